@@ -12,7 +12,16 @@ import matplotlib
 matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 from tqdm import tqdm
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import argparse
 import warnings
+from dataset_index import load_index
+from audio_gate import load_active_clip, SilentAudioError, SILENCE_DB
+from spectrogram_renderer import render_spectrogram, save_spectrogram_png
 warnings.filterwarnings('ignore')
 
 # ========== CONFIGURATION ==========
@@ -20,8 +29,11 @@ PROJECT_PATH = Path(r"C:\Users\sasik\OneDrive\Documents\AnimalVoicedetection")
 MINI_PROJECT_PATH = PROJECT_PATH / "mini_project"
 CSV_PATH = MINI_PROJECT_PATH / "sounds.csv"
 SPECTROGRAM_OUTPUT = PROJECT_PATH / "spectrograms_dataset"
-IMG_SIZE = (128, 128)  # Standard size for CNN input
-SAMPLE_LIMIT = 100  # Process first 100 samples
+SPECTROGRAM_CACHE = PROJECT_PATH / "spectrogram_cache"  # One subfolder per feature-parameter set
+IMG_SIZE = (128, 128)  # CNN input size (images are resized to it by step 2, not here)
+SAMPLE_LIMIT = 100  # Process first 100 samples (use --all for the full CSV)
+CSV_CHUNK_SIZE = 50000  # Rows read from sounds.csv at a time
+SAMPLE_SEED = 42
 
 # Audio processing parameters
 SAMPLE_RATE = 22050  # Standard sample rate
@@ -29,32 +41,304 @@ DURATION = 3  # Fixed duration in seconds
 N_MELS = 128  # Number of mel bands
 HOP_LENGTH = 512
 
+# Image rendering parameters
+FIGSIZE = (4, 4)
+DPI = 72
+CMAP = 'inferno'
+RENDERERS = ('specshow', 'lut')  # 'lut': NumPy/Pillow renderer with identical output, much faster
+DEFAULT_RENDERER = 'specshow'
+CACHE_DB_FILE = "cache.sqlite"  # Cache index, inside SPECTROGRAM_CACHE
+CACHE_COMMIT_EVERY = 500  # Cache index writes per SQLite transaction
+
+CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha1 TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS param_sets (
+    key TEXT PRIMARY KEY,
+    params TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS artifacts (
+    params_key TEXT NOT NULL,
+    source TEXT NOT NULL,
+    sha1 TEXT NOT NULL,
+    output TEXT NOT NULL,            -- relative to SPECTROGRAM_CACHE
+    PRIMARY KEY (params_key, source)
+);
+"""
+
 # Create output directory
 SPECTROGRAM_OUTPUT.mkdir(parents=True, exist_ok=True)
 
+def feature_params(renderer=DEFAULT_RENDERER):
+    """
+    Every setting that affects the generated images; part of the cache key. IMG_SIZE is not:
+    images are always rendered at FIGSIZE x DPI and resized to the model input when loaded.
+    """
+    return {
+        'sample_rate': SAMPLE_RATE,
+        'duration': DURATION,
+        'n_mels': N_MELS,
+        'hop_length': HOP_LENGTH,
+        'figsize': list(FIGSIZE),
+        'dpi': DPI,
+        'cmap': CMAP,
+        'renderer': renderer,
+        'window': 'energy',
+        'silence_db': SILENCE_DB,
+    }
+
+def params_key(params):
+    """Short stable key for a feature-parameter set"""
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:12]
+
+def file_sha1(path, chunk_size=1 << 20):
+    """Content hash of a file"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class SpectrogramCache:
+    """
+    Index of generated spectrograms keyed by source content hash + feature parameters.
+    Artifacts for each parameter set live in SPECTROGRAM_CACHE/<params key>/<label>/,
+    so several parameter sets can coexist and only missing/changed ones are recomputed.
+    The index is a SQLite table keyed by source path, so lookups and writes touch one
+    row and memory does not grow with the number of sources.
+    """
+
+    def __init__(self, root, params):
+        self.root = Path(root)
+        self.params = params
+        self.key = params_key(params)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.root / CACHE_DB_FILE)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(CACHE_SCHEMA)
+        self._import_json_manifest()
+        self.conn.execute("INSERT OR REPLACE INTO param_sets VALUES (?, ?)",
+                          (self.key, json.dumps(params, sort_keys=True)))
+        self.pending = 0
+
+    def _import_json_manifest(self):
+        """One-time migration of the manifest.json written by earlier versions"""
+        legacy = self.root / "manifest.json"
+        if not legacy.exists():
+            return
+        with open(legacy, 'r') as f:
+            manifest = json.load(f)
+        self.conn.executemany("INSERT OR IGNORE INTO sources VALUES (?, ?, ?, ?)",
+                              ((path, s['size'], s['mtime_ns'], s['sha1'])
+                               for path, s in manifest['sources'].items()))
+        self.conn.executemany("INSERT OR IGNORE INTO param_sets VALUES (?, ?)",
+                              ((key, json.dumps(p, sort_keys=True)) for key, p in manifest['param_sets'].items()))
+        self.conn.executemany("INSERT OR IGNORE INTO artifacts VALUES (?, ?, ?, ?)",
+                              ((key, source, a['sha1'], a['output'])
+                               for key, artifacts in manifest['artifacts'].items()
+                               for source, a in artifacts.items()))
+        self.conn.commit()
+        os.remove(legacy)
+
+    @property
+    def set_dir(self):
+        return self.root / self.key
+
+    def source_hash(self, audio_path):
+        """Content hash of a source file; re-hashed only when its size or mtime changed"""
+        st = os.stat(audio_path)
+        source = str(audio_path)
+        known = self.conn.execute("SELECT size, mtime_ns, sha1 FROM sources WHERE path = ?", (source,)).fetchone()
+        if known and known[0] == st.st_size and known[1] == st.st_mtime_ns:
+            return known[2]
+        sha1 = file_sha1(audio_path)
+        self.conn.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?)",
+                          (source, st.st_size, st.st_mtime_ns, sha1))
+        self._written()
+        return sha1
+
+    def artifact_path(self, label, filename):
+        return self.set_dir / label / f"{Path(filename).stem}_spec.png"
+
+    def lookup(self, audio_path, sha1):
+        """Cached artifact for this source + parameter set, or None if it must be (re)generated"""
+        entry = self.conn.execute("SELECT sha1, output FROM artifacts WHERE params_key = ? AND source = ?",
+                                  (self.key, str(audio_path))).fetchone()
+        if entry and entry[0] == sha1:
+            output = self.root / entry[1]
+            if output.exists():
+                return output
+        return None
+
+    def record(self, audio_path, sha1, output):
+        self.conn.execute("INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?)",
+                          (self.key, str(audio_path), sha1, Path(output).relative_to(self.root).as_posix()))
+        self._written()
+
+    def _written(self):
+        self.pending += 1
+        if self.pending >= CACHE_COMMIT_EVERY:
+            self.save()
+
+    def save(self):
+        """Commit pending index writes"""
+        self.conn.commit()
+        self.pending = 0
+
+    def close(self):
+        self.save()
+        self.conn.close()
+
+def dataset_params_key(output_dir):
+    """Parameter-set key recorded in output_dir/params.json, or None"""
+    try:
+        with open(Path(output_dir) / "params.json", 'r') as f:
+            return json.load(f).get('key')
+    except (FileNotFoundError, ValueError):
+        return None
+
+class DatasetBuilder:
+    """
+    Links the artifacts selected in this run into output_dir/<label>/ (hard links, or copies
+    where links are not supported) as soon as they are produced, so memory does not grow
+    with the number of rows.
+
+    By default they are merged into the existing dataset: earlier spectrograms stay, and
+    files with the same name are replaced. With replace=True the run builds a staging
+    folder and commit() swaps it in, so the dataset holds exactly this run's selection.
+    """
+
+    def __init__(self, output_dir, replace=False):
+        self.output_dir = Path(output_dir)
+        self.replace = replace
+        if replace:
+            self.root = self.output_dir.with_name(self.output_dir.name + ".tmp")
+            shutil.rmtree(self.root, ignore_errors=True)
+        else:
+            self.root = self.output_dir
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.labels = set()
+
+    def add(self, label, artifact):
+        label_dir = self.root / label
+        if label not in self.labels:
+            label_dir.mkdir(exist_ok=True)
+            self.labels.add(label)
+        target = label_dir / Path(artifact).name
+        try:
+            if os.path.samefile(artifact, target):
+                return  # Already linked (earlier run, or the same file twice in the CSV)
+        except FileNotFoundError:
+            pass
+        # Link under a temp name and rename, so an older image is replaced in one step
+        tmp_path = label_dir / f".{target.name}.tmp"
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+        try:
+            os.link(artifact, tmp_path)
+        except OSError:
+            shutil.copy2(artifact, tmp_path)
+        os.replace(tmp_path, target)
+
+    def commit(self, params):
+        """Write params.json; in replace mode, swap the staged dataset in for output_dir"""
+        tmp_path = self.root / "params.json.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'key': params_key(params), 'params': params}, f, indent=4)
+        os.replace(tmp_path, self.root / "params.json")
+        if not self.replace:
+            return
+        old = self.output_dir.with_name(self.output_dir.name + ".old")
+        shutil.rmtree(old, ignore_errors=True)
+        if self.output_dir.exists():
+            os.replace(self.output_dir, old)
+        os.replace(self.root, self.output_dir)
+        shutil.rmtree(old, ignore_errors=True)
+
+    def counts(self):
+        """Spectrograms per label in the committed dataset"""
+        counts = {}
+        with os.scandir(self.output_dir) as it:
+            for entry in it:
+                if entry.is_dir():
+                    with os.scandir(entry.path) as files:
+                        counts[entry.name] = sum(1 for f in files if f.name.endswith('.png'))
+        return counts
+
 def extract_label(filename):
     """Extract animal label from filename (e.g., 'Lion_1.wav' -> 'Lion')"""
     return filename.split('_')[0]
 
+def extract_labels(names):
+    """Vectorized extract_label over a pandas Series of filenames"""
+    return names.str.split('_', n=1).str[0]
+
+def iter_csv_rows(csv_path, limit=SAMPLE_LIMIT, per_class=None, chunk_size=CSV_CHUNK_SIZE, seed=SAMPLE_SEED):
+    """
+    Stream (filename, label) pairs from the CSV in chunks so memory stays flat.
+    limit: stop after this many rows (None = whole file)
+    per_class: uniform random sample of this many rows per class instead (stratified)
+    """
+    chunks = pd.read_csv(csv_path, usecols=['name'], chunksize=chunk_size)
+    
+    if per_class is None:
+        remaining = limit
+        for chunk in chunks:
+            if remaining is not None:
+                chunk = chunk.head(remaining)
+                remaining -= len(chunk)
+            yield from zip(chunk['name'], extract_labels(chunk['name']))
+            if remaining == 0:
+                return
+        return
+    
+    # Stratified sample: keep the per_class rows with the smallest random key for each class
+    rng = np.random.default_rng(seed)
+    kept = None
+    row_offset = 0
+    for chunk in chunks:
+        chunk = chunk.assign(
+            label=extract_labels(chunk['name']),
+            key=rng.random(len(chunk)),
+            row=np.arange(row_offset, row_offset + len(chunk))
+        )
+        row_offset += len(chunk)
+        kept = chunk if kept is None else pd.concat([kept, chunk], ignore_index=True)
+        kept = kept.sort_values('key').groupby('label', sort=False).head(per_class)
+    if kept is None:
+        return
+    kept = kept.sort_values(['label', 'row'])
+    yield from zip(kept['name'], kept['label'])
+
+def find_audio(audio_index, filename):
+    """
+    Path of a CSV row's file in mini_project/ or mini_project/data/, or None. Extensions
+    the index does not list are checked on disk, as before the index existed.
+    """
+    for rel in (filename, f"data/{filename}"):
+        if rel in audio_index:
+            return MINI_PROJECT_PATH / rel
+    if not filename.lower().endswith(audio_index.extensions):
+        for rel in (filename, f"data/{filename}"):
+            if (MINI_PROJECT_PATH / rel).exists():
+                return MINI_PROJECT_PATH / rel
+    return None
+
 def load_and_preprocess_audio(audio_path, target_sr=SAMPLE_RATE, duration=DURATION):
-    """Load audio file and preprocess to fixed length"""
+    """Load audio file, cut the most energetic fixed-length window (raises SilentAudioError)"""
     try:
-        # Load audio
-        y, sr = librosa.load(audio_path, sr=target_sr, duration=duration)
-        
-        # Pad or trim to fixed length
-        target_length = target_sr * duration
-        if len(y) < target_length:
-            y = np.pad(y, (0, target_length - len(y)), mode='constant')
-        else:
-            y = y[:target_length]
-        
-        return y, sr
+        return load_active_clip(audio_path, target_sr, duration)
+    except SilentAudioError:
+        raise
     except Exception as e:
         print(f"Error loading {audio_path}: {e}")
         return None, None
 
-def generate_mel_spectrogram(y, sr, save_path):
+def generate_mel_spectrogram(y, sr, save_path, renderer=DEFAULT_RENDERER):
     """Generate and save mel-spectrogram"""
     try:
         # Generate mel-spectrogram
@@ -69,8 +353,13 @@ def generate_mel_spectrogram(y, sr, save_path):
         # Convert to dB scale
         mel_spec_db = librosa.power_to_db(mel_spec, ref=np.max)
         
+        if renderer == 'lut':
+            image = render_spectrogram(mel_spec_db, sr, HOP_LENGTH, figsize=FIGSIZE, dpi=DPI)
+            save_spectrogram_png(image, save_path)
+            return True
+        
         # Create figure without axes for clean image
-        fig = plt.figure(figsize=(4, 4))
+        fig = plt.figure(figsize=FIGSIZE)
         ax = plt.Axes(fig, [0., 0., 1., 1.])
         ax.set_axis_off()
         fig.add_axes(ax)
@@ -82,12 +371,12 @@ def generate_mel_spectrogram(y, sr, save_path):
             hop_length=HOP_LENGTH,
             x_axis='time',
             y_axis='mel',
-            cmap='inferno',
+            cmap=CMAP,
             ax=ax
         )
         
         # Save figure
-        plt.savefig(save_path, dpi=72, bbox_inches='tight', pad_inches=0)
+        plt.savefig(save_path, dpi=DPI, bbox_inches='tight', pad_inches=0)
         plt.close()
         
         return True
@@ -96,7 +385,23 @@ def generate_mel_spectrogram(y, sr, save_path):
         plt.close()
         return False
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate spectrograms for CNN training")
+    parser.add_argument('--limit', type=int, default=SAMPLE_LIMIT,
+                        help=f"Process the first N rows of the CSV (default: {SAMPLE_LIMIT})")
+    parser.add_argument('--all', action='store_true', help="Process every row of the CSV")
+    parser.add_argument('--per-class', type=int, default=None,
+                        help="Random sample of N clips per class from the whole CSV (quick experiments)")
+    parser.add_argument('--chunk-size', type=int, default=CSV_CHUNK_SIZE, help="CSV rows read at a time")
+    parser.add_argument('--renderer', choices=RENDERERS, default=DEFAULT_RENDERER,
+                        help="Image renderer: matplotlib specshow or the faster lookup-table renderer")
+    parser.add_argument('--replace', action='store_true',
+                        help=f"Make {SPECTROGRAM_OUTPUT.name}/ exactly this run's selection (default: merge into it)")
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
+    
     print("=" * 60)
     print("STEP 1: GENERATING SPECTROGRAMS FOR CNN TRAINING")
     print("=" * 60)
@@ -106,72 +411,102 @@ def main():
         print(f"❌ CSV file not found: {CSV_PATH}")
         return
     
-    # Read CSV
-    df = pd.read_csv(CSV_PATH)
-    print(f"✅ Loaded CSV with {len(df)} entries")
+    # Stream the CSV instead of loading it whole
+    limit = None if args.all else args.limit
+    if args.per_class is not None:
+        print(f"📊 Sampling {args.per_class} clips per class from {CSV_PATH}")
+    elif limit is None:
+        print(f"📊 Processing every row of {CSV_PATH}")
+    else:
+        print(f"📊 Processing first {limit} rows of {CSV_PATH}")
+    rows = iter_csv_rows(CSV_PATH, limit=limit, per_class=args.per_class, chunk_size=args.chunk_size)
+    
+    # Spectrogram cache for the current feature-parameter set
+    cache = SpectrogramCache(SPECTROGRAM_CACHE, feature_params(args.renderer))
+    print(f"🗂️ Feature parameter set: {cache.key} ({cache.set_dir})")
+    
+    # Merging images of two parameter sets would give the CNN inconsistent inputs
+    existing_key = dataset_params_key(SPECTROGRAM_OUTPUT)
+    if not args.replace and existing_key not in (None, cache.key):
+        print(f"❌ {SPECTROGRAM_OUTPUT} holds parameter set {existing_key}, not {cache.key}.")
+        print("   Rerun with --replace to rebuild it from this run's rows.")
+        return
     
-    # Limit to first 100 samples
-    df = df.head(SAMPLE_LIMIT)
-    print(f"📊 Processing first {len(df)} samples")
+    # Animal classes are discovered as rows stream in
+    animals = []
     
-    # Get unique animal classes
-    df['label'] = df['name'].apply(extract_label)
-    animals = df['label'].unique()
-    print(f"🐾 Found {len(animals)} animal classes: {', '.join(animals)}")
+    # Index the audio folder once instead of probing paths per row (listing only, no header reads)
+    audio_index = load_index(MINI_PROJECT_PATH, probe=False)
+    print(f"📁 Indexed {len(audio_index)} audio files in {MINI_PROJECT_PATH}")
     
-    # Create directories for each animal class
-    for animal in animals:
-        (SPECTROGRAM_OUTPUT / animal).mkdir(parents=True, exist_ok=True)
+    # Selected artifacts are linked into the training dataset as they are produced
+    dataset = DatasetBuilder(SPECTROGRAM_OUTPUT, replace=args.replace)
     
     # Process each audio file
     success_count = 0
+    reused_count = 0
+    silent_count = 0
     fail_count = 0
     
     print("\n🎵 Processing audio files...")
-    for idx, row in tqdm(df.iterrows(), total=len(df), desc="Generating spectrograms"):
-        filename = row['name']
-        label = row['label']
-        
-        # Try to find the audio file in mini_project directory
-        audio_path = MINI_PROJECT_PATH / filename
-        
-        # If not found, try in data subdirectory
-        if not audio_path.exists():
-            audio_path = MINI_PROJECT_PATH / "data" / filename
+    for filename, label in tqdm(rows, desc="Generating spectrograms"):
+        if label not in animals:
+            animals.append(label)
+            (cache.set_dir / label).mkdir(parents=True, exist_ok=True)
         
-        # If still not found, skip
-        if not audio_path.exists():
+        # Try to find the audio file in mini_project directory, then in data subdirectory
+        audio_path = find_audio(audio_index, filename)
+        if audio_path is None:
+            # Not found, skip
             fail_count += 1
             continue
         
-        # Load and preprocess audio
-        y, sr = load_and_preprocess_audio(audio_path)
+        # Reuse the artifact if this exact source was rendered with these parameters
+        sha1 = cache.source_hash(audio_path)
+        cached = cache.lookup(audio_path, sha1)
+        if cached is not None:
+            dataset.add(label, cached)
+            reused_count += 1
+            continue
+        
+        # Load and preprocess audio; silent clips would only teach the model noise
+        try:
+            y, sr = load_and_preprocess_audio(audio_path)
+        except SilentAudioError:
+            silent_count += 1
+            continue
         if y is None:
             fail_count += 1
             continue
         
-        # Generate spectrogram filename
-        spec_filename = f"{Path(filename).stem}_spec.png"
-        save_path = SPECTROGRAM_OUTPUT / label / spec_filename
-        
         # Generate and save spectrogram
-        if generate_mel_spectrogram(y, sr, save_path):
+        save_path = cache.artifact_path(label, filename)
+        if generate_mel_spectrogram(y, sr, save_path, renderer=args.renderer):
+            cache.record(audio_path, sha1, save_path)
+            dataset.add(label, save_path)
             success_count += 1
         else:
             fail_count += 1
     
+    cache.close()
+    
+    # Expose the result as the training dataset
+    dataset.commit(cache.params)
+    
     # Summary
     print("\n" + "=" * 60)
     print("SUMMARY")
     print("=" * 60)
     print(f"✅ Successfully generated: {success_count} spectrograms")
+    print(f"♻️ Reused from cache: {reused_count} spectrograms")
+    print(f"🔇 Skipped as silent: {silent_count} files")
     print(f"❌ Failed: {fail_count} files")
     print(f"📁 Output directory: {SPECTROGRAM_OUTPUT}")
     
     # Print class distribution
-    print("\n📊 Class Distribution:")
-    for animal in animals:
-        count = len(list((SPECTROGRAM_OUTPUT / animal).glob("*.png")))
+    print(f"\n🐾 Found {len(animals)} animal classes in this run: {', '.join(animals)}")
+    print(f"\n📊 Class Distribution ({SPECTROGRAM_OUTPUT.name}/):")
+    for animal, count in sorted(dataset.counts().items()):
         print(f"  {animal}: {count} spectrograms")
     
     print("\n✅ Spectrogram generation complete!")
@@ -12,11 +12,21 @@ from pathlib import Path
 import numpy as np
 import matplotlib.pyplot as plt
 import json
+import os
+import pickle
+import random
+import shutil
+import argparse
 from datetime import datetime
+import pandas as pd
+from dataset_index import DatasetIndex, IMAGE_EXTENSIONS, load_index
+from augment import BatchAugmenter, load_waveform_cache, load_noise_bank
 
 # ========== CONFIGURATION ==========
 PROJECT_PATH = Path(r"C:\Users\sasik\OneDrive\Documents\AnimalVoicedetection")
 SPECTROGRAM_PATH = PROJECT_PATH / "spectrograms_dataset"
+AUDIO_PATH = PROJECT_PATH / "mini_project"  # Source clips of the spectrograms (for --augment audio)
+WAVEFORM_CACHE = PROJECT_PATH / "waveform_cache"
 MODEL_OUTPUT_PATH = PROJECT_PATH / "trained_model"
 MODEL_OUTPUT_PATH.mkdir(parents=True, exist_ok=True)
 
@@ -27,11 +37,37 @@ EPOCHS = 50
 VALIDATION_SPLIT = 0.2
 LEARNING_RATE = 0.001
 
+# Augmentation: 'audio' augments source waveforms/log-mels in batches, 'image' transforms the PNGs
+AUGMENT_MODES = ('audio', 'image')
+DEFAULT_AUGMENT = 'audio'
+AUGMENT_WORKERS = 2  # Threads preparing augmented batches ahead of the trainer
+
+# Audio parameters (must match 1_generate_spectrograms.py)
+SAMPLE_RATE = 22050
+DURATION = 3
+N_MELS = 128
+HOP_LENGTH = 512
+
 # Model save paths
 MODEL_FILE = MODEL_OUTPUT_PATH / "animal_sound_classifier.h5"
+SERVING_MODEL_FILE = MODEL_OUTPUT_PATH / "best_model.h5"  # Copy loaded by app.py, 3_predict.py and the job workers
 HISTORY_FILE = MODEL_OUTPUT_PATH / "training_history.json"
 CLASS_LABELS_FILE = MODEL_OUTPUT_PATH / "class_labels.json"
 
+# Full-state checkpoints (for --resume)
+CHECKPOINT_DIR = MODEL_OUTPUT_PATH / "checkpoints"
+CHECKPOINT_MODEL_FILE = CHECKPOINT_DIR / "last_model.keras"
+CHECKPOINT_STATE_FILE = CHECKPOINT_DIR / "last_state.pkl"
+CHECKPOINT_EVERY = 1  # Save full training state every N epochs
+SEED = 42
+
+# Callback attributes that make up their internal schedule state
+CALLBACK_STATE_ATTRS = {
+    'ModelCheckpoint': ['best'],
+    'EarlyStopping': ['wait', 'stopped_epoch', 'best', 'best_weights', 'best_epoch'],
+    'ReduceLROnPlateau': ['wait', 'cooldown_counter', 'best'],
+}
+
 def build_cnn_model(input_shape, num_classes):
     """
     Build CNN architecture for audio classification
@@ -88,6 +124,193 @@ def build_cnn_model(input_shape, num_classes):
     
     return model
 
+def _atomic_write_bytes(path, data):
+    """Write bytes to path via a temp file so a crash never leaves a partial file"""
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+class FullStateCheckpoint(keras.callbacks.Callback):
+    """
+    Periodically save everything needed to continue training exactly:
+    model + optimizer, epoch, history, callback schedules, RNG and data pipeline position.
+    Must be the last callback so its restore runs after the others reset themselves.
+    """
+
+    def __init__(self, train_generator, tracked_callbacks, every=CHECKPOINT_EVERY, resume_state=None):
+        super().__init__()
+        self.train_generator = train_generator
+        self.tracked_callbacks = tracked_callbacks
+        self.every = every
+        self.resume_state = resume_state
+        self.history = dict(resume_state['history']) if resume_state else {}
+
+    def on_train_begin(self, logs=None):
+        if self.resume_state is None:
+            return
+        state = self.resume_state
+
+        # Callback schedules (EarlyStopping patience, ReduceLROnPlateau cooldown, best metric)
+        for cb in self.tracked_callbacks:
+            for attr, value in state['callbacks'].get(type(cb).__name__, {}).items():
+                setattr(cb, attr, value)
+
+        # Learning rate as left by ReduceLROnPlateau
+        self.model.optimizer.learning_rate.assign(state['learning_rate'])
+
+        # RNG and input pipeline position
+        random.setstate(state['python_rng'])
+        np.random.set_state(state['numpy_rng'])
+        self.train_generator.total_batches_seen = state['total_batches_seen']
+        print(f"🔁 Restored training state from epoch {state['epoch']}")
+
+    def on_epoch_begin(self, epoch, logs=None):
+        # Per-epoch TF seed so dropout/shuffle ops do not depend on how many epochs ran in this process
+        tf.random.set_seed(SEED + epoch)
+
+    def on_epoch_end(self, epoch, logs=None):
+        for key, value in (logs or {}).items():
+            self.history.setdefault(key, []).append(float(value))
+        if (epoch + 1) % self.every == 0 or self.model.stop_training:
+            self.save(epoch + 1)
+
+    def save(self, completed_epochs):
+        """Save model + optimizer and the rest of the training state"""
+        CHECKPOINT_DIR.mkdir(parents=True, exist_ok=True)
+
+        tmp_model = CHECKPOINT_MODEL_FILE.with_name("tmp_" + CHECKPOINT_MODEL_FILE.name)
+        self.model.save(tmp_model)
+        os.replace(tmp_model, CHECKPOINT_MODEL_FILE)
+
+        callbacks_state = {}
+        for cb in self.tracked_callbacks:
+            attrs = CALLBACK_STATE_ATTRS.get(type(cb).__name__, [])
+            callbacks_state[type(cb).__name__] = {a: getattr(cb, a) for a in attrs if hasattr(cb, a)}
+
+        state = {
+            'epoch': completed_epochs,
+            'stopped': bool(self.model.stop_training),
+            'history': self.history,
+            'callbacks': callbacks_state,
+            'learning_rate': float(keras.backend.get_value(self.model.optimizer.learning_rate)),
+            'python_rng': random.getstate(),
+            'numpy_rng': np.random.get_state(),
+            'total_batches_seen': self.train_generator.total_batches_seen,
+            'saved_at': datetime.now().isoformat(),
+        }
+        _atomic_write_bytes(CHECKPOINT_STATE_FILE, pickle.dumps(state))
+        print(f"\n💾 Full training state saved (epoch {completed_epochs}): {CHECKPOINT_DIR}")
+
+def seed_shuffle_by_epoch(iterator, seed=SEED):
+    """
+    Make an image iterator's shuffle order a function of (seed, epoch). Keras draws it from the
+    global NumPy RNG, whose state at an epoch boundary is not part of the checkpoint, so a
+    resumed run would otherwise see different batches than an uninterrupted one.
+    """
+    def set_index_array():
+        seen = iterator.total_batches_seen
+        if iterator.index_array is None:
+            seen -= 1  # First batch in this process: __getitem__ has already counted it
+        epoch = seen // len(iterator)
+        iterator.index_array = np.random.default_rng([seed, epoch]).permutation(iterator.n)
+    iterator._set_index_array = set_index_array
+    return iterator
+
+class AugmentedAudioSequence(keras.utils.PyDataset):
+    """
+    Training batches built from cached waveforms: shuffle, then augment the whole batch
+    at once (shift, gain, noise, SpecAugment) and render it exactly like the training PNGs.
+    Randomness is derived from (seed, epoch, batch), so batches don't depend on worker timing.
+    """
+
+    def __init__(self, waveforms, rows, labels, classes, augmenter, batch_size=BATCH_SIZE, seed=SEED,
+                 workers=AUGMENT_WORKERS):
+        super().__init__(workers=workers, use_multiprocessing=False)
+        self.waveforms = waveforms
+        self.rows = np.asarray(rows)  # Ascending rows of waveforms used for training
+        self.labels = np.asarray(labels)
+        self.num_classes = len(classes)
+        self.class_indices = {c: i for i, c in enumerate(classes)}
+        self.augmenter = augmenter
+        self.batch_size = batch_size
+        self.seed = seed
+        self.epoch = 0
+        self.samples = len(self.labels)
+
+    def __len__(self):
+        return int(np.ceil(self.samples / self.batch_size))
+
+    @property
+    def total_batches_seen(self):
+        # Same attribute as the image iterators, so FullStateCheckpoint can save/restore the position
+        return self.epoch * len(self)
+
+    @total_batches_seen.setter
+    def total_batches_seen(self, value):
+        self.epoch = value // len(self)
+
+    def __getitem__(self, idx):
+        order = np.random.default_rng([self.seed, self.epoch]).permutation(self.samples)
+        batch = np.sort(order[idx * self.batch_size:(idx + 1) * self.batch_size])  # Sorted: sequential memmap reads
+        rng = np.random.default_rng([self.seed, self.epoch, idx])
+        x = self.augmenter(np.asarray(self.waveforms[self.rows[batch]]), rng)
+        y = np.eye(self.num_classes, dtype=np.float32)[self.labels[batch]]
+        return x, y
+
+    def on_epoch_end(self):
+        self.epoch += 1
+
+def audio_training_data(train_df, classes, noise_dir=None):
+    """
+    Source clip of every training spectrogram (<stem>_spec.png <- <stem>.<ext>) as
+    (waveforms memmap, usable rows, their label indices, augmenter); None when the source
+    audio is not available
+    """
+    if not AUDIO_PATH.exists():
+        return None
+    audio_by_stem = {Path(e.path).stem: e.path for e in load_index(AUDIO_PATH, probe=False).entries()}
+    stems = train_df['filename'].map(lambda p: Path(p).stem.removesuffix('_spec'))
+    found = stems.isin(audio_by_stem.keys())
+    if not found.any():
+        return None
+    if not found.all():
+        print(f"⚠️ Source audio missing for {int((~found).sum())} training spectrograms; they are left out")
+    
+    waveforms, ok = load_waveform_cache([audio_by_stem[s] for s in stems[found]], WAVEFORM_CACHE, SAMPLE_RATE, DURATION)
+    labels = train_df['class'][found].map({c: i for i, c in enumerate(classes)}).to_numpy()
+    keep = np.flatnonzero(ok)
+    if len(keep) < len(ok):
+        print(f"⚠️ {len(ok) - len(keep)} source clips could not be decoded or are silent; they are left out")
+    
+    noise_bank = load_noise_bank(noise_dir, SAMPLE_RATE) if noise_dir else None
+    if noise_dir:
+        print(f"🔊 Background noise: {noise_dir} ({0 if noise_bank is None else len(noise_bank) / SAMPLE_RATE:.0f} s)")
+    augmenter = BatchAugmenter(SAMPLE_RATE, N_MELS, HOP_LENGTH, IMG_SIZE, noise_bank=noise_bank)
+    return waveforms, keep, labels[keep], augmenter
+
+def load_checkpoint_state():
+    """Load the last full-state checkpoint, or None if there is nothing to resume"""
+    if not (CHECKPOINT_MODEL_FILE.exists() and CHECKPOINT_STATE_FILE.exists()):
+        return None
+    with open(CHECKPOINT_STATE_FILE, 'rb') as f:
+        return pickle.load(f)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Train the animal sound CNN")
+    parser.add_argument('--resume', action='store_true',
+                        help=f"Continue from the last full-state checkpoint in {CHECKPOINT_DIR}")
+    parser.add_argument('--checkpoint-every', type=int, default=CHECKPOINT_EVERY,
+                        help="Save full training state every N epochs")
+    parser.add_argument('--augment', choices=AUGMENT_MODES, default=DEFAULT_AUGMENT,
+                        help="'audio': batched waveform/log-mel augmentation from the source clips "
+                             "(falls back to 'image' when they are missing); 'image': PNG transforms")
+    parser.add_argument('--noise-dir', type=Path, default=None,
+                        help="Background recordings mixed into training clips (default: white noise)")
+    return parser.parse_args()
+
 def plot_training_history(history, save_path):
     """Plot and save training history"""
     fig, axes = plt.subplots(1, 2, figsize=(15, 5))
@@ -116,9 +339,26 @@ def plot_training_history(history, save_path):
     print(f"✅ Training history plot saved: {save_path}")
 
 def main():
+    args = parse_args()
+
     print("=" * 60)
     print("STEP 2: TRAINING CNN MODEL")
     print("=" * 60)
+
+    # Look for a checkpoint to resume from
+    resume_state = None
+    if args.resume:
+        resume_state = load_checkpoint_state()
+        if resume_state is None:
+            print(f"⚠️ No checkpoint found in {CHECKPOINT_DIR}, starting from scratch")
+        elif resume_state['stopped'] or resume_state['epoch'] >= EPOCHS:
+            print(f"✅ Checkpointed run already finished at epoch {resume_state['epoch']}")
+            return
+        else:
+            print(f"🔁 Resuming from epoch {resume_state['epoch']}/{EPOCHS}")
+    else:
+        random.seed(SEED)
+        np.random.seed(SEED)
     
     # Check if spectrogram directory exists
     if not SPECTROGRAM_PATH.exists():
@@ -126,8 +366,15 @@ def main():
         print("Please run '1_generate_spectrograms.py' first!")
         return
     
+    # Index spectrograms once (incremental, persisted manifest)
+    spec_index = DatasetIndex(SPECTROGRAM_PATH, IMAGE_EXTENSIONS, label_from='parent', probe=False).refresh()
+    spec_df = pd.DataFrame(
+        [(e.path, e.label) for e in spec_index.entries() if e.label],
+        columns=['filename', 'class']
+    )
+    
     # Count classes and samples
-    classes = [d.name for d in SPECTROGRAM_PATH.iterdir() if d.is_dir()]
+    classes = spec_index.labels()
     num_classes = len(classes)
     
     if num_classes == 0:
@@ -137,51 +384,72 @@ def main():
     print(f"🐾 Found {num_classes} animal classes: {', '.join(classes)}")
     
     # Count total spectrograms
-    total_spectrograms = sum(len(list((SPECTROGRAM_PATH / cls).glob("*.png"))) for cls in classes)
+    total_spectrograms = len(spec_df)
+    
+    # Per-class split: the first VALIDATION_SPLIT of each class (sorted by name) is held out,
+    # the same files flow_from_directory used to pick
+    class_position = spec_df.groupby('class').cumcount()
+    class_size = spec_df.groupby('class')['class'].transform('size')
+    is_validation = class_position < (class_size * VALIDATION_SPLIT).astype(int)
+    train_df = spec_df[~is_validation]
+    val_df = spec_df[is_validation]
     print(f"📊 Total spectrograms: {total_spectrograms}")
     
     if total_spectrograms < 10:
         print("❌ Not enough spectrograms for training!")
         return
     
-    # Data augmentation for training
-    train_datagen = ImageDataGenerator(
-        rescale=1./255,
-        validation_split=VALIDATION_SPLIT,
-        rotation_range=10,
-        width_shift_range=0.1,
-        height_shift_range=0.1,
-        horizontal_flip=True,
-        zoom_range=0.1,
-        fill_mode='nearest'
-    )
+    # Create training generator
+    print("\n📁 Loading training data...")
+    audio_data = audio_training_data(train_df, classes, args.noise_dir) if args.augment == 'audio' else None
+    if args.augment == 'audio' and audio_data is None:
+        print(f"⚠️ Source audio not found in {AUDIO_PATH}; using image augmentation")
+    
+    if audio_data is not None:
+        waveforms, rows, labels, augmenter = audio_data
+        train_generator = AugmentedAudioSequence(waveforms, rows, labels, classes, augmenter)
+        print(f"Found {train_generator.samples} source clips (waveform augmentation)")
+    else:
+        # Data augmentation for training
+        train_datagen = ImageDataGenerator(
+            rescale=1./255,
+            rotation_range=10,
+            width_shift_range=0.1,
+            height_shift_range=0.1,
+            horizontal_flip=True,
+            zoom_range=0.1,
+            fill_mode='nearest'
+        )
+        train_generator = train_datagen.flow_from_dataframe(
+            train_df,
+            x_col='filename',
+            y_col='class',
+            classes=classes,
+            validate_filenames=False,
+            target_size=IMG_SIZE,
+            batch_size=BATCH_SIZE,
+            class_mode='categorical',
+            shuffle=True,
+            seed=42
+        )
+        seed_shuffle_by_epoch(train_generator)
     
     # Validation data (no augmentation)
     val_datagen = ImageDataGenerator(
-        rescale=1./255,
-        validation_split=VALIDATION_SPLIT
-    )
-    
-    # Create training generator
-    print("\n📁 Loading training data...")
-    train_generator = train_datagen.flow_from_directory(
-        SPECTROGRAM_PATH,
-        target_size=IMG_SIZE,
-        batch_size=BATCH_SIZE,
-        class_mode='categorical',
-        subset='training',
-        shuffle=True,
-        seed=42
+        rescale=1./255
     )
     
     # Create validation generator
     print("📁 Loading validation data...")
-    validation_generator = val_datagen.flow_from_directory(
-        SPECTROGRAM_PATH,
+    validation_generator = val_datagen.flow_from_dataframe(
+        val_df,
+        x_col='filename',
+        y_col='class',
+        classes=classes,
+        validate_filenames=False,
         target_size=IMG_SIZE,
         batch_size=BATCH_SIZE,
         class_mode='categorical',
-        subset='validation',
         shuffle=False,
         seed=42
     )
@@ -192,17 +460,22 @@ def main():
         json.dump(class_labels, f, indent=4)
     print(f"✅ Class labels saved: {CLASS_LABELS_FILE}")
     
-    # Build model
-    print("\n🏗️ Building CNN model...")
-    input_shape = (*IMG_SIZE, 3)
-    model = build_cnn_model(input_shape, num_classes)
-    
-    # Compile model
-    model.compile(
-        optimizer=keras.optimizers.Adam(learning_rate=LEARNING_RATE),
-        loss='categorical_crossentropy',
-        metrics=['accuracy']
-    )
+    if resume_state is not None:
+        # Model, weights and optimizer state come from the checkpoint
+        print("\n🏗️ Loading checkpointed model...")
+        model = keras.models.load_model(CHECKPOINT_MODEL_FILE)
+    else:
+        # Build model
+        print("\n🏗️ Building CNN model...")
+        input_shape = (*IMG_SIZE, 3)
+        model = build_cnn_model(input_shape, num_classes)
+        
+        # Compile model
+        model.compile(
+            optimizer=keras.optimizers.Adam(learning_rate=LEARNING_RATE),
+            loss='categorical_crossentropy',
+            metrics=['accuracy']
+        )
     
     # Print model summary
     print("\n📋 Model Architecture:")
@@ -235,10 +508,18 @@ def main():
             verbose=1
         )
     ]
+    state_checkpoint = FullStateCheckpoint(
+        train_generator,
+        tracked_callbacks=callbacks,
+        every=args.checkpoint_every,
+        resume_state=resume_state
+    )
+    callbacks.append(state_checkpoint)
+    initial_epoch = resume_state['epoch'] if resume_state else 0
     
     # Train model
     print("\n🚀 Starting training...")
-    print(f"Epochs: {EPOCHS}")
+    print(f"Epochs: {EPOCHS} (starting at {initial_epoch})")
     print(f"Batch size: {BATCH_SIZE}")
     print(f"Training samples: {train_generator.samples}")
     print(f"Validation samples: {validation_generator.samples}")
@@ -247,17 +528,19 @@ def main():
     history = model.fit(
         train_generator,
         epochs=EPOCHS,
+        initial_epoch=initial_epoch,
         validation_data=validation_generator,
         callbacks=callbacks,
         verbose=1
     )
     
-    # Save training history
+    # Save training history (including epochs from before a resume)
+    full_history = state_checkpoint.history
     history_dict = {
-        'accuracy': [float(x) for x in history.history['accuracy']],
-        'val_accuracy': [float(x) for x in history.history['val_accuracy']],
-        'loss': [float(x) for x in history.history['loss']],
-        'val_loss': [float(x) for x in history.history['val_loss']]
+        'accuracy': full_history['accuracy'],
+        'val_accuracy': full_history['val_accuracy'],
+        'loss': full_history['loss'],
+        'val_loss': full_history['val_loss']
     }
     
     with open(HISTORY_FILE, 'w') as f:
@@ -274,11 +557,18 @@ def main():
     print(f"Validation Loss: {val_loss:.4f}")
     print(f"Validation Accuracy: {val_accuracy:.4f} ({val_accuracy*100:.2f}%)")
     
+    # The web server and 3_predict.py load best_model.h5, 4_batch_predict.py loads MODEL_FILE;
+    # both get a fast-loading serving export, so every entry point starts from one
+    from model_export import export_model
+    shutil.copy2(MODEL_FILE, SERVING_MODEL_FILE)
+    serving_exports = [export_model(path) for path in (MODEL_FILE, SERVING_MODEL_FILE)]
+    
     # Summary
     print("\n" + "=" * 60)
     print("TRAINING COMPLETE!")
     print("=" * 60)
-    print(f"✅ Model saved: {MODEL_FILE}")
+    print(f"✅ Model saved: {MODEL_FILE} (copy: {SERVING_MODEL_FILE.name})")
+    print(f"✅ Serving exports: {', '.join(str(p) for p in serving_exports)}")
     print(f"✅ Class labels: {CLASS_LABELS_FILE}")
     print(f"✅ Training history: {HISTORY_FILE}")
     print(f"✅ Training plot: {plot_path}")
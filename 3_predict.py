@@ -1,25 +1,29 @@
 """
 Step 3: Predict Animal Sound from Audio File
 This script takes a new audio file and predicts which animal it belongs to
+
+Warm daemon mode keeps the model loaded behind a local Unix socket:
+    python 3_predict.py --daemon        # start once
+    python 3_predict.py clip.wav        # uses the daemon if it is running, else runs in-process
 """
 
-import tensorflow as tf
-from tensorflow import keras
-import librosa
-import librosa.display
-import numpy as np
-import matplotlib
-matplotlib.use("Agg")
-import matplotlib.pyplot as plt
 from pathlib import Path
+import argparse
 import json
+import socket
+import socketserver
 import sys
+import tempfile
+
+# NumPy and the thread profile are set up by import_runtime() only when this process
+# scores audio itself, so the daemon client path stays lightweight; TensorFlow is
+# imported by the model loader and matplotlib not at all (in-memory renderer)
+np = None
 
 # ========== CONFIGURATION ==========
 PROJECT_PATH = Path(r"C:\Users\sasik\OneDrive\Documents\AnimalVoicedetection")
 MODEL_PATH = PROJECT_PATH / "trained_model" / "best_model.h5"  # Updated to match pipeline output
 CLASS_LABELS_PATH = PROJECT_PATH / "trained_model" / "class_labels.json"
-TEMP_SPEC_PATH = PROJECT_PATH / "temp_spectrogram.png"
 
 # Audio parameters (must match training)
 SAMPLE_RATE = 22050
@@ -28,8 +32,25 @@ N_MELS = 128
 HOP_LENGTH = 512
 IMG_SIZE = (128, 128)
 
+# Daemon settings
+DAEMON_SOCKET_PATH = Path(tempfile.gettempdir()) / "animal_sound_predict.sock"
+DAEMON_CONNECT_TIMEOUT = 0.5  # Seconds to wait for a running daemon before falling back
+DAEMON_REQUEST_TIMEOUT = 120
+
+def import_runtime():
+    """Import the libraries needed for in-process prediction"""
+    global np
+    if np is not None:
+        return
+    from thread_tuning import apply_thread_profile
+    apply_thread_profile('latency')  # Before TensorFlow is imported
+    import numpy as _np
+    np = _np
+
 def load_model_and_labels():
     """Load trained model and class labels"""
+    import_runtime()
+    
     if not MODEL_PATH.exists():
         print(f"❌ Model not found: {MODEL_PATH}")
         print("Please run '2_train_model.py' first!")
@@ -39,8 +60,9 @@ def load_model_and_labels():
         print(f"❌ Class labels not found: {CLASS_LABELS_PATH}")
         return None, None
     
-    # Load model
-    model = keras.models.load_model(MODEL_PATH)
+    # Load model (fast-loading export when fresh)
+    from model_export import load_inference_model
+    model = load_inference_model(MODEL_PATH)
     print(f"✅ Model loaded: {MODEL_PATH}")
     
     # Load class labels
@@ -51,102 +73,49 @@ def load_model_and_labels():
     return model, class_labels
 
 def load_and_preprocess_audio(audio_path, target_sr=SAMPLE_RATE, duration=DURATION):
-    """Load and preprocess audio file"""
+    """Load audio and cut its most energetic fixed-length window (raises SilentAudioError)"""
+    from audio_gate import load_active_clip, SilentAudioError
     try:
         print(f"🎵 Loading audio: {audio_path}")
         
-        # Load audio
-        y, sr = librosa.load(audio_path, sr=target_sr, duration=duration)
-        
-        # Pad or trim to fixed length
-        target_length = target_sr * duration
-        if len(y) < target_length:
-            y = np.pad(y, (0, target_length - len(y)), mode='constant')
-        else:
-            y = y[:target_length]
+        # Load audio, gate silence and pick the loudest window
+        y, sr = load_active_clip(audio_path, target_sr, duration)
         
         print(f"✅ Audio loaded: {len(y)} samples, {sr} Hz")
         return y, sr
+    except SilentAudioError:
+        raise
     except Exception as e:
         print(f"❌ Error loading audio: {e}")
         return None, None
 
-def generate_spectrogram_image(y, sr, save_path):
-    """Generate spectrogram and save as image"""
-    try:
-        # Generate mel-spectrogram
-        mel_spec = librosa.feature.melspectrogram(
-            y=y, 
-            sr=sr, 
-            n_mels=N_MELS,
-            hop_length=HOP_LENGTH,
-            fmax=sr//2
-        )
-        
-        # Convert to dB scale
-        mel_spec_db = librosa.power_to_db(mel_spec, ref=np.max)
-        
-        # Create figure without axes
-        fig = plt.figure(figsize=(4, 4))
-        ax = plt.Axes(fig, [0., 0., 1., 1.])
-        ax.set_axis_off()
-        fig.add_axes(ax)
-        
-        # Plot spectrogram
-        librosa.display.specshow(
-            mel_spec_db,
-            sr=sr,
-            hop_length=HOP_LENGTH,
-            x_axis='time',
-            y_axis='mel',
-            cmap='inferno',
-            ax=ax
-        )
-        
-        # Save
-        plt.savefig(save_path, dpi=72, bbox_inches='tight', pad_inches=0)
-        plt.close()
-        
-        print(f"✅ Spectrogram generated: {save_path}")
-        return True
-    except Exception as e:
-        print(f"❌ Error generating spectrogram: {e}")
-        plt.close()
-        return False
-
-def load_and_preprocess_image(image_path, target_size=IMG_SIZE):
-    """Load and preprocess spectrogram image for model"""
+def generate_model_input(y, sr):
+    """Spectrogram model input (1, H, W, 3), rendered in memory exactly like the training images"""
+    from spectrogram_renderer import clip_to_model_input
     try:
-        # Load image
-        img = keras.preprocessing.image.load_img(image_path, target_size=target_size)
-        
-        # Convert to array
-        img_array = keras.preprocessing.image.img_to_array(img)
-        
-        # Normalize
-        img_array = img_array / 255.0
-        
-        # Add batch dimension
-        img_array = np.expand_dims(img_array, axis=0)
-        
+        img_array = clip_to_model_input(y, sr, N_MELS, HOP_LENGTH, IMG_SIZE)[np.newaxis]
+        print("✅ Spectrogram generated")
         return img_array
     except Exception as e:
-        print(f"❌ Error loading image: {e}")
+        print(f"❌ Error generating spectrogram: {e}")
         return None
 
 def predict_animal(audio_path, model, class_labels, show_probabilities=True):
     """Predict animal from audio file"""
-    # Load and preprocess audio
-    y, sr = load_and_preprocess_audio(audio_path)
+    from audio_gate import SilentAudioError
+    
+    # Load and preprocess audio; silent clips are reported without running the model
+    try:
+        y, sr = load_and_preprocess_audio(audio_path)
+    except SilentAudioError:
+        result = {'no_sound': True, 'predicted_animal': None, 'confidence': 0.0, 'all_probabilities': {}}
+        print_prediction(result, show_probabilities)
+        return result
     if y is None:
         return None
     
     # Generate spectrogram
-    if not generate_spectrogram_image(y, sr, TEMP_SPEC_PATH):
-        return None
-    
-    # Load spectrogram image
-    img_array = load_and_preprocess_image(TEMP_SPEC_PATH)
+    img_array = generate_model_input(y, sr)
     if img_array is None:
         return None
     
@@ -157,49 +126,148 @@ def predict_animal(audio_path, model, class_labels, show_probabilities=True):
     predicted_class = class_labels[str(predicted_class_idx)]
     confidence = predictions[0][predicted_class_idx] * 100
     
-    # Clean up temp file
-    if TEMP_SPEC_PATH.exists():
-        TEMP_SPEC_PATH.unlink()
+    result = {
+        'predicted_animal': predicted_class,
+        'confidence': float(confidence),
+        'all_probabilities': {class_labels[str(i)]: float(predictions[0][i]) * 100 
+                             for i in range(len(class_labels))}
+    }
     
     # Display results
+    print_prediction(result, show_probabilities)
+    
+    return result
+
+def print_prediction(result, show_probabilities=True):
+    """Print a prediction result (also used for results coming back from the daemon)"""
     print("\n" + "=" * 60)
     print("PREDICTION RESULTS")
     print("=" * 60)
-    print(f"🐾 Predicted Animal: {predicted_class}")
-    print(f"🎯 Confidence: {confidence:.2f}%")
+    if result.get('no_sound'):
+        print("🔇 No sound detected - nothing to classify")
+        print("=" * 60)
+        return
+    print(f"🐾 Predicted Animal: {result['predicted_animal']}")
+    print(f"🎯 Confidence: {result['confidence']:.2f}%")
     
     if show_probabilities:
         print("\n📊 All Class Probabilities:")
         # Sort by probability
-        sorted_indices = np.argsort(predictions[0])[::-1]
-        for idx in sorted_indices:
-            animal = class_labels[str(idx)]
-            prob = predictions[0][idx] * 100
+        sorted_probs = sorted(result['all_probabilities'].items(), key=lambda x: x[1], reverse=True)
+        for animal, prob in sorted_probs:
             bar = "█" * int(prob / 2)
             print(f"  {animal:15s} {prob:6.2f}% {bar}")
     
     print("=" * 60)
+
+# ========== DAEMON ==========
+class PredictionRequestHandler(socketserver.StreamRequestHandler):
+    """One JSON request line in ({"path": ...}), one JSON response line out"""
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            result = predict_animal(Path(request['path']), self.server.model, self.server.class_labels,
+                                    show_probabilities=False)
+            response = {'ok': result is not None, 'result': result}
+            if result is None:
+                response['error'] = f"Prediction failed for {request['path']}"
+        except Exception as e:
+            response = {'ok': False, 'error': str(e)}
+        self.wfile.write((json.dumps(response) + "\n").encode('utf-8'))
+
+def run_daemon(socket_path=DAEMON_SOCKET_PATH):
+    """Keep the model loaded and serve predictions on a local Unix socket"""
+    if not hasattr(socket, 'AF_UNIX'):
+        print("❌ Unix sockets are not available on this platform")
+        return
     
-    return {
-        'predicted_animal': predicted_class,
-        'confidence': confidence,
-        'all_probabilities': {class_labels[str(i)]: float(predictions[0][i]) * 100 
-                             for i in range(len(class_labels))}
-    }
+    model, class_labels = load_model_and_labels()
+    if model is None or class_labels is None:
+        return
+    
+    # Remove a stale socket left by a daemon that did not shut down cleanly
+    if socket_path.exists():
+        if daemon_is_running(socket_path):
+            print(f"❌ A daemon is already listening on {socket_path}")
+            return
+        socket_path.unlink()
+    
+    with socketserver.UnixStreamServer(str(socket_path), PredictionRequestHandler) as server:
+        server.model = model
+        server.class_labels = class_labels
+        print(f"\n✅ Prediction daemon ready on {socket_path} (Ctrl+C to stop)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print("\n👋 Daemon stopped")
+        finally:
+            if socket_path.exists():
+                socket_path.unlink()
+
+def daemon_is_running(socket_path=DAEMON_SOCKET_PATH):
+    """True if something accepts connections on the daemon socket"""
+    if not hasattr(socket, 'AF_UNIX') or not socket_path.exists():
+        return False
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(DAEMON_CONNECT_TIMEOUT)
+            sock.connect(str(socket_path))
+        return True
+    except OSError:
+        return False
+
+def predict_via_daemon(audio_path, socket_path=DAEMON_SOCKET_PATH):
+    """
+    Send the file path to a running daemon.
+    Returns the response dict, or None when no daemon is reachable.
+    """
+    if not hasattr(socket, 'AF_UNIX') or not socket_path.exists():
+        return None
+    try:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(DAEMON_CONNECT_TIMEOUT)
+        sock.connect(str(socket_path))
+    except OSError:
+        return None
+    # A daemon that stalls, drops the connection or answers garbage is treated as absent
+    try:
+        with sock:
+            sock.settimeout(DAEMON_REQUEST_TIMEOUT)
+            request = {'path': str(Path(audio_path).resolve())}
+            sock.sendall((json.dumps(request) + "\n").encode('utf-8'))
+            with sock.makefile('rb') as f:
+                line = f.readline()
+        return json.loads(line) if line else None
+    except (OSError, ValueError):
+        return None
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Predict the animal in an audio file")
+    parser.add_argument('audio_file', nargs='?', help="Audio file (.wav, .mp3, .flac, .ogg)")
+    parser.add_argument('--daemon', action='store_true',
+                        help=f"Keep the model loaded and serve requests on {DAEMON_SOCKET_PATH}")
+    parser.add_argument('--no-daemon', action='store_true',
+                        help="Always predict in this process, even if a daemon is running")
+    return parser.parse_args()
 
 def main():
+    args = parse_args()
+    
+    if args.daemon:
+        print("=" * 60)
+        print("ANIMAL SOUND CLASSIFIER - PREDICTION DAEMON")
+        print("=" * 60)
+        run_daemon()
+        return
+    
     print("=" * 60)
     print("ANIMAL SOUND CLASSIFIER - PREDICTION")
     print("=" * 60)
     
-    # Load model and labels
-    model, class_labels = load_model_and_labels()
-    if model is None or class_labels is None:
-        return
-    
     # Get audio file path from command line or user input
-    if len(sys.argv) > 1:
-        audio_file = sys.argv[1]
+    if args.audio_file:
+        audio_file = args.audio_file
     else:
         print("\nEnter the path to the audio file (.wav or .mp3):")
         audio_file = input("> ").strip().strip('"')
@@ -215,12 +283,29 @@ def main():
     if audio_path.suffix.lower() not in ['.wav', '.mp3', '.flac', '.ogg']:
         print(f"⚠️ Warning: Unsupported file format. Supported: .wav, .mp3, .flac, .ogg")
     
-    # Make prediction
-    result = predict_animal(audio_path, model, class_labels)
+    # Fast path: a warm daemon already has the model loaded
+    response = None if args.no_daemon else predict_via_daemon(audio_path)
+    if response is not None:
+        if not response['ok']:
+            print(f"❌ {response.get('error', 'Prediction failed')}")
+            return
+        result = response['result']
+        print_prediction(result)
+    else:
+        # Load model and labels
+        model, class_labels = load_model_and_labels()
+        if model is None or class_labels is None:
+            return
+        
+        # Make prediction
+        result = predict_animal(audio_path, model, class_labels)
     
     if result:
         print(f"\n✅ Prediction complete!")
-        print(f"The audio file contains: {result['predicted_animal']} sound")
+        if result.get('no_sound'):
+            print("The audio file contains no sound to classify")
+        else:
+            print(f"The audio file contains: {result['predicted_animal']} sound")
 
 if __name__ == "__main__":
     main()
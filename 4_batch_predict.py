@@ -3,23 +3,31 @@ Step 4: Batch Prediction - Test model on multiple audio files
 Useful for evaluating model performance on test set
 """
 
-import tensorflow as tf
-from tensorflow import keras
+from thread_tuning import apply_thread_profile
+THREAD_PROFILE = apply_thread_profile('throughput')  # Before TensorFlow is imported (by model loading)
 import librosa
 import numpy as np
-import matplotlib
-matplotlib.use("Agg")
-import matplotlib.pyplot as plt
 from pathlib import Path
 import json
+import hashlib
+import argparse
+import sys
 import pandas as pd
 from tqdm import tqdm
+from dataset_index import load_index
+from prediction_store import (ResultWriter, ClassMismatchError, scored_paths, iter_latest_chunks, remove_results,
+                              NO_SOUND_LABEL, ERROR_LABEL)
+from evaluation import evaluate, evaluate_results, print_report
+from cascade import CascadeClassifier, CASCADE_CONFIG_FILE, print_stats
+from audio_gate import load_active_clip, SilentAudioError
+from model_export import load_inference_model
 
 # ========== CONFIGURATION ==========
 PROJECT_PATH = Path(r"C:\Users\sasik\OneDrive\Documents\AnimalVoicedetection")
 MODEL_PATH = PROJECT_PATH / "trained_model" / "animal_sound_classifier.h5"
 CLASS_LABELS_PATH = PROJECT_PATH / "trained_model" / "class_labels.json"
 RESULTS_PATH = PROJECT_PATH / "batch_predictions.csv"
+DEFAULT_AUDIO_FOLDER = PROJECT_PATH / "mini_project"
 
 # Audio parameters
 SAMPLE_RATE = 22050
@@ -29,22 +37,18 @@ HOP_LENGTH = 512
 IMG_SIZE = (128, 128)
 
 def load_model_and_labels():
-    """Load trained model and class labels"""
-    model = keras.models.load_model(MODEL_PATH)
+    """Load trained model (fast-loading export when fresh) and class labels"""
+    model = load_inference_model(MODEL_PATH)
     with open(CLASS_LABELS_PATH, 'r') as f:
         class_labels = json.load(f)
     return model, class_labels
 
 def load_and_preprocess_audio(audio_path):
-    """Load and preprocess audio file"""
+    """Load audio and cut its most energetic fixed-length window (raises SilentAudioError)"""
     try:
-        y, sr = librosa.load(audio_path, sr=SAMPLE_RATE, duration=DURATION)
-        target_length = SAMPLE_RATE * DURATION
-        if len(y) < target_length:
-            y = np.pad(y, (0, target_length - len(y)), mode='constant')
-        else:
-            y = y[:target_length]
-        return y, sr
+        return load_active_clip(audio_path, SAMPLE_RATE, DURATION)
+    except SilentAudioError:
+        raise
     except:
         return None, None
 
@@ -75,8 +79,11 @@ def audio_to_spectrogram_array(y, sr):
         return None
 
 def predict_single(audio_path, model, class_labels):
-    """Predict single audio file"""
-    y, sr = load_and_preprocess_audio(audio_path)
+    """Predict single audio file; silent files get NO_SOUND_LABEL without running the model"""
+    try:
+        y, sr = load_and_preprocess_audio(audio_path)
+    except SilentAudioError:
+        return NO_SOUND_LABEL, 0.0, np.zeros(len(class_labels), dtype=np.float32)
     if y is None:
         return None, None, None
     
@@ -91,14 +98,40 @@ def predict_single(audio_path, model, class_labels):
     
     return predicted_class, confidence, predictions[0]
 
-def batch_predict(audio_folder, model, class_labels, output_csv=None):
-    """Predict on all audio files in a folder"""
+def parse_shard(spec):
+    """'i/N' -> (i, N) with 0 <= i < N"""
+    try:
+        index, count = (int(x) for x in spec.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"shard must look like i/N, got {spec!r}")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"shard index must satisfy 0 <= i < N, got {spec!r}")
+    return index, count
+
+def shard_of(rel_path, num_shards):
+    """Stable shard number of a file, from its path relative to the audio folder"""
+    digest = hashlib.sha1(Path(rel_path).as_posix().encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % num_shards
+
+def shard_output_path(output_path, shard):
+    """batch_predictions.csv -> batch_predictions.shard-1-of-4.csv"""
+    index, count = shard
+    output_path = Path(output_path)
+    return output_path.with_name(f"{output_path.stem}.shard-{index}-of-{count}{output_path.suffix}")
+
+def batch_predict(audio_folder, model, class_labels, output_path=None, shard=None, overwrite=False):
+    """
+    Predict on all audio files in a folder.
+    With output_path (.csv or .parquet) results are appended in row groups as they are
+    produced, and files already present in that output are skipped (overwrite=True starts
+    a new output instead; raises ClassMismatchError if the output holds another class set).
+    shard=(i, N) scores only the files whose stable path hash falls in shard i of N.
+    Returns an evaluation accumulator (see evaluation.py) over the results.
+    """
     audio_folder = Path(audio_folder)
     
-    # Find all audio files
-    audio_files = []
-    for ext in ['*.wav', '*.mp3', '*.flac', '*.ogg']:
-        audio_files.extend(list(audio_folder.rglob(ext)))
+    # Find all audio files (single scandir walk, refreshed incrementally; no header reads)
+    audio_files = [Path(e.path) for e in load_index(audio_folder, probe=False).entries()]
     
     if len(audio_files) == 0:
         print(f"❌ No audio files found in {audio_folder}")
@@ -106,124 +139,189 @@ def batch_predict(audio_folder, model, class_labels, output_csv=None):
     
     print(f"📁 Found {len(audio_files)} audio files")
     
-    # Process each file
+    if shard is not None:
+        index, count = shard
+        audio_files = [p for p in audio_files if shard_of(p.relative_to(audio_folder), count) == index]
+        print(f"🧩 Shard {index}/{count}: {len(audio_files)} files")
+    
+    class_names = [class_labels[str(i)] for i in range(len(class_labels))]
+    writer = None
     results = []
-    for audio_path in tqdm(audio_files, desc="Processing"):
-        # Extract true label from filename if available
-        filename = audio_path.name
-        true_label = filename.split('_')[0] if '_' in filename else 'Unknown'
-        
-        # Make prediction
-        pred_class, confidence, all_probs = predict_single(audio_path, model, class_labels)
-        
-        if pred_class is None:
-            continue
-        
-        # Store result
-        result = {
-            'filename': filename,
-            'filepath': str(audio_path),
-            'true_label': true_label,
-            'predicted_label': pred_class,
-            'confidence': confidence,
-            'correct': (true_label.lower() == pred_class.lower())
-        }
+    if output_path:
+        if overwrite:
+            remove_results(output_path)
+        writer = ResultWriter(output_path, class_names)
         
-        # Add all class probabilities
-        for idx, prob in enumerate(all_probs):
-            class_name = class_labels[str(idx)]
-            result[f'prob_{class_name}'] = prob * 100
-        
-        results.append(result)
+        # Resume: skip files already scored in this output
+        done = scored_paths(output_path)
+        remaining = [p for p in audio_files if str(p) not in done]
+        if len(remaining) < len(audio_files):
+            print(f"♻️ Skipping {len(audio_files) - len(remaining)} already scored files, {len(remaining)} remaining")
+        audio_files = remaining
+    
+    # Process each file; the writer is closed even on Ctrl-C, so buffered rows are kept
+    silent_count = 0
+    failed_count = 0
+    try:
+        for audio_path in tqdm(audio_files, desc="Processing"):
+            # Extract true label from filename if available
+            filename = audio_path.name
+            true_label = filename.split('_')[0] if '_' in filename else 'Unknown'
+            
+            # Make prediction
+            pred_class, confidence, all_probs = predict_single(audio_path, model, class_labels)
+            
+            # Undecodable files are stored too, so a resumed run does not retry them
+            if pred_class is None:
+                pred_class, confidence, all_probs = ERROR_LABEL, 0.0, np.zeros(len(class_names), dtype=np.float32)
+                failed_count += 1
+            elif pred_class == NO_SOUND_LABEL:
+                silent_count += 1
+            
+            # Store result
+            result = {
+                'filename': filename,
+                'filepath': str(audio_path),
+                'true_label': true_label,
+                'predicted_label': pred_class,
+                'confidence': confidence,
+                'correct': (true_label.lower() == pred_class.lower())
+            }
+            
+            if writer is not None:
+                writer.add(result, all_probs * 100)
+            else:
+                # Add all class probabilities
+                for idx, prob in enumerate(all_probs):
+                    result[f'prob_{class_names[idx]}'] = prob * 100
+                results.append(result)
+    finally:
+        if writer is not None:
+            writer.close()
+    
+    if silent_count:
+        print(f"🔇 Skipped {silent_count} silent files (stored as '{NO_SOUND_LABEL}')")
+    if failed_count:
+        print(f"⚠️ {failed_count} files could not be decoded (stored as '{ERROR_LABEL}'; "
+              f"remove their rows to retry them)")
     
-    # Create DataFrame
-    df = pd.DataFrame(results)
+    if writer is None:
+        return evaluate([pd.DataFrame(results)])
     
-    # Save to CSV if requested
-    if output_csv:
-        df.to_csv(output_csv, index=False)
-        print(f"✅ Results saved to: {output_csv}")
+    print(f"✅ Results saved to: {output_path}")
     
-    return df
+    # Report over everything in the output, including earlier runs, streamed in chunks
+    return evaluate_results(output_path)
 
-def print_summary(df):
-    """Print summary statistics"""
-    print("\n" + "=" * 70)
-    print("BATCH PREDICTION SUMMARY")
-    print("=" * 70)
+def merge_results(shard_paths, output_path):
+    """Combine shard outputs into one store (first occurrence of a file wins); returns rows written"""
+    output_path = Path(output_path)
+    if any(output_path.resolve() == Path(p).resolve() for p in shard_paths):
+        raise ValueError(f"Merge output must not be one of the shards: {output_path}")
     
-    total = len(df)
-    print(f"\n📊 Total files processed: {total}")
-    
-    # Overall accuracy (if true labels available)
-    if 'correct' in df.columns and df['true_label'].iloc[0] != 'Unknown':
-        correct = df['correct'].sum()
-        accuracy = (correct / total) * 100
-        print(f"✅ Correct predictions: {correct}/{total} ({accuracy:.2f}%)")
-        print(f"❌ Incorrect predictions: {total - correct}/{total}")
-    
-    # Average confidence
-    avg_confidence = df['confidence'].mean()
-    print(f"\n🎯 Average confidence: {avg_confidence:.2f}%")
-    
-    # Per-class statistics
-    print("\n📈 Per-class predictions:")
-    pred_counts = df['predicted_label'].value_counts()
-    for animal, count in pred_counts.items():
-        percentage = (count / total) * 100
-        print(f"  {animal:15s}: {count:3d} ({percentage:5.1f}%)")
-    
-    # Confusion matrix (if true labels available)
-    if 'correct' in df.columns and df['true_label'].iloc[0] != 'Unknown':
-        print("\n📊 Confusion Matrix:")
-        confusion = pd.crosstab(df['true_label'], df['predicted_label'], 
-                               rownames=['True'], colnames=['Predicted'])
-        print(confusion)
+    # Start from an empty output so repeated merges do not duplicate rows
+    remove_results(output_path)
     
-    print("=" * 70)
+    seen = set()
+    writer = None
+    for shard_path in shard_paths:
+        for chunk in iter_latest_chunks(shard_path):
+            chunk = chunk[~chunk['filepath'].isin(seen)]
+            seen.update(chunk['filepath'])
+            if writer is None:
+                class_names = [c[len('prob_'):] for c in chunk.columns if c.startswith('prob_')]
+                writer = ResultWriter(output_path, class_names)
+            writer.add_frame(chunk)
+    if writer is not None:
+        writer.close()
+    return len(seen)
+
+def parse_args(argv):
+    if argv and argv[0] == 'merge':
+        parser = argparse.ArgumentParser(prog="4_batch_predict.py merge",
+                                         description="Merge sharded batch prediction outputs")
+        parser.add_argument('shards', nargs='+', type=Path, help="Shard output files")
+        parser.add_argument('--output', type=Path, default=RESULTS_PATH, help="Merged output (.csv or .parquet)")
+        args = parser.parse_args(argv[1:])
+        args.command = 'merge'
+        return args
+    
+    parser = argparse.ArgumentParser(
+        description="Batch prediction over a folder of audio files. "
+                    "Use '4_batch_predict.py merge SHARD...' to combine sharded outputs."
+    )
+    parser.add_argument('folder', nargs='?', type=Path, default=DEFAULT_AUDIO_FOLDER,
+                        help=f"Folder containing audio files (default: {DEFAULT_AUDIO_FOLDER})")
+    parser.add_argument('--output', type=Path, default=RESULTS_PATH,
+                        help="Results file (.csv or .parquet); appended to and resumed")
+    parser.add_argument('--overwrite', action='store_true',
+                        help="Delete the results file first instead of resuming it (e.g. after retraining)")
+    parser.add_argument('--shard', type=parse_shard, default=None,
+                        help="Score only shard i of N (e.g. 0/4), partitioned by a stable path hash")
+    parser.add_argument('--cascade', action='store_true',
+                        help="Answer confident clips with the small first-stage model (see cascade.py)")
+    args = parser.parse_args(argv)
+    args.command = 'predict'
+    return args
 
-def main():
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    
     print("=" * 70)
     print("BATCH PREDICTION - TEST MULTIPLE AUDIO FILES")
     print("=" * 70)
     
+    if args.command == 'merge':
+        missing = [p for p in args.shards if not p.exists()]
+        if missing:
+            print(f"❌ Shard outputs not found: {', '.join(map(str, missing))}")
+            return
+        print(f"\n🧩 Merging {len(args.shards)} shard outputs into: {args.output}")
+        total = merge_results(args.shards, args.output)
+        print(f"✅ Merged {total} results")
+        report = evaluate_results(args.output)
+        if report.total + report.silent + report.failed > 0:
+            print_report(report)
+        return
+    
+    folder_path = args.folder
+    if not folder_path.exists():
+        print(f"❌ Folder not found: {folder_path}")
+        return
+    
+    output_path = args.output
+    if args.shard is not None:
+        output_path = shard_output_path(output_path, args.shard)
+    
     # Load model
     print("\n🔧 Loading model...")
     model, class_labels = load_model_and_labels()
     print(f"✅ Model loaded with {len(class_labels)} classes")
+    if THREAD_PROFILE:
+        print(f"✅ Thread profile applied: {THREAD_PROFILE['intra_op_threads']} intra-op / "
+              f"{THREAD_PROFILE['inter_op_threads']} inter-op / {THREAD_PROFILE['blas_threads']} BLAS threads")
     
-    # Get folder path
-    print("\nEnter the folder path containing audio files:")
-    print("(Press Enter to use mini_project folder)")
-    folder_input = input("> ").strip().strip('"')
-    
-    if not folder_input:
-        folder_path = PROJECT_PATH / "mini_project"
-    else:
-        folder_path = Path(folder_input)
-    
-    if not folder_path.exists():
-        print(f"❌ Folder not found: {folder_path}")
-        return
+    if args.cascade:
+        if not CASCADE_CONFIG_FILE.exists():
+            print(f"❌ Cascade not calibrated: {CASCADE_CONFIG_FILE} (run cascade.py train/calibrate)")
+            return
+        # Same predict() interface, so the rest of the pipeline is unchanged
+        model = CascadeClassifier.load(model)
+        print(f"✅ Cascade enabled (threshold {model.threshold:.4f})")
     
     # Run batch prediction
     print(f"\n🎵 Processing audio files in: {folder_path}")
-    df = batch_predict(folder_path, model, class_labels, output_csv=RESULTS_PATH)
+    try:
+        report = batch_predict(folder_path, model, class_labels, output_path=output_path, shard=args.shard,
+                               overwrite=args.overwrite)
+    except ClassMismatchError as e:
+        print(f"❌ {e} (--overwrite)")
+        return
     
-    if df is not None and len(df) > 0:
-        # Print summary
-        print_summary(df)
-        
-        # Show top predictions
-        print("\n🔝 Top 10 Most Confident Predictions:")
-        top_10 = df.nlargest(10, 'confidence')[['filename', 'predicted_label', 'confidence']]
-        print(top_10.to_string(index=False))
-        
-        # Show low confidence predictions
-        if len(df) >= 10:
-            print("\n⚠️ Top 10 Least Confident Predictions:")
-            bottom_10 = df.nsmallest(10, 'confidence')[['filename', 'predicted_label', 'confidence']]
-            print(bottom_10.to_string(index=False))
+    if report is not None and report.total + report.silent + report.failed > 0:
+        print_report(report)
+    if args.cascade:
+        print_stats(model.stats())
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,269 @@
+"""
+Incremental Class Addition - add new animal classes without full retraining
+Freezes the convolutional trunk of an existing model, caches its embeddings for the
+already-known spectrograms once, and trains only a new classification head
+on the cached embeddings plus the spectrograms of the new classes.
+
+Usage:
+    1. Put the new class clips through '1_generate_spectrograms.py' so that
+       spectrograms_dataset/<NewAnimal>/ exists
+    2. python add_class.py
+"""
+
+import tensorflow as tf
+from tensorflow import keras
+from tensorflow.keras import layers
+from pathlib import Path
+import numpy as np
+import hashlib
+import json
+import os
+import argparse
+from datetime import datetime
+from tqdm import tqdm
+
+# ========== CONFIGURATION ==========
+PROJECT_PATH = Path(r"C:\Users\sasik\OneDrive\Documents\AnimalVoicedetection")
+SPECTROGRAM_PATH = PROJECT_PATH / "spectrograms_dataset"
+MODEL_OUTPUT_PATH = PROJECT_PATH / "trained_model"
+MODEL_FILE = MODEL_OUTPUT_PATH / "animal_sound_classifier.h5"
+CLASS_LABELS_FILE = MODEL_OUTPUT_PATH / "class_labels.json"
+EMBEDDING_CACHE_DIR = MODEL_OUTPUT_PATH / "embedding_cache"
+
+# Training parameters (head only)
+IMG_SIZE = (128, 128)
+BATCH_SIZE = 64
+EPOCHS = 15
+VALIDATION_SPLIT = 0.2
+LEARNING_RATE = 0.001
+EMBED_BATCH_SIZE = 64
+SEED = 42
+
+def trunk_fingerprint(trunk):
+    """Hash of the frozen trunk weights; cached embeddings are only valid for this trunk"""
+    digest = hashlib.sha1()
+    for w in trunk.get_weights():
+        digest.update(np.ascontiguousarray(w).tobytes())
+    return digest.hexdigest()
+
+def split_model(model):
+    """Split a trained CNN into (trunk, head layers) at the Flatten layer"""
+    for i, layer in enumerate(model.layers):
+        if isinstance(layer, layers.Flatten):
+            trunk = keras.Model(model.inputs, layer.output, name="trunk")
+            trunk.trainable = False
+            return trunk, model.layers[i + 1:]
+    raise ValueError("Model has no Flatten layer to split the convolutional trunk from")
+
+def list_spectrograms(class_names):
+    """List (path, label) pairs for the given classes, in a stable order"""
+    items = []
+    for label in class_names:
+        class_dir = SPECTROGRAM_PATH / label
+        if not class_dir.is_dir():
+            continue
+        with os.scandir(class_dir) as it:
+            names = sorted(e.name for e in it if e.is_file() and e.name.endswith('.png'))
+        items.extend((str(class_dir / name), label) for name in names)
+    return items
+
+def load_image_batch(paths):
+    """Load spectrogram images exactly like the training generator does (resize + rescale)"""
+    batch = np.empty((len(paths), *IMG_SIZE, 3), dtype=np.float32)
+    for i, path in enumerate(paths):
+        img = keras.preprocessing.image.load_img(path, target_size=IMG_SIZE)
+        batch[i] = keras.preprocessing.image.img_to_array(img) / 255.0
+    return batch
+
+def compute_embeddings(trunk, paths, out):
+    """Run the frozen trunk over paths and write float16 embeddings into out"""
+    for start in tqdm(range(0, len(paths), EMBED_BATCH_SIZE), desc="Embedding"):
+        batch_paths = paths[start:start + EMBED_BATCH_SIZE]
+        emb = trunk.predict(load_image_batch(batch_paths), verbose=0)
+        out[start:start + len(batch_paths)] = emb.astype(np.float16)
+
+def load_or_update_cache(trunk, items):
+    """
+    Return (embeddings memmap, labels) for items, reusing the on-disk cache.
+    Only spectrograms that are new, modified, or embedded by a different trunk are recomputed.
+    """
+    EMBEDDING_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    index_file = EMBEDDING_CACHE_DIR / "index.json"
+    emb_file = EMBEDDING_CACHE_DIR / "embeddings.npy"
+    fingerprint = trunk_fingerprint(trunk)
+    emb_dim = int(np.prod(trunk.output_shape[1:]))
+
+    cached_rows = {}
+    old = None
+    if index_file.exists() and emb_file.exists():
+        with open(index_file, 'r') as f:
+            index = json.load(f)
+        if index['trunk'] == fingerprint and index['dim'] == emb_dim:
+            old = np.load(emb_file, mmap_mode='r')
+            cached_rows = {(e['path'], e['mtime']): row for row, e in enumerate(index['entries'])}
+        else:
+            print("⚠️ Trunk changed since the cache was built, recomputing all embeddings")
+
+    entries = [{'path': p, 'label': label, 'mtime': os.stat(p).st_mtime} for p, label in items]
+    tmp_file = EMBEDDING_CACHE_DIR / "embeddings.tmp.npy"
+    new = np.lib.format.open_memmap(tmp_file, mode='w+', dtype=np.float16, shape=(len(entries), emb_dim))
+
+    missing = []
+    for row, e in enumerate(entries):
+        old_row = cached_rows.get((e['path'], e['mtime']))
+        if old_row is None:
+            missing.append(row)
+        else:
+            new[row] = old[old_row]
+    print(f"📦 Cached embeddings reused: {len(entries) - len(missing)}, to compute: {len(missing)}")
+
+    if missing:
+        computed = np.empty((len(missing), emb_dim), dtype=np.float16)
+        compute_embeddings(trunk, [entries[r]['path'] for r in missing], computed)
+        new[np.array(missing)] = computed
+
+    new.flush()
+    del new, old
+    os.replace(tmp_file, emb_file)
+    with open(index_file, 'w') as f:
+        json.dump({'trunk': fingerprint, 'dim': emb_dim, 'entries': entries}, f)
+
+    return np.load(emb_file, mmap_mode='r'), [e['label'] for e in entries]
+
+class EmbeddingSequence(keras.utils.Sequence):
+    """Batches of cached embeddings read lazily from the memmap"""
+
+    def __init__(self, embeddings, targets, indices, batch_size, shuffle):
+        super().__init__()
+        self.embeddings = embeddings
+        self.targets = targets
+        self.indices = np.array(indices)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.on_epoch_end()
+
+    def __len__(self):
+        return int(np.ceil(len(self.indices) / self.batch_size))
+
+    def __getitem__(self, idx):
+        rows = np.sort(self.order[idx * self.batch_size:(idx + 1) * self.batch_size])
+        return self.embeddings[rows].astype(np.float32), self.targets[rows]
+
+    def on_epoch_end(self):
+        self.order = np.random.permutation(self.indices) if self.shuffle else self.indices
+
+def build_head(old_head_layers, emb_dim, num_old, num_classes):
+    """
+    New head with the same shape as the old one; hidden layers start from the old
+    weights and the output layer is widened, keeping the old class columns.
+    """
+    head = keras.Sequential([layers.Input(shape=(emb_dim,))], name="head")
+    for layer in old_head_layers[:-1]:
+        head.add(layer.__class__.from_config(layer.get_config()))
+    head.add(layers.Dense(num_classes, activation='softmax', name="predictions"))
+
+    for new_layer, old_layer in zip(head.layers[:-1], old_head_layers[:-1]):
+        new_layer.set_weights(old_layer.get_weights())
+
+    old_w, old_b = old_head_layers[-1].get_weights()
+    new_w, new_b = head.layers[-1].get_weights()
+    new_w[:, :num_old] = old_w
+    new_b[:num_old] = old_b
+    head.layers[-1].set_weights([new_w, new_b])
+    return head
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Add new animal classes to a trained model")
+    parser.add_argument('--model', type=Path, default=MODEL_FILE, help="Existing trained model")
+    parser.add_argument('--output', type=Path, default=MODEL_FILE, help="Where to save the updated model")
+    parser.add_argument('--epochs', type=int, default=EPOCHS, help="Head training epochs")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    np.random.seed(SEED)
+    tf.random.set_seed(SEED)
+
+    print("=" * 60)
+    print("INCREMENTAL CLASS ADDITION")
+    print("=" * 60)
+
+    if not args.model.exists() or not CLASS_LABELS_FILE.exists():
+        print(f"❌ Model or class labels not found in {MODEL_OUTPUT_PATH}")
+        print("Please run '2_train_model.py' first!")
+        return
+
+    with open(CLASS_LABELS_FILE, 'r') as f:
+        class_labels = json.load(f)
+    old_classes = [class_labels[str(i)] for i in range(len(class_labels))]
+
+    # New classes are spectrogram folders the model does not know yet
+    on_disk = sorted(d.name for d in SPECTROGRAM_PATH.iterdir() if d.is_dir())
+    new_classes = [c for c in on_disk if c not in old_classes]
+    if not new_classes:
+        print("✅ No new classes found in spectrogram directory, nothing to do")
+        return
+    print(f"🐾 Existing classes: {len(old_classes)}")
+    print(f"🆕 New classes: {', '.join(new_classes)}")
+
+    # Existing classes keep their indices; new ones are appended
+    all_classes = old_classes + new_classes
+    class_to_idx = {c: i for i, c in enumerate(all_classes)}
+
+    print("\n🔧 Loading model and freezing convolutional trunk...")
+    model = keras.models.load_model(args.model)
+    trunk, old_head_layers = split_model(model)
+
+    items = list_spectrograms(all_classes)
+    embeddings, labels = load_or_update_cache(trunk, items)
+    targets = keras.utils.to_categorical([class_to_idx[l] for l in labels], len(all_classes))
+
+    indices = np.random.permutation(len(labels))
+    n_val = int(len(indices) * VALIDATION_SPLIT)
+    train_seq = EmbeddingSequence(embeddings, targets, indices[n_val:], BATCH_SIZE, shuffle=True)
+    val_seq = EmbeddingSequence(embeddings, targets, indices[:n_val], BATCH_SIZE, shuffle=False)
+
+    emb_dim = embeddings.shape[1]
+    head = build_head(old_head_layers, emb_dim, len(old_classes), len(all_classes))
+    head.compile(
+        optimizer=keras.optimizers.Adam(learning_rate=LEARNING_RATE),
+        loss='categorical_crossentropy',
+        metrics=['accuracy']
+    )
+
+    print(f"\n🚀 Training new head on {len(indices) - n_val} embeddings ({n_val} validation)...")
+    head.fit(
+        train_seq,
+        epochs=args.epochs,
+        validation_data=val_seq if n_val else None,
+        callbacks=[keras.callbacks.EarlyStopping(monitor='val_loss' if n_val else 'loss',
+                                                 patience=3, restore_best_weights=True)],
+        verbose=1
+    )
+
+    # Reassemble a flat model (trunk layers + new head) so it can be split again next time
+    updated = keras.Sequential([layers.Input(shape=model.input_shape[1:])])
+    for layer in model.layers:
+        updated.add(layer)
+        if isinstance(layer, layers.Flatten):
+            break
+    for layer in head.layers:
+        updated.add(layer)
+
+    if args.output == args.model:
+        backup = args.model.with_name(f"{args.model.stem}_{datetime.now():%Y%m%d_%H%M%S}{args.model.suffix}")
+        os.replace(args.model, backup)
+        print(f"📦 Previous model backed up to: {backup}")
+    updated.save(args.output)
+
+    with open(CLASS_LABELS_FILE, 'w') as f:
+        json.dump({str(i): c for i, c in enumerate(all_classes)}, f, indent=4)
+
+    print("\n" + "=" * 60)
+    print("CLASSES ADDED!")
+    print("=" * 60)
+    print(f"✅ Model saved: {args.output}")
+    print(f"✅ Class labels ({len(all_classes)}): {CLASS_LABELS_FILE}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Admission Control - bounded concurrency with a bounded wait queue
+At most max_in_flight requests run at once; up to max_queue more may wait for a
+slot, each for at most its deadline. Anything beyond that is rejected at once
+(Overloaded), so overload turns into fast 429s instead of an ever-growing backlog.
+"""
+
+import math
+import threading
+import time
+
+SERVICE_TIME_SMOOTHING = 0.2  # Weight of the newest request in the moving average
+
+class Overloaded(Exception):
+    """Request was not admitted; retry_after is a suggested wait in seconds"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class AdmissionController:
+    """Thread-safe in-flight limit with a bounded, deadline-aware wait queue"""
+
+    def __init__(self, max_in_flight, max_queue, deadline):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.deadline = deadline
+        self.cond = threading.Condition()
+        self.in_flight = 0
+        self.queued = 0
+        self.counters = {'admitted': 0, 'rejected_queue_full': 0, 'rejected_deadline': 0}
+        self.service_time = None  # Moving average of seconds per admitted request
+
+    def retry_after(self):
+        """Seconds until the current backlog should have drained (at least 1)"""
+        per_request = self.service_time or 1.0
+        backlog = self.queued + self.in_flight + 1
+        return max(1, math.ceil(per_request * backlog / self.max_in_flight))
+
+    def acquire(self, deadline=None):
+        """Take a slot, waiting at most the deadline; raises Overloaded"""
+        deadline = self.deadline if deadline is None else deadline
+        with self.cond:
+            if self.in_flight >= self.max_in_flight:
+                if self.queued >= self.max_queue:
+                    self.counters['rejected_queue_full'] += 1
+                    raise Overloaded("Server busy: request queue is full", self.retry_after())
+                self.queued += 1
+                try:
+                    expires = time.monotonic() + deadline
+                    while self.in_flight >= self.max_in_flight:
+                        remaining = expires - time.monotonic()
+                        if remaining <= 0:
+                            self.counters['rejected_deadline'] += 1
+                            raise Overloaded("Server busy: timed out waiting for a free slot", self.retry_after())
+                        self.cond.wait(remaining)
+                finally:
+                    self.queued -= 1
+            self.in_flight += 1
+            self.counters['admitted'] += 1
+        return time.monotonic()
+
+    def release(self, started=None):
+        """Free a slot; pass acquire()'s return value to update the service-time estimate"""
+        with self.cond:
+            self.in_flight -= 1
+            if started is not None:
+                elapsed = time.monotonic() - started
+                if self.service_time is None:
+                    self.service_time = elapsed
+                else:
+                    self.service_time += SERVICE_TIME_SMOOTHING * (elapsed - self.service_time)
+            self.cond.notify()
+
+    def stats(self):
+        with self.cond:
+            return dict(
+                self.counters,
+                in_flight=self.in_flight,
+                queue_depth=self.queued,
+                max_in_flight=self.max_in_flight,
+                max_queue=self.max_queue,
+                deadline_seconds=self.deadline,
+                avg_service_seconds=self.service_time
+            )
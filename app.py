@@ -3,20 +3,33 @@ Flask Backend for Animal Voice Detection
 Provides web interface for uploading audio files and getting predictions
 """
 
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, Response
 from flask_cors import CORS
-import tensorflow as tf
-from tensorflow import keras
+from thread_tuning import apply_thread_profile
+THREAD_PROFILE = apply_thread_profile('latency')  # Before TensorFlow is imported (by model loading)
 import librosa
 import numpy as np
-import matplotlib
-matplotlib.use("Agg")
-import matplotlib.pyplot as plt
 from pathlib import Path
 import json
 import os
 from werkzeug.utils import secure_filename
 import traceback
+import time
+import shutil
+import tempfile
+import zipfile
+import uuid
+from similarity_index import SimilarityIndex, build_embedding_model, model_fingerprint
+from preprocess_pool import PreprocessPool, audio_to_image_array
+from model_registry import ServingModel, ModelReloader, active_version, REGISTRY_PATH, UNVERSIONED
+from audio_gate import load_active_clip, SilentAudioError
+from spectrogram_renderer import render_spectrogram, spectrogram_png_bytes
+import threading
+import functools
+from admission import AdmissionController, Overloaded
+from werkzeug.exceptions import RequestEntityTooLarge
+from job_queue import JobQueue, start_workers, job_dir, JOBS_DB_PATH, JOBS_FOLDER
+import atexit
 
 app = Flask(__name__, static_folder='static')
 CORS(app)
@@ -26,7 +39,15 @@ PROJECT_PATH = Path(__file__).parent
 MODEL_PATH = PROJECT_PATH / "trained_model" / "best_model.h5"
 CLASS_LABELS_PATH = PROJECT_PATH / "trained_model" / "class_labels.json"
 UPLOAD_FOLDER = PROJECT_PATH / "uploads"
-TEMP_SPEC_PATH = PROJECT_PATH / "temp_spectrogram.png"
+SIMILARITY_INDEX_PATH = PROJECT_PATH / "trained_model" / "similarity_index"
+CASCADE_CONFIG_PATH = PROJECT_PATH / "trained_model" / "cascade.json"
+
+# Two-stage inference when a calibrated cascade exists (USE_CASCADE=0 forces the full model)
+USE_CASCADE = os.environ.get('USE_CASCADE', '1') != '0'
+
+# Versioned models: serve the registry's ACTIVE version and hot-swap when it changes (MODEL_RELOAD=0 disables)
+MODEL_REGISTRY_PATH = Path(os.environ.get('MODEL_REGISTRY', REGISTRY_PATH))
+MODEL_RELOAD = os.environ.get('MODEL_RELOAD', '1') != '0'
 
 # Create upload folder if it doesn't exist
 UPLOAD_FOLDER.mkdir(exist_ok=True)
@@ -37,181 +58,655 @@ DURATION = 3
 N_MELS = 128
 HOP_LENGTH = 512
 IMG_SIZE = (128, 128)
+PREPROCESS_PARAMS = {
+    'sample_rate': SAMPLE_RATE,
+    'duration': DURATION,
+    'n_mels': N_MELS,
+    'hop_length': HOP_LENGTH,
+    'img_size': IMG_SIZE
+}
+
+# Worker processes for decoding/mel/rendering (0 = run on the request thread); tuned value if profiled
+DEFAULT_PREPROCESS_WORKERS = (THREAD_PROFILE['preprocess_workers'] if THREAD_PROFILE
+                              else max(1, (os.cpu_count() or 2) - 1))
+PREPROCESS_WORKERS = int(os.environ.get('PREPROCESS_WORKERS', DEFAULT_PREPROCESS_WORKERS))
 
 # Allowed file extensions
 ALLOWED_EXTENSIONS = {'wav', 'mp3', 'flac', 'ogg', 'm4a'}
 
+# Batch endpoint limits
+MAX_BATCH_FILES = 500
+MAX_BATCH_BYTES = 200 * 1024 * 1024  # Total upload size (and total unzipped size)
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', 20 * 1024 * 1024))  # Single-file endpoints
+INFERENCE_BATCH_SIZE = 32
+
+# Admission control: requests running at once, requests allowed to wait, and how long they may wait
+MAX_IN_FLIGHT = int(os.environ.get('MAX_IN_FLIGHT', max(1, PREPROCESS_WORKERS)))
+MAX_QUEUE = int(os.environ.get('MAX_QUEUE', 4 * MAX_IN_FLIGHT))
+REQUEST_DEADLINE = float(os.environ.get('REQUEST_DEADLINE', 10))
+
+# Background jobs: worker processes (separate from request handling), queue cap and long-poll limit
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 1))
+MAX_QUEUED_JOBS = 1000
+MAX_JOB_WAIT = 60
+JOB_PRIORITY_RANGE = (-10, 10)
+
+# Werkzeug refuses to read bodies beyond this (covers chunked uploads without Content-Length)
+app.config['MAX_CONTENT_LENGTH'] = MAX_BATCH_BYTES
+
+# Similarity search defaults
+DEFAULT_TOP_K = 10
+MAX_TOP_K = 100
+
 # Global variables for model and labels
-model = None
-class_labels = None
+serving = None  # ServingModel: model + labels + cascade of one version, replaced as a whole on reload
+model_reloader = None
+embedding_model = None  # (serving version, embedding sub-model), built on first use (see get_embedding_model)
+model_fingerprints = {}  # serving version -> content hash of its model file
+embedding_lock = threading.Lock()
+similarity_index = None
+preprocess_pool = None
+
+# Request counters reported by /metrics
+metrics = {'predictions': 0, 'silent_skipped': 0}
+metrics_lock = threading.Lock()
+admission = AdmissionController(MAX_IN_FLIGHT, MAX_QUEUE, REQUEST_DEADLINE)
+job_queue = None
+job_workers = []
+
+def count_metric(name, n=1):
+    with metrics_lock:
+        metrics[name] += n
+
+def too_large_response(max_bytes):
+    return jsonify({
+        'success': False,
+        'error': f'Upload too large (max {max_bytes // (1024 * 1024)} MB)'
+    }), 413
+
+def overloaded_response(error):
+    response = jsonify({'success': False, 'error': str(error), 'retry_after': error.retry_after})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+def admitted(max_bytes=MAX_UPLOAD_BYTES):
+    """
+    Route decorator: reject oversized bodies (413) and excess load (429 + Retry-After)
+    before the upload is read, then run the view holding an admission slot.
+    REQUEST_DEADLINE bounds only the wait for a slot; an admitted request runs to completion.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.content_length is not None and request.content_length > max_bytes:
+                return too_large_response(max_bytes)
+            # Chunked uploads have no Content-Length; Werkzeug stops reading them at this limit
+            request.max_content_length = max_bytes
+            try:
+                started = admission.acquire()
+            except Overloaded as e:
+                return overloaded_response(e)
+            try:
+                # Parse the body here, so the views' generic error handling never turns a 413 into a 500
+                try:
+                    request.files
+                except RequestEntityTooLarge:
+                    return too_large_response(max_bytes)
+                return view(*args, **kwargs)
+            finally:
+                admission.release(started)
+        return wrapper
+    return decorator
 
 def allowed_file(filename):
     """Check if file extension is allowed"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 def load_model_and_labels():
-    """Load trained model and class labels"""
-    global model, class_labels
+    """Load the registry's active version, or MODEL_PATH (+ cascade, if calibrated) when nothing is published"""
+    global serving
+    
+    version = active_version(MODEL_REGISTRY_PATH)
+    if version is not None:
+        serving = ServingModel.load_version(version, MODEL_REGISTRY_PATH, USE_CASCADE)
+        print(f"✅ Model version {version} loaded from {MODEL_REGISTRY_PATH}")
+    else:
+        if not MODEL_PATH.exists():
+            raise FileNotFoundError(f"Model not found: {MODEL_PATH}")
+        
+        if not CLASS_LABELS_PATH.exists():
+            raise FileNotFoundError(f"Class labels not found: {CLASS_LABELS_PATH}")
+        
+        serving = ServingModel.load(MODEL_PATH, CLASS_LABELS_PATH,
+                                    cascade_config=CASCADE_CONFIG_PATH if USE_CASCADE else None)
+        print(f"✅ Model loaded: {MODEL_PATH} ({UNVERSIONED})")
+    
+    print(f"✅ Class labels loaded: {list(serving.class_labels.values())}")
+    if serving.cascade is not None:
+        print(f"✅ Cascade loaded: threshold {serving.cascade.threshold:.4f}")
+    elif USE_CASCADE:
+        print("⚠️ Cascade not calibrated (full model only)")
+    serving.warm_up((*IMG_SIZE, 3), (1, INFERENCE_BATCH_SIZE))
+
+def swap_serving_model(new_serving):
+    """Called by the reloader once the new version is loaded and warm; requests already running keep the old one"""
+    global serving
+    serving = new_serving
+
+def start_model_reloader():
+    """Watch the registry's ACTIVE file and hot-swap new versions in the background"""
+    global model_reloader
     
-    if not MODEL_PATH.exists():
-        raise FileNotFoundError(f"Model not found: {MODEL_PATH}")
+    if not MODEL_RELOAD:
+        print("⚠️ Model hot-reload disabled (MODEL_RELOAD=0)")
+        return
     
-    if not CLASS_LABELS_PATH.exists():
-        raise FileNotFoundError(f"Class labels not found: {CLASS_LABELS_PATH}")
+    model_reloader = ModelReloader(serving.version, swap_serving_model, (*IMG_SIZE, 3),
+                                   (1, INFERENCE_BATCH_SIZE), MODEL_REGISTRY_PATH, USE_CASCADE)
+    model_reloader.start()
+    print(f"✅ Watching {MODEL_REGISTRY_PATH} for new model versions")
+
+def load_similarity_index():
+    """Load the nearest-neighbour index if it has been built (optional)"""
+    global similarity_index
     
-    # Load model
-    model = keras.models.load_model(MODEL_PATH)
-    print(f"✅ Model loaded: {MODEL_PATH}")
+    if not (SIMILARITY_INDEX_PATH / "vectors.npy").exists():
+        print(f"⚠️ Similarity index not found: {SIMILARITY_INDEX_PATH} (/similar disabled)")
+        return
     
-    # Load class labels
-    with open(CLASS_LABELS_PATH, 'r') as f:
-        class_labels = json.load(f)
-    print(f"✅ Class labels loaded: {list(class_labels.values())}")
+    similarity_index = SimilarityIndex.load(SIMILARITY_INDEX_PATH)
+    print(f"✅ Similarity index loaded: {len(similarity_index)} vectors")
+    mismatch = similarity_index_mismatch(serving)
+    if mismatch:
+        print(f"⚠️ {mismatch} /similar answers 409 until then.")
 
-def load_and_preprocess_audio(audio_path, target_sr=SAMPLE_RATE, duration=DURATION):
-    """Load and preprocess audio file"""
-    # Load audio
-    y, sr = librosa.load(audio_path, sr=target_sr, duration=duration)
-    
-    # Pad or trim to fixed length
-    target_length = target_sr * duration
-    if len(y) < target_length:
-        y = np.pad(y, (0, target_length - len(y)), mode='constant')
-    else:
-        y = y[:target_length]
-    
-    return y, sr
-
-def generate_spectrogram_image(y, sr, save_path):
-    """Generate spectrogram and save as image"""
-    # Generate mel-spectrogram
-    mel_spec = librosa.feature.melspectrogram(
-        y=y, 
-        sr=sr, 
-        n_mels=N_MELS,
-        hop_length=HOP_LENGTH,
-        fmax=sr//2
-    )
-    
-    # Convert to dB scale
-    mel_spec_db = librosa.power_to_db(mel_spec, ref=np.max)
+def get_embedding_model(current):
+    """
+    Embedding sub-model of a serving model, built on first use and again after a hot swap:
+    when the server runs a serving export this reloads the Keras model file, which would
+    otherwise slow down every startup
+    """
+    global embedding_model
+    
+    with embedding_lock:
+        if embedding_model is None or embedding_model[0] != current.version:
+            embedding_model = (current.version, build_embedding_model(current.keras_model()))
+        return embedding_model[1]
+
+def similarity_index_mismatch(current):
+    """Error message if the index was built with another model than current, else None"""
+    built_with = similarity_index.model
+    if not built_with:
+        return None  # Index built before the model was recorded: cannot tell
+    with embedding_lock:
+        if current.version not in model_fingerprints:
+            model_fingerprints[current.version] = model_fingerprint(current.model_path)
+        fingerprint = model_fingerprints[current.version]
+    if fingerprint == built_with['sha1']:
+        return None
+    return (f"Similarity index was built with model {built_with['version']} ({built_with['path']}), "
+            f"but version {current.version} is serving. Rebuild it with similarity_index.py --model.")
+
+def start_preprocess_pool():
+    """Start the persistent preprocessing worker processes"""
+    global preprocess_pool
+    
+    if PREPROCESS_WORKERS <= 0:
+        print("⚠️ Preprocessing runs on request threads (PREPROCESS_WORKERS=0)")
+        return
+    
+    # Workers import librosa in the background while the model loads
+    preprocess_pool = PreprocessPool(PREPROCESS_WORKERS, PREPROCESS_PARAMS, wait_ready=False)
+    print(f"✅ Preprocessing pool started: {PREPROCESS_WORKERS} worker processes")
+
+def start_job_queue():
+    """Open the persistent job queue and start the background worker processes"""
+    global job_queue, job_workers
     
-    # Create figure without axes
-    fig = plt.figure(figsize=(4, 4))
-    ax = plt.Axes(fig, [0., 0., 1., 1.])
-    ax.set_axis_off()
-    fig.add_axes(ax)
+    job_queue = JobQueue(JOBS_DB_PATH)
+    if JOB_WORKERS <= 0:
+        print("⚠️ No job workers started (JOB_WORKERS=0); run 'python job_queue.py worker' separately")
+        return
     
-    # Plot spectrogram
-    librosa.display.specshow(
-        mel_spec_db,
-        sr=sr,
-        hop_length=HOP_LENGTH,
-        x_axis='time',
-        y_axis='mel',
-        cmap='inferno',
-        ax=ax
-    )
+    job_workers = start_workers(JOB_WORKERS, JOBS_DB_PATH, MODEL_PATH, CLASS_LABELS_PATH, MODEL_REGISTRY_PATH)
+    atexit.register(stop_job_workers)
+    print(f"✅ Job queue started: {JOB_WORKERS} worker processes, {job_queue.counts()}")
+
+def stop_job_workers():
+    for worker in job_workers:
+        worker.terminate()
+    for worker in job_workers:
+        worker.wait()
+
+def load_and_preprocess_audio(audio_path, target_sr=SAMPLE_RATE, duration=DURATION):
+    """Load audio and cut its most energetic fixed-length window (raises SilentAudioError)"""
+    return load_active_clip(audio_path, target_sr, duration)
+
+def render_spectrogram_png(audio_path):
+    """Audio file -> spectrogram PNG bytes (lookup-table renderer, same image as training)"""
+    y, sr = load_and_preprocess_audio(audio_path)
+    mel_spec = librosa.feature.melspectrogram(y=y, sr=sr, n_mels=N_MELS, hop_length=HOP_LENGTH, fmax=sr//2)
+    mel_spec_db = librosa.power_to_db(mel_spec, ref=np.max)
+    return spectrogram_png_bytes(render_spectrogram(mel_spec_db, sr, HOP_LENGTH))
+
+def audio_to_model_input(audio_path):
+    """Audio file -> normalized spectrogram image batch, exactly as used in training"""
+    if preprocess_pool is not None:
+        return preprocess_pool.preprocess(audio_path)
     
-    # Save
-    plt.savefig(save_path, dpi=72, bbox_inches='tight', pad_inches=0)
-    plt.close()
+    # Same pipeline on the request thread, rendered in memory
+    return audio_to_image_array(audio_path, PREPROCESS_PARAMS)[np.newaxis]
 
-def load_and_preprocess_image(image_path, target_size=IMG_SIZE):
-    """Load and preprocess spectrogram image for model"""
-    # Load image
-    img = keras.preprocessing.image.load_img(image_path, target_size=target_size)
+def iter_model_inputs(audio_paths):
+    """Yield (path, img_array, error) for many files; in parallel when the pool is running"""
+    if preprocess_pool is not None:
+        yield from preprocess_pool.iter_preprocessed(audio_paths)
+        return
     
-    # Convert to array
-    img_array = keras.preprocessing.image.img_to_array(img)
+    for audio_path in audio_paths:
+        try:
+            yield audio_path, audio_to_model_input(audio_path), None
+        except Exception as e:
+            yield audio_path, None, e
+
+def format_prediction(probabilities, current, stage='full'):
+    """Softmax output for one clip -> response dict (current is the ServingModel that produced it)"""
+    class_labels = current.class_labels
+    predicted_class_idx = np.argmax(probabilities)
+    predicted_class = class_labels[str(predicted_class_idx)]
+    confidence = float(probabilities[predicted_class_idx]) * 100
     
-    # Normalize
-    img_array = img_array / 255.0
+    # Get all probabilities
+    all_probabilities = {
+        class_labels[str(i)]: float(probabilities[i]) * 100 
+        for i in range(len(class_labels))
+    }
     
-    # Add batch dimension
-    img_array = np.expand_dims(img_array, axis=0)
+    # Sort by probability
+    sorted_probs = dict(sorted(all_probabilities.items(), key=lambda x: x[1], reverse=True))
     
-    return img_array
+    return {
+        'success': True,
+        'predicted_animal': predicted_class,
+        'confidence': confidence,
+        'all_probabilities': sorted_probs,
+        'model_stage': stage,
+        'model_version': current.version
+    }
+
+def no_sound_result():
+    """Response for a clip the silence gate rejected; the model is not run"""
+    count_metric('silent_skipped')
+    return {
+        'success': True,
+        'no_sound': True,
+        'predicted_animal': None,
+        'confidence': 0.0,
+        'all_probabilities': {}
+    }
 
 def predict_animal(audio_path):
     """Predict animal from audio file"""
     try:
-        # Load and preprocess audio
-        y, sr = load_and_preprocess_audio(audio_path)
+        img_array = audio_to_model_input(audio_path)
         
-        # Generate spectrogram
-        generate_spectrogram_image(y, sr, TEMP_SPEC_PATH)
-        
-        # Load spectrogram image
-        img_array = load_and_preprocess_image(TEMP_SPEC_PATH)
-        
-        # Make prediction
-        predictions = model.predict(img_array, verbose=0)
-        predicted_class_idx = np.argmax(predictions[0])
-        predicted_class = class_labels[str(predicted_class_idx)]
-        confidence = float(predictions[0][predicted_class_idx]) * 100
-        
-        # Clean up temp file
-        if TEMP_SPEC_PATH.exists():
-            TEMP_SPEC_PATH.unlink()
-        
-        # Get all probabilities
-        all_probabilities = {
-            class_labels[str(i)]: float(predictions[0][i]) * 100 
-            for i in range(len(class_labels))
+        # Make prediction (take the handle once, so a concurrent swap can't mix versions)
+        current = serving
+        predictions, stages = current.classify(img_array)
+        count_metric('predictions')
+        return format_prediction(predictions[0], current, stages[0])
+    
+    except SilentAudioError:
+        return no_sound_result()
+    except Exception as e:
+        print(f"Error in prediction: {e}")
+        traceback.print_exc()
+        return {
+            'success': False,
+            'error': str(e)
         }
+
+def find_similar(audio_path, current, k=DEFAULT_TOP_K, method='exact'):
+    """Find the k dataset clips whose embeddings (under serving model current) are closest to the audio file"""
+    try:
+        img_array = audio_to_model_input(audio_path)
+        query = get_embedding_model(current).predict(img_array, verbose=0)[0]
         
-        # Sort by probability
-        sorted_probs = dict(sorted(all_probabilities.items(), key=lambda x: x[1], reverse=True))
+        start = time.perf_counter()
+        neighbours = similarity_index.search(query, k=k, method=method)
+        search_ms = (time.perf_counter() - start) * 1000
         
         return {
             'success': True,
-            'predicted_animal': predicted_class,
-            'confidence': confidence,
-            'all_probabilities': sorted_probs
+            'method': method,
+            'search_ms': search_ms,
+            'neighbours': neighbours
         }
     
     except Exception as e:
-        print(f"Error in prediction: {e}")
+        print(f"Error in similarity search: {e}")
         traceback.print_exc()
         return {
             'success': False,
             'error': str(e)
         }
 
+def save_upload():
+    """Validate and save the 'audio' upload; returns (filepath, None) or (None, error response)"""
+    # Check if file is present
+    if 'audio' not in request.files:
+        return None, (jsonify({'success': False, 'error': 'No file uploaded'}), 400)
+    
+    file = request.files['audio']
+    
+    # Check if file is selected
+    if file.filename == '':
+        return None, (jsonify({'success': False, 'error': 'No file selected'}), 400)
+    
+    # Check file extension
+    if not allowed_file(file.filename):
+        return None, (jsonify({
+            'success': False, 
+            'error': f'Invalid file type. Allowed: {", ".join(ALLOWED_EXTENSIONS)}'
+        }), 400)
+    
+    # Save file
+    filename = secure_filename(file.filename)
+    filepath = UPLOAD_FOLDER / filename
+    file.save(filepath)
+    return filepath, None
+
+class UploadLimitError(Exception):
+    """A batch upload exceeded MAX_BATCH_FILES or MAX_BATCH_BYTES"""
+
+def save_batch_upload(batch_dir):
+    """
+    Save every 'audio' file (and the allowed members of any .zip upload) into batch_dir.
+    Returns ([(display name, path)], None) or (None, error response).
+    """
+    uploads = request.files.getlist('audio') + request.files.getlist('archive')
+    if not uploads:
+        return None, (jsonify({'success': False, 'error': 'No files uploaded'}), 400)
+    
+    saved = []
+    total_bytes = 0
+    
+    def add(name, path):
+        saved.append((name, path))
+        if len(saved) > MAX_BATCH_FILES:
+            raise UploadLimitError(f'Too many files (max {MAX_BATCH_FILES})')
+    
+    try:
+        for file in uploads:
+            if file.filename.lower().endswith('.zip'):
+                with zipfile.ZipFile(file.stream) as archive:
+                    for info in archive.infolist():
+                        if info.is_dir() or not allowed_file(info.filename):
+                            continue
+                        # Declared sizes are checked before extracting anything (zip bombs)
+                        total_bytes += info.file_size
+                        if total_bytes > MAX_BATCH_BYTES:
+                            raise UploadLimitError(f'Archive content too large (max {MAX_BATCH_BYTES // (1024 * 1024)} MB)')
+                        path = batch_dir / f"{len(saved):05d}_{secure_filename(Path(info.filename).name)}"
+                        with archive.open(info) as src, open(path, 'wb') as dst:
+                            shutil.copyfileobj(src, dst)
+                        add(info.filename, path)
+            elif allowed_file(file.filename):
+                path = batch_dir / f"{len(saved):05d}_{secure_filename(file.filename)}"
+                file.save(path)
+                add(file.filename, path)
+    except UploadLimitError as e:
+        return None, (jsonify({'success': False, 'error': str(e)}), 413)
+    except zipfile.BadZipFile as e:
+        return None, (jsonify({'success': False, 'error': f'Invalid zip archive: {e}'}), 400)
+    
+    if not saved:
+        return None, (jsonify({
+            'success': False,
+            'error': f'No supported audio files. Allowed: {", ".join(ALLOWED_EXTENSIONS)}'
+        }), 400)
+    return saved, None
+
+def stream_batch_predictions(saved, batch_dir):
+    """Preprocess in parallel, run batched inference, yield one NDJSON line per file"""
+    names = {path: name for name, path in saved}
+    pending = []
+    current = serving  # The whole stream is scored by one model version
+    
+    def flush():
+        batch = np.concatenate([arr for _, arr in pending])
+        predictions, stages = current.classify(batch)
+        count_metric('predictions', len(batch))
+        lines = []
+        for (path, _), probabilities, stage in zip(pending, predictions, stages):
+            result = format_prediction(probabilities, current, stage)
+            result['file'] = names[path]
+            lines.append(json.dumps(result) + "\n")
+        pending.clear()
+        return "".join(lines)
+    
+    try:
+        for path, img_array, error in iter_model_inputs([path for _, path in saved]):
+            if isinstance(error, SilentAudioError):
+                yield json.dumps(dict(no_sound_result(), file=names[path])) + "\n"
+                continue
+            if error is not None:
+                message = str(error) or type(error).__name__
+                yield json.dumps({'file': names[path], 'success': False, 'error': message}) + "\n"
+                continue
+            pending.append((path, img_array))
+            if len(pending) >= INFERENCE_BATCH_SIZE:
+                yield flush()
+        if pending:
+            yield flush()
+    finally:
+        shutil.rmtree(batch_dir, ignore_errors=True)
+
 @app.route('/')
 def index():
     """Serve the main HTML page"""
     return send_from_directory('static', 'index.html')
 
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(error):
+    return too_large_response(request.max_content_length or MAX_BATCH_BYTES)
+
 @app.route('/predict', methods=['POST'])
+@admitted()
 def predict():
     """Handle audio file upload and prediction"""
     try:
-        # Check if file is present
-        if 'audio' not in request.files:
-            return jsonify({'success': False, 'error': 'No file uploaded'}), 400
+        filepath, error = save_upload()
+        if error:
+            return error
         
-        file = request.files['audio']
+        # Make prediction
+        result = predict_animal(filepath)
         
-        # Check if file is selected
-        if file.filename == '':
-            return jsonify({'success': False, 'error': 'No file selected'}), 400
+        # Clean up uploaded file
+        if filepath.exists():
+            filepath.unlink()
         
-        # Check file extension
-        if not allowed_file(file.filename):
+        return jsonify(result)
+    
+    except Exception as e:
+        print(f"Error in /predict endpoint: {e}")
+        traceback.print_exc()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/predict_batch', methods=['POST'])
+def predict_batch():
+    """
+    Predict many clips in one request: repeated 'audio' files and/or a .zip upload.
+    Streams one JSON object per file (NDJSON) as results complete.
+    """
+    # Reject oversized bodies and excess load before reading them
+    if request.content_length is not None and request.content_length > MAX_BATCH_BYTES:
+        return too_large_response(MAX_BATCH_BYTES)
+    try:
+        started = admission.acquire()
+    except Overloaded as e:
+        return overloaded_response(e)
+    
+    batch_dir = Path(tempfile.mkdtemp(prefix="batch_", dir=UPLOAD_FOLDER))
+    try:
+        saved, error = save_batch_upload(batch_dir)
+    except Exception as e:
+        shutil.rmtree(batch_dir, ignore_errors=True)
+        admission.release(started)
+        if isinstance(e, RequestEntityTooLarge):
+            return too_large_response(MAX_BATCH_BYTES)
+        print(f"Error in /predict_batch endpoint: {e}")
+        traceback.print_exc()
+        return jsonify({'success': False, 'error': str(e)}), 500
+    if error:
+        shutil.rmtree(batch_dir, ignore_errors=True)
+        admission.release(started)
+        return error
+    
+    # The slot is held until the stream finishes (or the client goes away)
+    def on_close():
+        shutil.rmtree(batch_dir, ignore_errors=True)
+        admission.release(started)
+    
+    response = Response(stream_batch_predictions(saved, batch_dir), mimetype='application/x-ndjson')
+    response.call_on_close(on_close)
+    return response
+
+@app.route('/jobs', methods=['POST'])
+@admitted(MAX_BATCH_BYTES)
+def submit_job():
+    """
+    Queue audio files (repeated 'audio' fields and/or a .zip 'archive') for background
+    prediction and return a job id at once. Options: priority (higher runs first),
+    windowed=1 to score every window of long recordings, hop (seconds between windows).
+    """
+    if job_queue is None:
+        return jsonify({'success': False, 'error': 'Job queue not running'}), 503
+    
+    counts = job_queue.counts()
+    if counts.get('queued', 0) >= MAX_QUEUED_JOBS:
+        return overloaded_response(Overloaded('Job queue is full', retry_after=60))
+    
+    try:
+        priority = int(request.values.get('priority', 0))
+        hop_seconds = float(request.values.get('hop', DURATION / 2))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'priority must be an integer and hop a number'}), 400
+    if hop_seconds <= 0:
+        return jsonify({'success': False, 'error': 'hop must be positive'}), 400
+    priority = min(max(priority, JOB_PRIORITY_RANGE[0]), JOB_PRIORITY_RANGE[1])
+    windowed = request.values.get('windowed', '0').lower() in ('1', 'true', 'yes')
+    
+    job_id = uuid.uuid4().hex
+    upload_dir = job_dir(job_id, JOBS_FOLDER)
+    upload_dir.mkdir(parents=True)
+    try:
+        saved, error = save_batch_upload(upload_dir)
+    except Exception as e:
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        if isinstance(e, RequestEntityTooLarge):
+            return too_large_response(MAX_BATCH_BYTES)
+        print(f"Error in /jobs endpoint: {e}")
+        traceback.print_exc()
+        return jsonify({'success': False, 'error': str(e)}), 500
+    if error:
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        return error
+    
+    job_queue.submit({
+        'files': [{'name': name, 'path': str(path)} for name, path in saved],
+        'windowed': windowed,
+        'hop_seconds': hop_seconds
+    }, priority=priority, job_id=job_id)
+    
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status_url': f'/jobs/{job_id}',
+        'files': len(saved)
+    }), 202
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    """Job status and, once done, its results. ?wait=N long-polls up to N seconds for completion."""
+    if job_queue is None:
+        return jsonify({'success': False, 'error': 'Job queue not running'}), 503
+    
+    wait = min(max(request.args.get('wait', 0, type=float), 0), MAX_JOB_WAIT)
+    job = job_queue.wait(job_id, wait) if wait > 0 else job_queue.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Unknown or expired job'}), 404
+    return jsonify(dict(job, success=True))
+
+@app.route('/metrics')
+def get_metrics():
+    """Counters since startup (clips scored, skipped as silent), admission queue state and the serving model version"""
+    with metrics_lock:
+        counters = dict(metrics)
+    jobs = job_queue.counts() if job_queue is not None else {}
+    model_info = serving.info() if serving is not None else {}
+    if model_reloader is not None:
+        model_info['reload'] = model_reloader.status()
+    return jsonify(dict(counters, admission=admission.stats(), jobs=jobs, model=model_info))
+
+@app.route('/cascade_stats')
+def cascade_stats():
+    """Escalation rate and average latency since startup, plus the calibration accuracy"""
+    current = serving
+    if current is None or current.cascade is None:
+        return jsonify({'success': True, 'enabled': False})
+    return jsonify(dict(current.cascade.stats(), success=True, enabled=True, model_version=current.version))
+
+@app.route('/spectrogram', methods=['POST'])
+@admitted()
+def spectrogram():
+    """Return the mel-spectrogram PNG the model would see for an uploaded audio file"""
+    filepath = None
+    try:
+        filepath, error = save_upload()
+        if error:
+            return error
+        return Response(render_spectrogram_png(filepath), mimetype='image/png')
+    
+    except SilentAudioError as e:
+        return jsonify({'success': False, 'no_sound': True, 'error': str(e)}), 422
+    except Exception as e:
+        print(f"Error in /spectrogram endpoint: {e}")
+        traceback.print_exc()
+        return jsonify({'success': False, 'error': str(e)}), 500
+    finally:
+        if filepath is not None and filepath.exists():
+            filepath.unlink()
+
+@app.route('/similar', methods=['POST'])
+@admitted()
+def similar():
+    """Return the top-k most similar dataset clips for an uploaded audio file"""
+    try:
+        if similarity_index is None:
             return jsonify({
-                'success': False, 
-                'error': f'Invalid file type. Allowed: {", ".join(ALLOWED_EXTENSIONS)}'
-            }), 400
+                'success': False,
+                'error': 'Similarity index not built. Run similarity_index.py first.'
+            }), 503
         
-        # Save file
-        filename = secure_filename(file.filename)
-        filepath = UPLOAD_FOLDER / filename
-        file.save(filepath)
+        k = min(max(request.args.get('k', DEFAULT_TOP_K, type=int), 1), MAX_TOP_K)
+        method = request.args.get('method', 'exact')
+        if method not in ('exact', 'ivf'):
+            return jsonify({'success': False, 'error': "method must be 'exact' or 'ivf'"}), 400
         
-        # Make prediction
-        result = predict_animal(filepath)
+        # Embeddings of another model are not comparable with the indexed ones
+        current = serving
+        mismatch = similarity_index_mismatch(current)
+        if mismatch:
+            return jsonify({'success': False, 'error': mismatch, 'model_version': current.version}), 409
+        
+        filepath, error = save_upload()
+        if error:
+            return error
+        
+        result = find_similar(filepath, current, k=k, method=method)
         
         # Clean up uploaded file
         if filepath.exists():
@@ -220,7 +715,7 @@ def predict():
         return jsonify(result)
     
     except Exception as e:
-        print(f"Error in /predict endpoint: {e}")
+        print(f"Error in /similar endpoint: {e}")
         traceback.print_exc()
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -231,13 +726,20 @@ if __name__ == '__main__':
     
     # Load model and labels
     try:
+        start_preprocess_pool()  # First, so worker startup overlaps with loading TensorFlow and the model
         load_model_and_labels()
+        start_model_reloader()
+        load_similarity_index()
+        start_job_queue()
+        if THREAD_PROFILE:
+            print(f"✅ Thread profile applied: {THREAD_PROFILE['intra_op_threads']} intra-op / "
+                  f"{THREAD_PROFILE['inter_op_threads']} inter-op / {THREAD_PROFILE['blas_threads']} BLAS threads")
         print("\n✅ Server ready!")
         print(f"📂 Upload folder: {UPLOAD_FOLDER}")
         print(f"🌐 Open browser to: http://localhost:5000")
         print("=" * 60)
         
-        app.run(debug=True, host='0.0.0.0', port=5000)
+        app.run(debug=True, host='0.0.0.0', port=5000, threaded=True, use_reloader=False)
     except Exception as e:
         print(f"\n❌ Error starting server: {e}")
         traceback.print_exc()
@@ -0,0 +1,77 @@
+"""
+Audio Gate - energy pre-pass before feature extraction
+Skips clearly silent clips (no frame louder than SILENCE_DB) so the model never
+scores near-empty input, and picks the most energetic DURATION-second window
+from longer recordings instead of always taking the first seconds.
+
+Both passes use one cumulative sum of the squared signal, so the energy of every
+frame / window is a vectorized difference instead of a Python loop.
+"""
+
+import numpy as np
+
+SILENCE_DB = -60.0  # Peak frame RMS (dBFS) below which a clip counts as silent
+FRAME_LENGTH = 2048  # Samples per RMS frame for the silence check
+HOP_LENGTH = 512  # Step between candidate frames / windows
+MAX_LOAD_SECONDS = 60  # Only this much of a long file is searched for the active window
+
+class SilentAudioError(Exception):
+    """The clip has no frame louder than SILENCE_DB; there is nothing to classify"""
+
+def _window_energies(y, window_length, hop_length):
+    """(starts, mean energy) of every window_length window, stepping by hop_length"""
+    power = np.concatenate([[0.0], np.cumsum(np.square(y, dtype=np.float64))])
+    last = len(y) - window_length
+    starts = np.arange(0, last + 1, hop_length)
+    if starts[-1] != last:
+        starts = np.append(starts, last)  # Always consider the window that ends the clip
+    return starts, (power[starts + window_length] - power[starts]) / window_length
+
+def peak_rms_db(y, frame_length=FRAME_LENGTH, hop_length=HOP_LENGTH):
+    """Loudest frame's RMS level in dBFS (-inf for digital silence)"""
+    if len(y) == 0:
+        return -np.inf
+    frame_length = min(frame_length, len(y))
+    _, energies = _window_energies(y, frame_length, hop_length)
+    peak = energies.max()
+    return 10 * np.log10(peak) if peak > 0 else -np.inf
+
+def is_silent(y, silence_db=SILENCE_DB):
+    return peak_rms_db(y) < silence_db
+
+def active_window(y, target_length, hop_length=HOP_LENGTH):
+    """Most energetic target_length samples of y; shorter clips are zero-padded"""
+    if len(y) <= target_length:
+        return np.pad(y, (0, target_length - len(y)), mode='constant')
+    starts, energies = _window_energies(y, target_length, hop_length)
+    start = starts[np.argmax(energies)]
+    return y[start:start + target_length]
+
+def load_active_clip(audio_path, target_sr, duration, silence_db=SILENCE_DB, max_seconds=MAX_LOAD_SECONDS):
+    """
+    Load audio and return (fixed-length clip, sr) cut at its most energetic window.
+    Raises SilentAudioError for clearly silent files.
+    """
+    import librosa
+
+    y, sr = librosa.load(audio_path, sr=target_sr, duration=max_seconds)
+    if is_silent(y, silence_db):
+        raise SilentAudioError(f"No sound detected (peak level below {silence_db:.0f} dBFS)")
+    return active_window(y, target_sr * duration), sr
+
+def load_windows(audio_path, target_sr, duration, hop_seconds, silence_db=SILENCE_DB, max_seconds=None):
+    """
+    Load a long recording and cut it into fixed-length windows every hop_seconds.
+    Returns (start times in seconds, (n, samples) window array) for the non-silent windows.
+    """
+    import librosa
+
+    y, sr = librosa.load(audio_path, sr=target_sr, duration=max_seconds)
+    window_length = target_sr * duration
+    if len(y) < window_length:
+        y = np.pad(y, (0, window_length - len(y)), mode='constant')
+    hop_length = max(1, int(hop_seconds * target_sr))
+    windows = np.lib.stride_tricks.sliding_window_view(y, window_length)[::hop_length]
+    starts = np.arange(len(windows)) * hop_length / target_sr
+    keep = np.array([not is_silent(w, silence_db) for w in windows], dtype=bool)
+    return starts[keep], windows[keep]
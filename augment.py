@@ -0,0 +1,184 @@
+"""
+Audio Augmentation - vectorized training augmentation on whole batches
+Works on (B, samples) waveform batches and (B, n_mels, frames) dB mel batches
+with NumPy broadcasting, so one call augments a full training batch without
+per-clip Python loops:
+
+    waveform:  time shift (zero-filled), foreground gain, background-noise mixing
+    log-mel:   SpecAugment-style time and frequency masks
+
+Spectrograms are normalized to their own peak, so gain on its own changes
+nothing; it matters relative to the background noise, which is mixed in at an
+absolute level.
+
+Decoded training clips are kept in a memory-mapped cache (one float32 row per
+clip) so each epoch reads waveforms straight from the page cache instead of
+decoding audio again.
+"""
+
+from pathlib import Path
+import numpy as np
+import hashlib
+import json
+import os
+
+# Default augmentation strengths
+MAX_SHIFT_SECONDS = 0.5
+GAIN_DB_RANGE = (-12.0, 6.0)
+NOISE_DBFS_RANGE = (-60.0, -25.0)  # RMS level of the mixed-in background
+NOISE_PROBABILITY = 0.5
+TIME_MASKS = 2
+TIME_MASK_MAX = 20  # Frames per mask
+FREQ_MASKS = 2
+FREQ_MASK_MAX = 16  # Mel bands per mask
+
+def _rms(x):
+    return np.sqrt(np.mean(np.square(x), axis=-1, keepdims=True) + 1e-12)
+
+def time_shift(clips, max_shift, rng):
+    """Shift each clip by up to ±max_shift samples, zero-filling the gap"""
+    n = clips.shape[1]
+    shifts = rng.integers(-max_shift, max_shift + 1, size=len(clips))
+    source = np.arange(n)[np.newaxis] - shifts[:, np.newaxis]
+    valid = (source >= 0) & (source < n)
+    return np.where(valid, np.take_along_axis(clips, np.clip(source, 0, n - 1), axis=1), 0).astype(clips.dtype)
+
+def random_gain(clips, gain_db_range, rng):
+    gain_db = rng.uniform(*gain_db_range, size=(len(clips), 1))
+    return (clips * 10 ** (gain_db / 20)).astype(clips.dtype)
+
+def mix_noise(clips, noise_dbfs_range, probability, rng, noise_bank=None):
+    """
+    Add background noise at a random absolute RMS level to a random subset of clips.
+    Noise comes from random segments of noise_bank (1-D array), or is white noise.
+    """
+    batch, n = clips.shape
+    if noise_bank is not None and len(noise_bank) > n:
+        starts = rng.integers(0, len(noise_bank) - n, size=batch)
+        noise = noise_bank[starts[:, np.newaxis] + np.arange(n)]
+    else:
+        noise = rng.standard_normal((batch, n)).astype(clips.dtype)
+    level = 10 ** (rng.uniform(*noise_dbfs_range, size=(batch, 1)) / 20)
+    apply = rng.random((batch, 1)) < probability
+    return (clips + np.where(apply, noise * (level / _rms(noise)), 0)).astype(clips.dtype)
+
+def _band_masks(batch, size, count, max_width, rng):
+    """(batch, size) bool: union of count random bands of up to max_width per row"""
+    positions = np.arange(size)
+    masked = np.zeros((batch, size), dtype=bool)
+    for _ in range(count):
+        widths = rng.integers(0, max_width + 1, size=(batch, 1))
+        starts = rng.integers(0, np.maximum(size - widths, 0) + 1)
+        masked |= (positions >= starts) & (positions < starts + widths)
+    return masked
+
+def spec_augment(mel_specs_db, rng, time_masks=TIME_MASKS, time_mask_max=TIME_MASK_MAX,
+                 freq_masks=FREQ_MASKS, freq_mask_max=FREQ_MASK_MAX):
+    """SpecAugment time/frequency masking; masked cells get each clip's floor value"""
+    batch, n_mels, n_frames = mel_specs_db.shape
+    floor = mel_specs_db.min(axis=(1, 2), keepdims=True)
+    freq = _band_masks(batch, n_mels, freq_masks, freq_mask_max, rng)[:, :, np.newaxis]
+    time = _band_masks(batch, n_frames, time_masks, time_mask_max, rng)[:, np.newaxis, :]
+    return np.where(freq | time, floor, mel_specs_db)
+
+class BatchAugmenter:
+    """Waveform + log-mel augmentation for (B, samples) batches, producing model inputs"""
+
+    def __init__(self, sr, n_mels, hop_length, img_size, noise_bank=None,
+                 max_shift_seconds=MAX_SHIFT_SECONDS, gain_db_range=GAIN_DB_RANGE,
+                 noise_dbfs_range=NOISE_DBFS_RANGE, noise_probability=NOISE_PROBABILITY,
+                 time_masks=TIME_MASKS, time_mask_max=TIME_MASK_MAX,
+                 freq_masks=FREQ_MASKS, freq_mask_max=FREQ_MASK_MAX):
+        self.sr = sr
+        self.n_mels = n_mels
+        self.hop_length = hop_length
+        self.img_size = tuple(img_size)
+        self.noise_bank = noise_bank
+        self.max_shift = int(max_shift_seconds * sr)
+        self.gain_db_range = gain_db_range
+        self.noise_dbfs_range = noise_dbfs_range
+        self.noise_probability = noise_probability
+        self.mask_params = dict(time_masks=time_masks, time_mask_max=time_mask_max,
+                                freq_masks=freq_masks, freq_mask_max=freq_mask_max)
+
+    def augment_waveforms(self, clips, rng):
+        clips = time_shift(clips, self.max_shift, rng)
+        clips = random_gain(clips, self.gain_db_range, rng)
+        return mix_noise(clips, self.noise_dbfs_range, self.noise_probability, rng, self.noise_bank)
+
+    def __call__(self, clips, rng):
+        """(B, samples) clean clips -> (B, H, W, 3) augmented model inputs"""
+        from spectrogram_renderer import batch_log_mel, render_model_inputs
+
+        mel_specs_db = batch_log_mel(self.augment_waveforms(clips, rng), self.sr, self.n_mels, self.hop_length)
+        mel_specs_db = spec_augment(mel_specs_db, rng, **self.mask_params)
+        return render_model_inputs(mel_specs_db, self.sr, self.hop_length, self.img_size)
+
+def load_waveform_cache(audio_paths, cache_dir, sr, duration):
+    """
+    Decode clips once (active window, like spectrogram generation) into a memory-mapped
+    (N, sr * duration) float32 array; reused while the files (path, size, mtime) and
+    settings match. Caches for older file lists are deleted once the new one is written.
+    Returns (waveforms, ok) where ok marks clips that decoded and were not silent.
+    """
+    from tqdm import tqdm
+    from audio_gate import load_active_clip
+
+    audio_paths = [str(p) for p in audio_paths]
+    signature = [(p, *_file_stamp(p)) for p in audio_paths]
+    key = hashlib.sha1(json.dumps([signature, sr, duration]).encode()).hexdigest()[:12]
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    data_path = cache_dir / f"waveforms_{key}.npy"
+    ok_path = cache_dir / f"waveforms_{key}_ok.npy"
+    if data_path.exists() and ok_path.exists():
+        return np.load(data_path, mmap_mode='r'), np.load(ok_path)
+
+    tmp_path = cache_dir / f"waveforms_{key}.tmp.npy"
+    waveforms = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32,
+                                          shape=(len(audio_paths), sr * duration))
+    ok = np.zeros(len(audio_paths), dtype=bool)
+    for i, path in enumerate(tqdm(audio_paths, desc="Decoding audio")):
+        try:
+            waveforms[i], _ = load_active_clip(path, sr, duration)
+            ok[i] = True
+        except Exception:
+            waveforms[i] = 0
+    waveforms.flush()
+    del waveforms
+    os.replace(tmp_path, data_path)
+    np.save(ok_path, ok)
+    _prune_waveform_caches(cache_dir, key)
+    return np.load(data_path, mmap_mode='r'), ok
+
+def _file_stamp(path):
+    """(size, mtime_ns) of an audio file; (None, None) if it is missing"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None, None
+    return st.st_size, st.st_mtime_ns
+
+def _prune_waveform_caches(cache_dir, keep_key):
+    """Delete cache files of other keys (older file lists, leftover temp files)"""
+    for path in cache_dir.glob("waveforms_*.npy"):
+        if path.name.split('_')[1].split('.')[0] == keep_key:
+            continue
+        try:
+            path.unlink()
+        except OSError:
+            pass  # Still mapped by another process (Windows); removed next time
+
+def load_noise_bank(noise_dir, sr, max_seconds=600):
+    """Concatenate background recordings from noise_dir into one 1-D array (None if empty)"""
+    import librosa
+    from dataset_index import load_index
+
+    pieces, total = [], 0
+    for entry in load_index(Path(noise_dir), probe=False).entries():
+        y, _ = librosa.load(entry.path, sr=sr, duration=max_seconds - total / sr)
+        pieces.append(y.astype(np.float32))
+        total += len(y)
+        if total >= max_seconds * sr:
+            break
+    return np.concatenate(pieces) if pieces else None
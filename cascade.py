@@ -0,0 +1,246 @@
+"""
+Model Cascade - confidence-gated two-stage inference
+A small first-stage CNN answers when its top softmax probability reaches a calibrated
+threshold; only uncertain clips are escalated to the full model from '2_train_model.py'.
+
+Usage:
+    python cascade.py train       # train the small first-stage model on the spectrograms
+    python cascade.py calibrate   # pick the threshold on the validation split
+"""
+
+from pathlib import Path
+import numpy as np
+import json
+import time
+import threading
+import argparse
+
+# ========== CONFIGURATION ==========
+PROJECT_PATH = Path(r"C:\Users\sasik\OneDrive\Documents\AnimalVoicedetection")
+SPECTROGRAM_PATH = PROJECT_PATH / "spectrograms_dataset"
+MODEL_OUTPUT_PATH = PROJECT_PATH / "trained_model"
+FULL_MODEL_FILE = MODEL_OUTPUT_PATH / "animal_sound_classifier.h5"
+STAGE1_MODEL_FILE = MODEL_OUTPUT_PATH / "cascade_stage1.h5"
+CASCADE_CONFIG_FILE = MODEL_OUTPUT_PATH / "cascade.json"
+
+IMG_SIZE = (128, 128)
+BATCH_SIZE = 32
+EPOCHS = 30
+VALIDATION_SPLIT = 0.2
+LEARNING_RATE = 0.001
+MAX_ACCURACY_DROP = 0.01  # Calibrated cascade may lose at most this much accuracy vs. the full model
+
+def build_small_model(input_shape, num_classes):
+    """Cheap first-stage CNN: downsample early, few filters, global pooling instead of big Dense layers"""
+    from tensorflow.keras import layers, models
+
+    return models.Sequential([
+        layers.Input(shape=input_shape),
+        layers.AveragePooling2D((2, 2)),
+        layers.Conv2D(16, (3, 3), activation='relu', padding='same'),
+        layers.MaxPooling2D((2, 2)),
+        layers.Conv2D(32, (3, 3), activation='relu', padding='same'),
+        layers.MaxPooling2D((2, 2)),
+        layers.Conv2D(64, (3, 3), activation='relu', padding='same'),
+        layers.GlobalAveragePooling2D(),
+        layers.Dropout(0.3),
+        layers.Dense(num_classes, activation='softmax')
+    ])
+
+class CascadeClassifier:
+    """
+    Drop-in for a Keras model's predict(): returns the first stage's probabilities where it
+    is confident and the full model's elsewhere, and keeps escalation/latency statistics.
+    """
+
+    def __init__(self, stage1_model, full_model, threshold, calibration=None):
+        self.stage1_model = stage1_model
+        self.full_model = full_model
+        self.threshold = float(threshold)
+        self.calibration = calibration or {}
+        self.lock = threading.Lock()
+        self.reset_stats()
+
+    @classmethod
+    def load(cls, full_model, config_file=CASCADE_CONFIG_FILE):
+        """Load the first stage and threshold saved by 'cascade.py calibrate'"""
+        from model_export import load_inference_model
+
+        config_file = Path(config_file)
+        with open(config_file, 'r') as f:
+            config = json.load(f)
+        stage1 = load_inference_model(config_file.parent / config['stage1_model'])
+        return cls(stage1, full_model, config['threshold'], config.get('calibration'))
+
+    def reset_stats(self):
+        self.samples = 0
+        self.escalated = 0
+        self.seconds = 0.0
+
+    def classify(self, batch):
+        """Returns (probabilities, escalated mask) for a batch of spectrogram images"""
+        start = time.perf_counter()
+        probabilities = np.array(self.stage1_model.predict(batch, verbose=0))
+        escalated = probabilities.max(axis=1) < self.threshold
+        if escalated.any():
+            probabilities[escalated] = self.full_model.predict(batch[escalated], verbose=0)
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.samples += len(batch)
+            self.escalated += int(escalated.sum())
+            self.seconds += elapsed
+        return probabilities, escalated
+
+    def predict(self, batch, verbose=0):
+        return self.classify(batch)[0]
+
+    def stats(self):
+        """Escalation rate, average latency and the accuracy measured at calibration"""
+        return {
+            'threshold': self.threshold,
+            'samples': self.samples,
+            'escalated': self.escalated,
+            'escalation_rate': self.escalated / self.samples if self.samples else 0.0,
+            'avg_latency_ms': self.seconds / self.samples * 1000 if self.samples else 0.0,
+            'calibration': self.calibration
+        }
+
+def print_stats(stats):
+    """Console report of a CascadeClassifier's stats()"""
+    print(f"\n🪜 Cascade (threshold {stats['threshold']:.4f}):")
+    print(f"  Clips: {stats['samples']}, escalated to full model: {stats['escalated']} "
+          f"({stats['escalation_rate']*100:.1f}%)")
+    print(f"  Average latency: {stats['avg_latency_ms']:.2f} ms per clip (model inference only)")
+    calibration = stats['calibration']
+    if calibration:
+        print(f"  Validation accuracy - cascade: {calibration['cascade_accuracy']*100:.2f}%, "
+              f"full model: {calibration['full_accuracy']*100:.2f}%")
+
+def calibrate_threshold(stage1_probs, full_probs, y_true, max_accuracy_drop=MAX_ACCURACY_DROP):
+    """
+    Lowest threshold (= fewest escalations) whose cascade accuracy on labelled data stays
+    within max_accuracy_drop of the full model. Returns (threshold, report dict).
+    """
+    stage1_conf = stage1_probs.max(axis=1)
+    stage1_correct = stage1_probs.argmax(axis=1) == y_true
+    full_correct = full_probs.argmax(axis=1) == y_true
+    full_accuracy = float(full_correct.mean())
+
+    # Candidate thresholds: every observed confidence, plus 1.0+ (always escalate)
+    candidates = np.unique(np.concatenate([stage1_conf, [np.nextafter(1.0, 2.0)]]))
+    best = None
+    for threshold in candidates:
+        accept = stage1_conf >= threshold
+        accuracy = float(np.where(accept, stage1_correct, full_correct).mean())
+        if accuracy >= full_accuracy - max_accuracy_drop:
+            best = (float(threshold), accuracy, float(1 - accept.mean()))
+            break
+    threshold, accuracy, escalation_rate = best
+
+    return threshold, {
+        'samples': int(len(y_true)),
+        'full_accuracy': full_accuracy,
+        'stage1_accuracy': float(stage1_correct.mean()),
+        'cascade_accuracy': accuracy,
+        'escalation_rate': escalation_rate
+    }
+
+def load_split():
+    """Train/validation DataFrames with the same per-class split as '2_train_model.py'"""
+    import pandas as pd
+    from dataset_index import DatasetIndex, IMAGE_EXTENSIONS
+
+    index = DatasetIndex(SPECTROGRAM_PATH, IMAGE_EXTENSIONS, label_from='parent', probe=False).refresh()
+    df = pd.DataFrame([(e.path, e.label) for e in index.entries() if e.label], columns=['filename', 'class'])
+    position = df.groupby('class').cumcount()
+    size = df.groupby('class')['class'].transform('size')
+    is_validation = position < (size * VALIDATION_SPLIT).astype(int)
+    return df[~is_validation], df[is_validation], index.labels()
+
+def train_stage1():
+    from tensorflow import keras
+    from tensorflow.keras.preprocessing.image import ImageDataGenerator
+
+    train_df, val_df, classes = load_split()
+    datagen = ImageDataGenerator(rescale=1./255)
+    common = dict(x_col='filename', y_col='class', classes=classes, validate_filenames=False,
+                  target_size=IMG_SIZE, batch_size=BATCH_SIZE, class_mode='categorical')
+    train_generator = datagen.flow_from_dataframe(train_df, shuffle=True, seed=42, **common)
+    validation_generator = datagen.flow_from_dataframe(val_df, shuffle=False, **common)
+
+    model = build_small_model((*IMG_SIZE, 3), len(classes))
+    model.compile(optimizer=keras.optimizers.Adam(learning_rate=LEARNING_RATE),
+                  loss='categorical_crossentropy', metrics=['accuracy'])
+    print(f"📊 First-stage parameters: {model.count_params():,}")
+    model.fit(
+        train_generator,
+        epochs=EPOCHS,
+        validation_data=validation_generator,
+        callbacks=[
+            keras.callbacks.ModelCheckpoint(STAGE1_MODEL_FILE, monitor='val_accuracy',
+                                            save_best_only=True, mode='max', verbose=1),
+            keras.callbacks.EarlyStopping(monitor='val_loss', patience=8, restore_best_weights=True)
+        ],
+        verbose=1
+    )
+    print(f"✅ First-stage model saved: {STAGE1_MODEL_FILE}")
+
+def calibrate(max_accuracy_drop=MAX_ACCURACY_DROP):
+    from tensorflow import keras
+    from tensorflow.keras.preprocessing.image import ImageDataGenerator
+
+    _, val_df, classes = load_split()
+    generator = ImageDataGenerator(rescale=1./255).flow_from_dataframe(
+        val_df, x_col='filename', y_col='class', classes=classes, validate_filenames=False,
+        target_size=IMG_SIZE, batch_size=BATCH_SIZE, class_mode='categorical', shuffle=False
+    )
+    stage1 = keras.models.load_model(STAGE1_MODEL_FILE)
+    full = keras.models.load_model(FULL_MODEL_FILE)
+
+    stage1_probs = stage1.predict(generator, verbose=1)
+    full_probs = full.predict(generator, verbose=1)
+    threshold, report = calibrate_threshold(stage1_probs, full_probs, generator.classes, max_accuracy_drop)
+
+    # Timing of each stage on one validation batch, to show the expected speed-up
+    batch = generator[0][0]
+    for name, m in (('stage1', stage1), ('full', full)):
+        m.predict(batch, verbose=0)
+        start = time.perf_counter()
+        m.predict(batch, verbose=0)
+        report[f'{name}_latency_ms'] = (time.perf_counter() - start) / len(batch) * 1000
+
+    with open(CASCADE_CONFIG_FILE, 'w') as f:
+        json.dump({
+            'stage1_model': STAGE1_MODEL_FILE.name,
+            'threshold': threshold,
+            'calibration': report
+        }, f, indent=4)
+
+    print(f"\n🎚️ Threshold: {threshold:.4f}")
+    print(f"📈 Escalation rate: {report['escalation_rate']*100:.1f}%")
+    print(f"🎯 Accuracy - full: {report['full_accuracy']*100:.2f}%, "
+          f"stage 1: {report['stage1_accuracy']*100:.2f}%, cascade: {report['cascade_accuracy']*100:.2f}%")
+    print(f"⏱️ Latency per clip - stage 1: {report['stage1_latency_ms']:.2f} ms, full: {report['full_latency_ms']:.2f} ms")
+    print(f"✅ Cascade config saved: {CASCADE_CONFIG_FILE}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Train and calibrate the first-stage cascade model")
+    parser.add_argument('command', choices=['train', 'calibrate'])
+    parser.add_argument('--max-accuracy-drop', type=float, default=MAX_ACCURACY_DROP,
+                        help="Accuracy the cascade may lose vs. the full model on validation data")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print(f"MODEL CASCADE - {args.command.upper()}")
+    print("=" * 60)
+
+    if not SPECTROGRAM_PATH.exists():
+        print(f"❌ Spectrogram directory not found: {SPECTROGRAM_PATH}")
+        return
+    if args.command == 'train':
+        train_stage1()
+    else:
+        calibrate(args.max_accuracy_drop)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""
+Dataset Indexer - one os.scandir walk instead of repeated glob/rglob/exists calls
+Builds a persisted manifest of the files under a folder (path, size, mtime, label,
+duration, sample rate) and refreshes it incrementally: directories whose mtime has
+not changed are not listed again, and audio headers are only read for new or changed files.
+
+Usage:
+    python dataset_index.py <folder> [--deep]
+"""
+
+from collections import namedtuple
+from pathlib import Path
+import hashlib
+import json
+import os
+import tempfile
+import argparse
+
+# ========== CONFIGURATION ==========
+PROJECT_PATH = Path(r"C:\Users\sasik\OneDrive\Documents\AnimalVoicedetection")
+INDEX_DIR = PROJECT_PATH / "dataset_index"  # Manifests live here, one per indexed folder
+AUDIO_EXTENSIONS = ('.wav', '.mp3', '.flac', '.ogg', '.m4a', '.aac', '.aif', '.aiff')
+IMAGE_EXTENSIONS = ('.png',)
+PROBE_FAILED = -1  # Stored duration of a file whose header could not be read (None = not probed yet)
+
+IndexEntry = namedtuple('IndexEntry', ['path', 'size', 'mtime_ns', 'label', 'duration', 'sample_rate'])
+
+def label_from_filename(rel_path):
+    """'Lion_1.wav' -> 'Lion' (same convention as extract_label); '' if there is no label"""
+    name = rel_path.rsplit('/', 1)[-1]
+    return name.split('_')[0] if '_' in name else ''
+
+def label_from_parent(rel_path):
+    """'Lion/Lion_1_spec.png' -> 'Lion' (class-per-folder layout)"""
+    return rel_path.rsplit('/', 1)[0] if '/' in rel_path else ''
+
+LABELERS = {'filename': label_from_filename, 'parent': label_from_parent}
+
+def probe_audio(path):
+    """(duration seconds, sample rate) from the file header, or (None, None)"""
+    try:
+        import soundfile as sf
+        info = sf.info(path)
+        return info.frames / info.samplerate, info.samplerate
+    except Exception:
+        return None, None
+
+def manifest_path_for(root, extensions):
+    """Manifest location for a folder; kept outside the (possibly read-only) dataset"""
+    key = hashlib.sha1(f"{Path(root).resolve()}|{','.join(extensions)}".encode()).hexdigest()[:12]
+    return INDEX_DIR / f"{Path(root).name or 'root'}_{key}.json"
+
+class DatasetIndex:
+    """Persisted, incrementally refreshed listing of the files under a folder"""
+
+    def __init__(self, root, extensions=AUDIO_EXTENSIONS, label_from='filename', probe=True,
+                 manifest_path=None):
+        self.root = Path(root)
+        self.extensions = tuple(e.lower() for e in extensions)
+        self.labeler = LABELERS[label_from]
+        self.probe = probe
+        self.manifest_path = Path(manifest_path) if manifest_path else manifest_path_for(root, self.extensions)
+        self.dirs = {}
+        self.files = {}
+        if self.manifest_path.exists():
+            with open(self.manifest_path, 'r') as f:
+                manifest = json.load(f)
+            self.dirs = manifest['dirs']
+            self.files = manifest['files']
+
+    def refresh(self, deep=False):
+        """
+        Bring the manifest up to date with the filesystem and save it.
+        deep=True re-stats every file (catches in-place edits that don't touch the dir mtime).
+        """
+        old_dirs, old_files = self.dirs, self.files
+        self.dirs, self.files = {}, {}
+        self.stats = {'listed_dirs': 0, 'reused_dirs': 0, 'probed_files': 0}
+        if self.root.is_dir():
+            self._scan('', old_dirs, old_files, deep)
+        self.save()
+        return self
+
+    def _scan(self, rel_dir, old_dirs, old_files, deep):
+        full_dir = os.path.join(self.root, rel_dir) if rel_dir else str(self.root)
+        mtime_ns = os.stat(full_dir).st_mtime_ns
+        known = old_dirs.get(rel_dir)
+
+        if known is not None and known['mtime_ns'] == mtime_ns and not deep:
+            # Listing unchanged: reuse it without touching the directory
+            self.stats['reused_dirs'] += 1
+            self.dirs[rel_dir] = known
+            for name in known['files']:
+                rel = f"{rel_dir}/{name}" if rel_dir else name
+                if rel in old_files:
+                    self.files[rel] = self._probed(rel, old_files[rel])
+            for sub in known['subdirs']:
+                self._scan(f"{rel_dir}/{sub}" if rel_dir else sub, old_dirs, old_files, deep)
+            return
+
+        self.stats['listed_dirs'] += 1
+        names, subdirs = [], []
+        with os.scandir(full_dir) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                elif entry.is_file() and entry.name.lower().endswith(self.extensions):
+                    names.append(entry.name)
+                    rel = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                    st = entry.stat()
+                    old = old_files.get(rel)
+                    if old is not None and old[0] == st.st_size and old[1] == st.st_mtime_ns:
+                        self.files[rel] = self._probed(rel, old)
+                        continue
+                    duration, sample_rate = None, None
+                    if self.probe:
+                        duration, sample_rate = self._probe(entry.path)
+                    self.files[rel] = [st.st_size, st.st_mtime_ns, self.labeler(rel), duration, sample_rate]
+
+        names.sort()
+        subdirs.sort()
+        self.dirs[rel_dir] = {'mtime_ns': mtime_ns, 'files': names, 'subdirs': subdirs}
+        for sub in subdirs:
+            self._scan(f"{rel_dir}/{sub}" if rel_dir else sub, old_dirs, old_files, deep)
+
+    def _probe(self, path):
+        """Header of a new or changed file; failures are recorded so they are not retried"""
+        duration, sample_rate = probe_audio(path)
+        self.stats['probed_files'] += 1
+        return (PROBE_FAILED, None) if duration is None else (duration, sample_rate)
+
+    def _probed(self, rel, values):
+        """Reused entry, with its header read now if an index built without probing left it empty"""
+        if not self.probe or values[3] is not None:
+            return values
+        return [*values[:3], *self._probe(os.path.join(self.root, rel))]
+
+    def save(self):
+        """
+        Write the manifest atomically. Each save uses its own temp file, so processes refreshing
+        the same folder at once (e.g. sharded batch runs) never replace each other's half-written file.
+        """
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=self.manifest_path.name + ".", suffix=".tmp",
+                                        dir=self.manifest_path.parent)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'root': str(self.root), 'dirs': self.dirs, 'files': self.files}, f)
+            os.replace(tmp_path, self.manifest_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def __len__(self):
+        return len(self.files)
+
+    def __contains__(self, rel_path):
+        return rel_path in self.files
+
+    def entries(self):
+        """All indexed files as IndexEntry tuples, sorted by relative path (duration None if unknown)"""
+        return [IndexEntry(str(self.root / rel), *values[:3], None if values[3] == PROBE_FAILED else values[3],
+                           values[4])
+                for rel, values in sorted(self.files.items())]
+
+    def labels(self):
+        """Sorted distinct labels"""
+        return sorted({values[2] for values in self.files.values() if values[2]})
+
+    def count_by_label(self):
+        counts = {}
+        for values in self.files.values():
+            counts[values[2]] = counts.get(values[2], 0) + 1
+        return counts
+
+def load_index(root, extensions=AUDIO_EXTENSIONS, label_from='filename', probe=True, deep=False):
+    """Load the manifest for root and refresh it incrementally"""
+    return DatasetIndex(root, extensions, label_from, probe).refresh(deep=deep)
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or refresh the dataset manifest for a folder")
+    parser.add_argument('folder', type=Path, help="Folder to index")
+    parser.add_argument('--spectrograms', action='store_true',
+                        help="Index .png spectrograms labelled by folder instead of audio files")
+    parser.add_argument('--deep', action='store_true', help="Re-stat every file, not only changed folders")
+    args = parser.parse_args()
+
+    if args.spectrograms:
+        index = DatasetIndex(args.folder, IMAGE_EXTENSIONS, label_from='parent', probe=False)
+    else:
+        index = DatasetIndex(args.folder)
+    index.refresh(deep=args.deep)
+
+    print(f"✅ Indexed {len(index)} files in {args.folder}")
+    print(f"📁 Folders listed: {index.stats['listed_dirs']}, reused: {index.stats['reused_dirs']}")
+    print(f"🎵 Headers read: {index.stats['probed_files']}")
+    print(f"💾 Manifest: {index.manifest_path}")
+    for label, count in sorted(index.count_by_label().items()):
+        print(f"  {label or 'Unknown':15s}: {count}")
+
+if __name__ == "__main__":
+    main()
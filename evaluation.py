@@ -0,0 +1,306 @@
+"""
+Evaluation - streaming accuracy report for batch prediction outputs
+Accumulates everything the report needs chunk by chunk with np.bincount, so memory
+stays constant however many clips were scored, and the report is the same whether
+the results come from one store, several shard outputs or a partially finished run:
+
+    - confusion matrix (true x predicted label)
+    - per-class precision / recall / F1 with macro and weighted averages
+    - top-k accuracy (rank of the true class in the stored probabilities)
+    - calibration: reliability bins and expected calibration error (ECE)
+    - prediction counts, average confidence, most / least confident clips
+
+Usage:
+    python evaluation.py batch_predictions.csv
+    python evaluation.py batch_predictions.shard-*.csv --json report.json
+"""
+
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import argparse
+import json
+from prediction_store import iter_latest_chunks, NO_SOUND_LABEL, ERROR_LABEL
+
+TOP_K = (1, 3, 5)
+CALIBRATION_BINS = 10
+EXTREMES = 10  # Most / least confident predictions kept for the report
+UNKNOWN_LABEL = 'Unknown'  # true_label of clips whose filename carries no label
+
+class EvaluationAccumulator:
+    """Running totals over result chunks (SCALAR_COLUMNS, optionally prob_<class> columns)"""
+
+    def __init__(self, top_k=TOP_K, bins=CALIBRATION_BINS, extremes=EXTREMES):
+        self.top_k = tuple(sorted(top_k))
+        self.bins = bins
+        self.extremes = extremes
+        self.labels = []  # Every true/predicted label seen, in first-seen order
+        self.label_index = {}
+        self.confusion = np.zeros((0, 0), dtype=np.int64)
+        self.predicted_counts = np.zeros(0, dtype=np.int64)
+        self.class_names = None  # Probability columns, from the first chunk that has them
+        self.rank_counts = np.zeros(max(self.top_k) + 1, dtype=np.int64)  # Last bucket: rank >= max k
+        self.bin_count = np.zeros(bins, dtype=np.int64)
+        self.bin_confidence = np.zeros(bins)
+        self.bin_correct = np.zeros(bins)
+        self.total = 0
+        self.silent = 0
+        self.failed = 0
+        self.labeled = 0
+        self.correct = 0
+        self.confidence_sum = 0.0
+        self.top = None
+        self.bottom = None
+
+    def _codes(self, labels):
+        """Label strings -> indices into self.labels, growing the matrices for new labels"""
+        new = [label for label in pd.unique(labels) if label not in self.label_index]
+        if new:
+            for label in new:
+                self.label_index[label] = len(self.labels)
+                self.labels.append(label)
+            grow = len(self.labels) - len(self.confusion)
+            self.confusion = np.pad(self.confusion, ((0, grow), (0, grow)))
+            self.predicted_counts = np.pad(self.predicted_counts, (0, grow))
+        return pd.Categorical(labels, categories=self.labels).codes.astype(np.int64)
+
+    def update(self, chunk):
+        if len(chunk) == 0:
+            return self  # e.g. pd.DataFrame([]) from a run with no results: no columns at all
+        silent = (chunk['predicted_label'] == NO_SOUND_LABEL).to_numpy()
+        failed = (chunk['predicted_label'] == ERROR_LABEL).to_numpy()
+        self.silent += int(silent.sum())
+        self.failed += int(failed.sum())
+        chunk = chunk[~(silent | failed)]
+        if len(chunk) == 0:
+            return self
+        self.total += len(chunk)
+
+        predicted = self._codes(chunk['predicted_label'].astype(str).to_numpy())
+        n = len(self.labels)
+        self.predicted_counts += np.bincount(predicted, minlength=n)
+        confidence = chunk['confidence'].to_numpy(dtype=np.float64)
+        self.confidence_sum += float(confidence.sum())
+        self._update_extremes(chunk)
+
+        labeled = (chunk['true_label'] != UNKNOWN_LABEL).to_numpy()
+        if not labeled.any():
+            return self
+        true = self._codes(chunk['true_label'].astype(str).to_numpy()[labeled])
+        predicted = predicted[labeled]
+        n = len(self.labels)
+        self.confusion += np.bincount(true * n + predicted, minlength=n * n).reshape(n, n)
+        # Same rule as the stored 'correct' column, without depending on how CSV parsed it
+        labeled_chunk = chunk[labeled]
+        correct = (labeled_chunk['true_label'].astype(str).str.lower()
+                   == labeled_chunk['predicted_label'].astype(str).str.lower()).to_numpy()
+        self.labeled += int(labeled.sum())
+        self.correct += int(correct.sum())
+
+        # Calibration: confidence (0-1) bins vs. how often those predictions were right
+        p = np.clip(confidence[labeled] / 100.0, 0.0, 1.0)
+        bin_index = np.minimum((p * self.bins).astype(np.int64), self.bins - 1)
+        self.bin_count += np.bincount(bin_index, minlength=self.bins)
+        self.bin_confidence += np.bincount(bin_index, weights=p, minlength=self.bins)
+        self.bin_correct += np.bincount(bin_index, weights=correct, minlength=self.bins)
+
+        self._update_top_k(labeled_chunk)
+        return self
+
+    def _update_top_k(self, chunk):
+        """Rank of the true class among the stored probabilities (needs prob_<class> columns)"""
+        prob_columns = [c for c in chunk.columns if c.startswith('prob_')]
+        if not prob_columns:
+            return
+        if self.class_names is None:
+            self.class_names = [c[len('prob_'):] for c in prob_columns]
+        class_index = {name.lower(): i for i, name in enumerate(self.class_names)}
+        true = chunk['true_label'].astype(str).str.lower().map(class_index)
+        known = true.notna().to_numpy()
+        if not known.any():
+            return
+        probs = chunk[prob_columns].to_numpy(dtype=np.float64)[known]
+        true_prob = probs[np.arange(len(probs)), true[known].to_numpy(dtype=np.int64)]
+        rank = (probs > true_prob[:, np.newaxis]).sum(axis=1)
+        self.rank_counts += np.bincount(np.minimum(rank, max(self.top_k)), minlength=len(self.rank_counts))
+
+    def _update_extremes(self, chunk):
+        columns = ['filename', 'predicted_label', 'confidence']
+        top = chunk.nlargest(self.extremes, 'confidence')[columns]
+        bottom = chunk.nsmallest(self.extremes, 'confidence')[columns]
+        if self.top is not None:
+            top = pd.concat([self.top, top]).nlargest(self.extremes, 'confidence')
+            bottom = pd.concat([self.bottom, bottom]).nsmallest(self.extremes, 'confidence')
+        self.top, self.bottom = top, bottom
+
+    def per_class(self):
+        """DataFrame of precision / recall / F1 / support per true or predicted label"""
+        tp = np.diag(self.confusion).astype(np.float64)
+        predicted = self.confusion.sum(axis=0)
+        support = self.confusion.sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            precision = np.where(predicted > 0, tp / predicted, 0.0)
+            recall = np.where(support > 0, tp / support, 0.0)
+            f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+        df = pd.DataFrame({'precision': precision, 'recall': recall, 'f1': f1, 'support': support},
+                          index=pd.Index(self.labels, name='class'))
+        return df[(support > 0) | (predicted > 0)].sort_index()
+
+    def f1_averages(self):
+        """(macro F1, support-weighted F1)"""
+        per_class = self.per_class()
+        support = per_class['support'].to_numpy()
+        if support.sum() == 0:
+            return None, None
+        return float(per_class['f1'].mean()), float((per_class['f1'] * support).sum() / support.sum())
+
+    def top_k_accuracy(self):
+        scored = self.rank_counts.sum()
+        if scored == 0:
+            return {}
+        hits = np.cumsum(self.rank_counts)
+        return {k: float(hits[k - 1] / scored) for k in self.top_k}
+
+    def calibration(self):
+        """(reliability table, expected calibration error)"""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            confidence = np.where(self.bin_count > 0, self.bin_confidence / self.bin_count, np.nan)
+            accuracy = np.where(self.bin_count > 0, self.bin_correct / self.bin_count, np.nan)
+        edges = np.linspace(0, 1, self.bins + 1)
+        table = pd.DataFrame({'count': self.bin_count, 'avg_confidence': confidence, 'accuracy': accuracy},
+                             index=[f"{lo:.1f}-{hi:.1f}" for lo, hi in zip(edges[:-1], edges[1:])])
+        total = self.bin_count.sum()
+        ece = float(np.nansum(self.bin_count * np.abs(confidence - accuracy)) / total) if total else None
+        return table, ece
+
+    def confusion_frame(self):
+        """Confusion matrix over the labels that occur, like pd.crosstab(true, predicted)"""
+        rows = self.confusion.sum(axis=1) > 0
+        cols = self.confusion.sum(axis=0) > 0
+        labels = np.array(self.labels, dtype=object)
+        rows_order = np.argsort(labels[rows].astype(str), kind='stable')
+        cols_order = np.argsort(labels[cols].astype(str), kind='stable')
+        matrix = self.confusion[rows][:, cols][rows_order][:, cols_order]
+        return pd.DataFrame(matrix, index=pd.Index(labels[rows][rows_order], name='True'),
+                            columns=pd.Index(labels[cols][cols_order], name='Predicted'))
+
+    def report(self):
+        """Everything as a JSON-serializable dict"""
+        table, ece = self.calibration()
+        macro_f1, weighted_f1 = self.f1_averages()
+        return {
+            'total': self.total,
+            'silent': self.silent,
+            'failed': self.failed,
+            'labeled': self.labeled,
+            'accuracy': self.correct / self.labeled if self.labeled else None,
+            'average_confidence': self.confidence_sum / self.total if self.total else None,
+            'predicted_counts': {label: int(c) for label, c in zip(self.labels, self.predicted_counts) if c},
+            'per_class': self.per_class().reset_index().to_dict('records'),
+            'macro_f1': macro_f1,
+            'weighted_f1': weighted_f1,
+            'top_k_accuracy': self.top_k_accuracy(),
+            'calibration': table.reset_index(names='bin').replace({np.nan: None}).to_dict('records'),
+            'ece': ece,
+            'confusion': {'labels': self.labels, 'matrix': self.confusion.tolist()}
+        }
+
+def evaluate(chunks, **kwargs):
+    """Accumulate an iterable of result DataFrames"""
+    accumulator = EvaluationAccumulator(**kwargs)
+    for chunk in chunks:
+        accumulator.update(chunk)
+    return accumulator
+
+def evaluate_results(paths, **kwargs):
+    """Stream one or more result stores (.csv / .parquet, e.g. shard outputs) into one report"""
+    if isinstance(paths, (str, Path)):
+        paths = [paths]
+    return evaluate((chunk for path in paths for chunk in iter_latest_chunks(path)), **kwargs)
+
+def print_summary(acc):
+    """Print summary statistics"""
+    print("\n" + "=" * 70)
+    print("BATCH PREDICTION SUMMARY")
+    print("=" * 70)
+
+    print(f"\n📊 Total files processed: {acc.total + acc.silent + acc.failed}")
+
+    # Silent and undecodable clips were never scored; they are kept out of accuracy and confidence
+    if acc.silent:
+        print(f"🔇 Silent files skipped: {acc.silent}")
+    if acc.failed:
+        print(f"⚠️ Files that could not be decoded: {acc.failed}")
+    if acc.total == 0:
+        print("=" * 70)
+        return
+
+    # Overall accuracy (if true labels available)
+    if acc.labeled:
+        print(f"✅ Correct predictions: {acc.correct}/{acc.labeled} ({acc.correct / acc.labeled * 100:.2f}%)")
+        print(f"❌ Incorrect predictions: {acc.labeled - acc.correct}/{acc.labeled}")
+
+    # Average confidence
+    print(f"\n🎯 Average confidence: {acc.confidence_sum / acc.total:.2f}%")
+
+    # Per-class statistics
+    print("\n📈 Per-class predictions:")
+    order = np.argsort(-acc.predicted_counts, kind='stable')
+    for i in order[acc.predicted_counts[order] > 0]:
+        count = acc.predicted_counts[i]
+        print(f"  {acc.labels[i]:15s}: {count:3d} ({count / acc.total * 100:5.1f}%)")
+
+    if acc.labeled:
+        print("\n📋 Per-class precision / recall / F1:")
+        print(acc.per_class().to_string(float_format=lambda v: f"{v:.3f}"))
+        macro_f1, weighted_f1 = acc.f1_averages()
+        print(f"  Macro F1: {macro_f1:.3f}   Weighted F1: {weighted_f1:.3f}")
+
+        top_k = acc.top_k_accuracy()
+        if top_k:
+            print("\n🏅 Top-k accuracy: " + "   ".join(f"top-{k}: {v * 100:.2f}%" for k, v in top_k.items()))
+
+        table, ece = acc.calibration()
+        print(f"\n📐 Calibration (ECE {ece * 100:.2f}%):")
+        print(table[table['count'] > 0].to_string(float_format=lambda v: f"{v:.3f}"))
+
+        # Confusion matrix
+        print("\n📊 Confusion Matrix:")
+        print(acc.confusion_frame())
+
+    print("=" * 70)
+
+def print_report(acc):
+    """Summary plus most/least confident predictions"""
+    print_summary(acc)
+    if acc.top is None:
+        return
+
+    print(f"\n🔝 Top {acc.extremes} Most Confident Predictions:")
+    print(acc.top.to_string(index=False))
+
+    if acc.total >= acc.extremes:
+        print(f"\n⚠️ Top {acc.extremes} Least Confident Predictions:")
+        print(acc.bottom.to_string(index=False))
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluation report for batch prediction outputs (streamed)")
+    parser.add_argument('results', nargs='+', type=Path, help="Result stores (.csv/.parquet), e.g. all shard outputs")
+    parser.add_argument('--top-k', type=lambda s: [int(k) for k in s.split(',')], default=list(TOP_K))
+    parser.add_argument('--bins', type=int, default=CALIBRATION_BINS, help="Calibration bins")
+    parser.add_argument('--json', type=Path, default=None, help="Also write the report as JSON")
+    args = parser.parse_args()
+
+    missing = [p for p in args.results if not p.exists()]
+    if missing:
+        print(f"❌ Results not found: {', '.join(map(str, missing))}")
+        return
+    acc = evaluate_results(args.results, top_k=args.top_k, bins=args.bins)
+    print_report(acc)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(acc.report(), f, indent=4, default=float)
+        print(f"\n✅ Report saved to: {args.json}")
+
+if __name__ == "__main__":
+    main()
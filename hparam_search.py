@@ -0,0 +1,376 @@
+"""
+Hyperparameter Search - successive halving over cached spectrogram features
+Samples configurations (learning rate, batch size, architecture variant) and trains
+them concurrently in a process pool, each worker limited to its share of the CPU
+threads. Every trial reads the same memory-mapped feature cache (the training PNGs
+decoded once to uint8 arrays), so no trial decodes an image again.
+
+Successive halving: all configurations train for a few epochs, only the best
+1/ETA continue for ETA times as many epochs, and so on until one is left or
+MAX_EPOCHS is reached. Survivors continue from their saved weights.
+
+Usage:
+    python hparam_search.py --trials 16 --workers 4
+    python hparam_search.py --learning-rates 3e-4,1e-3 --architectures base,gap
+"""
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+import multiprocessing
+import numpy as np
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import shutil
+import time
+
+# ========== CONFIGURATION ==========
+PROJECT_PATH = Path(r"C:\Users\sasik\OneDrive\Documents\AnimalVoicedetection")
+MODEL_OUTPUT_PATH = PROJECT_PATH / "trained_model"
+FEATURE_CACHE = PROJECT_PATH / "feature_cache"
+SEARCH_OUTPUT = MODEL_OUTPUT_PATH / "hparam_search"  # Per-trial checkpoints, results table, best config, plot
+RESULTS_FILE = "results.csv"
+BEST_FILE = "best.json"
+PLOT_FILE = "accuracy_vs_cost.png"
+
+IMG_SIZE = (128, 128)
+SEED = 42
+
+# Search space and schedule
+LEARNING_RATES = (1e-4, 3e-4, 1e-3, 3e-3)
+BATCH_SIZES = (16, 32, 64)
+DEFAULT_TRIALS = 16
+MIN_EPOCHS = 2  # Budget of the first rung
+MAX_EPOCHS = 32
+ETA = 3  # Keep the best 1/ETA of trials per rung, give them ETA times the epochs
+TRIAL_ATTEMPTS = 2  # Runs per rung for a trial whose worker process died (killed, out of memory)
+
+# Architecture variants; 'base' is the '2_train_model.py' network
+ARCHITECTURES = {
+    'base': {'filters': (32, 64, 128, 256), 'dense': (512, 256), 'head': 'flatten'},
+    'narrow': {'filters': (16, 32, 64, 128), 'dense': (256, 128), 'head': 'flatten'},
+    'shallow': {'filters': (32, 64, 128), 'dense': (256,), 'head': 'flatten'},
+    'gap': {'filters': (32, 64, 128, 256), 'dense': (256,), 'head': 'gap'},
+}
+
+def build_model(input_shape, num_classes, architecture):
+    """VGG-style CNN from an ARCHITECTURES entry (conv pairs + BatchNorm per block, dense head)"""
+    from tensorflow.keras import layers, models
+
+    spec = ARCHITECTURES[architecture]
+    stack = [layers.Input(shape=input_shape)]
+    for filters in spec['filters']:
+        stack += [
+            layers.Conv2D(filters, (3, 3), activation='relu', padding='same'),
+            layers.BatchNormalization(),
+            layers.Conv2D(filters, (3, 3), activation='relu', padding='same'),
+            layers.BatchNormalization(),
+            layers.MaxPooling2D((2, 2)),
+            layers.Dropout(0.25),
+        ]
+    stack.append(layers.Flatten() if spec['head'] == 'flatten' else layers.GlobalAveragePooling2D())
+    for units in spec['dense']:
+        stack += [layers.Dense(units, activation='relu'), layers.BatchNormalization(), layers.Dropout(0.5)]
+    stack.append(layers.Dense(num_classes, activation='softmax'))
+    return models.Sequential(stack)
+
+# ---------- Feature cache ----------
+
+def build_feature_cache(cache_root=FEATURE_CACHE):
+    """
+    Decode the training/validation PNGs once into memory-mapped uint8 arrays (same split as
+    '2_train_model.py'). Returns the cache folder; reused while the files are unchanged.
+    """
+    from PIL import Image
+    from tqdm import tqdm
+    from cascade import load_split
+
+    train_df, val_df, classes = load_split()
+    files = [(p, c, split) for split, df in (('train', train_df), ('val', val_df))
+             for p, c in zip(df['filename'], df['class'])]
+    signature = [(p, os.stat(p).st_size, os.stat(p).st_mtime_ns) for p, _, _ in files]
+    key = hashlib.sha1(json.dumps([signature, list(IMG_SIZE)]).encode()).hexdigest()[:12]
+    cache_dir = Path(cache_root) / key
+    if (cache_dir / "meta.json").exists():
+        return cache_dir
+
+    tmp_dir = Path(cache_root) / f".{key}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+    class_index = {c: i for i, c in enumerate(classes)}
+    for split in ('train', 'val'):
+        rows = [(p, c) for p, c, s in files if s == split]
+        x = np.lib.format.open_memmap(tmp_dir / f"x_{split}.npy", mode='w+', dtype=np.uint8,
+                                      shape=(len(rows), *IMG_SIZE, 3))
+        for i, (path, _) in enumerate(tqdm(rows, desc=f"Caching {split} features")):
+            img = Image.open(path).convert('RGB')
+            if img.size != (IMG_SIZE[1], IMG_SIZE[0]):
+                img = img.resize((IMG_SIZE[1], IMG_SIZE[0]), Image.NEAREST)  # Like keras load_img
+            x[i] = np.asarray(img)
+        x.flush()
+        del x
+        np.save(tmp_dir / f"y_{split}.npy", np.array([class_index[c] for _, c in rows], dtype=np.int64))
+    with open(tmp_dir / "meta.json", 'w') as f:
+        json.dump({'classes': classes, 'train': len(train_df), 'val': len(val_df)}, f, indent=4)
+    os.replace(tmp_dir, cache_dir)
+    return cache_dir
+
+# ---------- Worker side (one TensorFlow per process, threads capped) ----------
+
+_features = None
+
+def _init_worker(cache_dir, threads):
+    """Cap this process's threads before TensorFlow starts, then map the shared features"""
+    global _features
+    for var in ('TF_NUM_INTRAOP_THREADS', 'OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS'):
+        os.environ[var] = str(threads)
+    os.environ['TF_NUM_INTEROP_THREADS'] = '1'
+    os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+    cache_dir = Path(cache_dir)
+    _features = {name: np.load(cache_dir / f"{name}.npy", mmap_mode='r')
+                 for name in ('x_train', 'y_train', 'x_val', 'y_val')}
+    with open(cache_dir / "meta.json", 'r') as f:
+        _features['classes'] = json.load(f)['classes']
+
+def _batches(x, y, num_classes, batch_size, shuffle, seed):
+    """Endless (float images, one-hot) batches read from the memmaps, reshuffled every epoch"""
+    for epoch in itertools.count():
+        order = np.random.default_rng([seed, epoch]).permutation(len(x)) if shuffle else np.arange(len(x))
+        for start in range(0, len(x), batch_size):
+            idx = np.sort(order[start:start + batch_size])
+            yield (np.asarray(x[idx], dtype=np.float32) / 255.0,
+                   np.eye(num_classes, dtype=np.float32)[y[idx]])
+
+def run_trial(trial, start_epoch, end_epoch, trial_dir):
+    """Train one configuration from start_epoch to end_epoch and evaluate it on the validation split"""
+    from tensorflow import keras
+
+    num_classes = len(_features['classes'])
+    model_file = Path(trial_dir) / "model.keras"
+    if start_epoch > 0:
+        model = keras.models.load_model(model_file)
+    else:
+        keras.utils.set_random_seed(SEED + trial['id'])
+        model = build_model((*IMG_SIZE, 3), num_classes, trial['architecture'])
+        model.compile(optimizer=keras.optimizers.Adam(learning_rate=trial['learning_rate']),
+                      loss='categorical_crossentropy', metrics=['accuracy'])
+
+    x_train, y_train = _features['x_train'], _features['y_train']
+    x_val, y_val = _features['x_val'], _features['y_val']
+    batch_size = trial['batch_size']
+    started = time.perf_counter()
+    model.fit(_batches(x_train, y_train, num_classes, batch_size, True, SEED + trial['id'] * 1000 + start_epoch),
+              steps_per_epoch=int(np.ceil(len(x_train) / batch_size)),
+              initial_epoch=start_epoch, epochs=end_epoch, shuffle=False, verbose=0)  # _batches shuffles
+    train_seconds = time.perf_counter() - started
+    val_loss, val_accuracy = model.evaluate(
+        _batches(x_val, y_val, num_classes, batch_size, False, 0),
+        steps=int(np.ceil(len(x_val) / batch_size)), verbose=0)
+
+    Path(trial_dir).mkdir(parents=True, exist_ok=True)
+    model.save(model_file)
+    return {
+        'val_accuracy': float(val_accuracy),
+        'val_loss': float(val_loss),
+        'train_seconds': train_seconds,
+        'params': int(model.count_params())
+    }
+
+# ---------- Driver ----------
+
+def sample_trials(learning_rates, batch_sizes, architectures, count, seed=SEED):
+    """count distinct configurations drawn from the grid (all of them if count >= grid size)"""
+    grid = list(itertools.product(learning_rates, batch_sizes, architectures))
+    picks = np.random.default_rng(seed).permutation(len(grid))[:count]
+    return [{'id': i, 'learning_rate': grid[p][0], 'batch_size': grid[p][1], 'architecture': grid[p][2]}
+            for i, p in enumerate(sorted(picks))]
+
+def successive_halving(trials, cache_dir, workers, threads, output_dir=SEARCH_OUTPUT,
+                       min_epochs=MIN_EPOCHS, max_epochs=MAX_EPOCHS, eta=ETA):
+    """Run the rungs; returns one row per (trial, rung) evaluation"""
+    with open(Path(cache_dir) / "meta.json", 'r') as f:
+        train_samples = json.load(f)['train']
+
+    rows = []
+    done_epochs = {t['id']: 0 for t in trials}
+    spent = {t['id']: {'seconds': 0.0, 'sample_epochs': 0} for t in trials}
+    survivors = list(trials)
+    budget = min(min_epochs, max_epochs)
+    context = multiprocessing.get_context('spawn')  # Fresh TensorFlow per worker, thread caps applied before import
+
+    def new_pool():
+        return ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                   initializer=_init_worker, initargs=(str(cache_dir), threads))
+
+    pool = new_pool()
+    try:
+        for rung in itertools.count():
+            print(f"\n🪜 Rung {rung}: {len(survivors)} trials → {budget} epochs")
+            scores = {}
+            attempts = {t['id']: 0 for t in survivors}
+            pending = list(survivors)
+            while pending:
+                futures = {pool.submit(run_trial, t, done_epochs[t['id']], budget,
+                                       str(Path(output_dir) / f"trial_{t['id']:03d}")): t for t in pending}
+                pending = []
+                broken = False
+                for future in as_completed(futures):
+                    trial = futures[future]
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool:
+                        # A worker died; every trial still queued on this pool fails with it
+                        broken = True
+                        attempts[trial['id']] += 1
+                        if attempts[trial['id']] < TRIAL_ATTEMPTS:
+                            pending.append(trial)
+                        else:
+                            print(f"   ❌ trial {trial['id']}: worker process died {TRIAL_ATTEMPTS} times")
+                        continue
+                    except Exception as e:
+                        print(f"   ❌ trial {trial['id']}: {e}")
+                        continue
+                    cost = spent[trial['id']]
+                    cost['seconds'] += result['train_seconds']
+                    cost['sample_epochs'] += (budget - done_epochs[trial['id']]) * train_samples
+                    done_epochs[trial['id']] = budget
+                    scores[trial['id']] = result['val_accuracy']
+                    rows.append(dict(trial, rung=rung, epochs=budget, val_accuracy=result['val_accuracy'],
+                                     val_loss=result['val_loss'], params=result['params'],
+                                     train_seconds=cost['seconds'], sample_epochs=cost['sample_epochs']))
+                    print(f"   trial {trial['id']:3d} lr={trial['learning_rate']:.0e} batch={trial['batch_size']:<3d} "
+                          f"{trial['architecture']:<8} acc={result['val_accuracy']:.4f} ({cost['seconds']:.0f}s total)")
+                if broken:
+                    print("   ⚠️ A worker process died; restarting the pool"
+                          + (f" and rerunning {len(pending)} trials" if pending else ""))
+                    pool.shutdown(wait=True)
+                    pool = new_pool()
+
+            survivors = sorted((t for t in survivors if t['id'] in scores), key=lambda t: -scores[t['id']])
+            if len(survivors) <= 1 or budget >= max_epochs:
+                break
+            survivors = survivors[:max(1, len(survivors) // eta)]
+            budget = min(budget * eta, max_epochs)
+    finally:
+        pool.shutdown(wait=True)
+    return rows
+
+def prepare_output(output_dir=SEARCH_OUTPUT):
+    """
+    Clear a previous search's trial checkpoints and results from output_dir.
+    Returns False (and deletes nothing) if the folder holds files that are not from a search.
+    """
+    output_dir = Path(output_dir)
+    outputs = {RESULTS_FILE, BEST_FILE, PLOT_FILE}
+    if output_dir.exists():
+        foreign = [p for p in output_dir.iterdir()
+                   if not (p.name in outputs or (p.is_dir() and p.name.startswith("trial_")))]
+        if foreign and not (output_dir / RESULTS_FILE).exists():
+            return False
+        for path in output_dir.iterdir():
+            if path.is_dir() and path.name.startswith("trial_"):
+                shutil.rmtree(path)
+            elif path.name in outputs:
+                path.unlink()
+    output_dir.mkdir(parents=True, exist_ok=True)
+    return True
+
+def save_results(rows, output_dir=SEARCH_OUTPUT):
+    """Results table (CSV), best configuration (JSON) and an accuracy-vs-cost plot"""
+    import pandas as pd
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    df = pd.DataFrame(rows)
+    df.to_csv(Path(output_dir) / RESULTS_FILE, index=False)
+
+    # Each trial's last evaluation; ties on accuracy go to the cheaper trial
+    final = df.sort_values('rung').groupby('id').tail(1)
+    final = final.sort_values(['epochs', 'val_accuracy', 'sample_epochs'], ascending=[False, False, True])
+    best = final.iloc[0]
+    with open(Path(output_dir) / BEST_FILE, 'w') as f:
+        json.dump({k: (v.item() if hasattr(v, 'item') else v) for k, v in best.items()}, f, indent=4)
+
+    fig, ax = plt.subplots(figsize=(8, 5))
+    for architecture, group in df.groupby('architecture'):
+        ax.scatter(group['sample_epochs'], group['val_accuracy'], label=architecture, alpha=0.7)
+    ax.set_xscale('log')
+    ax.set_xlabel('Training cost (sample-epochs)')
+    ax.set_ylabel('Validation accuracy')
+    ax.set_title('Hyperparameter search: accuracy vs. cost')
+    ax.legend()
+    ax.grid(True)
+    plt.savefig(Path(output_dir) / PLOT_FILE, dpi=150, bbox_inches='tight')
+    plt.close(fig)
+    return final
+
+def print_table(final):
+    print(f"\n{'Trial':<6} {'LR':<8} {'Batch':<6} {'Arch':<8} {'Params':>10} {'Epochs':>7} "
+          f"{'Val acc':>8} {'Train s':>8} {'Sample-epochs':>14}")
+    print("-" * 84)
+    for _, r in final.iterrows():
+        print(f"{r['id']:<6d} {r['learning_rate']:<8.0e} {r['batch_size']:<6d} {r['architecture']:<8} "
+              f"{r['params']:>10,d} {r['epochs']:>7d} {r['val_accuracy']:>8.4f} {r['train_seconds']:>8.0f} "
+              f"{r['sample_epochs']:>14,d}")
+
+def parse_list(cast):
+    return lambda text: [cast(x) for x in text.split(',') if x]
+
+def main():
+    cores = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="Successive-halving hyperparameter search for the CNN")
+    parser.add_argument('--trials', type=int, default=DEFAULT_TRIALS, help="Configurations to sample")
+    parser.add_argument('--workers', type=int, default=max(1, cores // 2), help="Trials trained at once")
+    parser.add_argument('--threads', type=int, default=None, help="Threads per trial (default: cores / workers)")
+    parser.add_argument('--learning-rates', type=parse_list(float), default=list(LEARNING_RATES))
+    parser.add_argument('--batch-sizes', type=parse_list(int), default=list(BATCH_SIZES))
+    parser.add_argument('--architectures', type=parse_list(str), default=list(ARCHITECTURES))
+    parser.add_argument('--min-epochs', type=int, default=MIN_EPOCHS, help="Epochs in the first rung")
+    parser.add_argument('--max-epochs', type=int, default=MAX_EPOCHS)
+    parser.add_argument('--eta', type=int, default=ETA, help="Keep 1/eta of the trials per rung")
+    parser.add_argument('--output', type=Path, default=SEARCH_OUTPUT, help="Trial checkpoints and results")
+    args = parser.parse_args()
+
+    unknown = set(args.architectures) - set(ARCHITECTURES)
+    if unknown:
+        parser.error(f"unknown architectures: {', '.join(sorted(unknown))} (choose from {', '.join(ARCHITECTURES)})")
+    threads = args.threads or max(1, cores // args.workers)
+
+    print("=" * 60)
+    print("HYPERPARAMETER SEARCH")
+    print("=" * 60)
+    if not prepare_output(args.output):
+        print(f"❌ {args.output} is not empty and holds no previous search ({RESULTS_FILE}); choose another --output")
+        return
+    cache_dir = build_feature_cache()
+    with open(cache_dir / "meta.json", 'r') as f:
+        meta = json.load(f)
+    print(f"✅ Features cached: {cache_dir} ({meta['train']} train / {meta['val']} validation)")
+
+    trials = sample_trials(args.learning_rates, args.batch_sizes, args.architectures, args.trials)
+    print(f"🔍 {len(trials)} trials, {args.workers} at a time with {threads} threads each, "
+          f"epochs {args.min_epochs}→{args.max_epochs} (eta {args.eta})")
+
+    started = time.perf_counter()
+    rows = successive_halving(trials, cache_dir, args.workers, threads, args.output,
+                              args.min_epochs, args.max_epochs, args.eta)
+    if not rows:
+        print("❌ All trials failed")
+        return
+    final = save_results(rows, args.output)
+    print_table(final)
+    print(f"\n✅ Search finished in {time.perf_counter() - started:.0f}s")
+    print(f"✅ Results: {args.output / RESULTS_FILE}")
+    print(f"🏆 Best: lr={final.iloc[0]['learning_rate']:.0e} batch={final.iloc[0]['batch_size']} "
+          f"architecture={final.iloc[0]['architecture']} → {final.iloc[0]['val_accuracy']:.4f}")
+
+if __name__ == "__main__":
+    main()
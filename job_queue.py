@@ -0,0 +1,390 @@
+"""
+Job Queue - persistent background prediction jobs
+A SQLite table is the queue, so queued and finished jobs survive server restarts.
+Worker processes (started by app.py, or by hand) claim the highest-priority job,
+run it with their own copy of the model and store the result; clients poll
+GET /jobs/<id>. Workers follow the model registry's ACTIVE version, switching
+between jobs, and record the version each result came from.
+
+- priorities: higher runs first, FIFO within a priority
+- retries: a failed job is re-queued with exponential backoff until max_attempts;
+  a job whose worker died is re-queued when its lease expires
+- TTL: finished jobs (and their results) are deleted RESULT_TTL seconds after finishing
+
+Run a worker by hand:
+    python job_queue.py worker
+"""
+
+from contextlib import contextmanager
+from pathlib import Path
+import numpy as np
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import time
+import uuid
+from model_registry import active_version, REGISTRY_PATH, MODEL_FILE, LABELS_FILE, UNVERSIONED
+
+# ========== CONFIGURATION ==========
+PROJECT_PATH = Path(__file__).parent
+JOBS_DB_PATH = PROJECT_PATH / "jobs.db"
+JOBS_FOLDER = PROJECT_PATH / "job_uploads"  # Uploaded audio per job, removed once the job finishes
+MODEL_PATH = PROJECT_PATH / "trained_model" / "best_model.h5"
+CLASS_LABELS_PATH = PROJECT_PATH / "trained_model" / "class_labels.json"
+
+# Audio parameters (must match training)
+SAMPLE_RATE = 22050
+DURATION = 3
+N_MELS = 128
+HOP_LENGTH = 512
+IMG_SIZE = (128, 128)
+
+DEFAULT_MAX_ATTEMPTS = 3
+RETRY_BACKOFF = 5  # Seconds before the first retry, doubled per attempt
+LEASE_SECONDS = 600  # A running job whose worker stops renewing is re-queued after this
+RESULT_TTL = 24 * 3600
+POLL_INTERVAL = 0.5  # Idle workers and long-polls check the queue this often
+WORKER_NICENESS = 10  # Workers run below the web server's CPU priority
+MAX_WINDOW_SECONDS = 600  # Longest recording analysed by a windowed job
+INFERENCE_BATCH_SIZE = 32
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,            -- queued | running | done | failed
+    priority INTEGER NOT NULL,
+    payload TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    available_at REAL NOT NULL,      -- not claimed before this (retry backoff)
+    started_at REAL,
+    finished_at REAL,
+    lease_expires REAL,
+    worker TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, priority DESC, created_at);
+"""
+
+TERMINAL_STATUSES = ('done', 'failed')
+
+class JobQueue:
+    """SQLite-backed priority queue; safe to use from many threads and processes"""
+
+    def __init__(self, db_path=JOBS_DB_PATH):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        # One short-lived connection per call: sqlite3 connections must not cross threads
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def submit(self, payload, priority=0, max_attempts=DEFAULT_MAX_ATTEMPTS, job_id=None):
+        job_id = job_id or uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, priority, payload, max_attempts, created_at, available_at) "
+                "VALUES (?, 'queued', ?, ?, ?, ?, ?)",
+                (job_id, int(priority), json.dumps(payload), int(max_attempts), now, now)
+            )
+        return job_id
+
+    def claim(self, worker):
+        """Atomically take the next runnable job; returns (id, payload) or None"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                return self._claim(conn, worker, now)
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def _claim(self, conn, worker, now):
+        # Jobs whose worker died go back to the queue (the lost run counts as an attempt)
+        conn.execute(
+            "UPDATE jobs SET status = 'queued', worker = NULL, available_at = ? "
+            "WHERE status = 'running' AND lease_expires < ? AND attempts < max_attempts",
+            (now, now)
+        )
+        conn.execute(
+            "UPDATE jobs SET status = 'failed', error = 'Worker lost', finished_at = ? "
+            "WHERE status = 'running' AND lease_expires < ?",
+            (now, now)
+        )
+        row = conn.execute(
+            "SELECT id, payload FROM jobs WHERE status = 'queued' AND available_at <= ? "
+            "ORDER BY priority DESC, created_at LIMIT 1",
+            (now,)
+        ).fetchone()
+        if row is None:
+            conn.execute("COMMIT")
+            return None
+        conn.execute(
+            "UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1, "
+            "started_at = ?, lease_expires = ? WHERE id = ?",
+            (worker, now, now + LEASE_SECONDS, row['id'])
+        )
+        conn.execute("COMMIT")
+        return row['id'], json.loads(row['payload'])
+
+    def complete(self, job_id, result):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'done', result = ?, error = NULL, finished_at = ?, "
+                "lease_expires = NULL WHERE id = ?",
+                (json.dumps(result), time.time(), job_id)
+            )
+
+    def fail(self, job_id, error):
+        """Re-queue with backoff, or mark failed once max_attempts is used up; returns the new status"""
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT attempts, max_attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            if row['attempts'] < row['max_attempts']:
+                delay = RETRY_BACKOFF * 2 ** (row['attempts'] - 1)
+                conn.execute(
+                    "UPDATE jobs SET status = 'queued', error = ?, worker = NULL, lease_expires = NULL, "
+                    "available_at = ? WHERE id = ?",
+                    (error, now + delay, job_id)
+                )
+                return 'queued'
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, finished_at = ?, lease_expires = NULL "
+                "WHERE id = ?",
+                (error, now, job_id)
+            )
+            return 'failed'
+
+    def get(self, job_id):
+        """Job as a dict (result decoded), or None if unknown or expired"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = {
+            'id': row['id'],
+            'status': row['status'],
+            'priority': row['priority'],
+            'attempts': row['attempts'],
+            'max_attempts': row['max_attempts'],
+            'created_at': row['created_at'],
+            'started_at': row['started_at'],
+            'finished_at': row['finished_at']
+        }
+        if row['status'] == 'queued':
+            job['position'] = self.position(row['priority'], row['created_at'])
+        if row['error']:
+            job['error'] = row['error']
+        if row['result'] is not None:
+            job['result'] = json.loads(row['result'])
+        if row['finished_at'] is not None:
+            job['expires_at'] = row['finished_at'] + RESULT_TTL
+        return job
+
+    def wait(self, job_id, timeout):
+        """Long-poll: return the job once it is finished or timeout seconds have passed"""
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job['status'] in TERMINAL_STATUSES or time.monotonic() >= deadline:
+                return job
+            time.sleep(min(POLL_INTERVAL, max(0.0, deadline - time.monotonic())))
+
+    def position(self, priority, created_at):
+        """Queued jobs that will run before one with this priority and creation time"""
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND "
+                "(priority > ? OR (priority = ? AND created_at < ?))",
+                (priority, priority, created_at)
+            ).fetchone()[0]
+
+    def renew(self, job_id):
+        """Extend the lease of a running job (long jobs call this between files)"""
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET lease_expires = ? WHERE id = ? AND status = 'running'",
+                         (time.time() + LEASE_SECONDS, job_id))
+
+    def purge_expired(self):
+        """Delete finished jobs older than RESULT_TTL; returns their ids"""
+        cutoff = time.time() - RESULT_TTL
+        with self._connect() as conn:
+            ids = [r['id'] for r in conn.execute(
+                "SELECT id FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?", (cutoff,))]
+            conn.executemany("DELETE FROM jobs WHERE id = ?", [(i,) for i in ids])
+        return ids
+
+    def counts(self):
+        """Number of jobs per status"""
+        with self._connect() as conn:
+            return {r['status']: r['n'] for r in conn.execute(
+                "SELECT status, COUNT(*) AS n FROM jobs GROUP BY status")}
+
+def job_dir(job_id, jobs_folder=JOBS_FOLDER):
+    return Path(jobs_folder) / job_id
+
+# ========== WORKER ==========
+class JobRunner:
+    """Holds one model and runs job payloads: {'files': [{'name', 'path'}], 'windowed', 'hop_seconds'}"""
+
+    def __init__(self, model_path=MODEL_PATH, class_labels_path=CLASS_LABELS_PATH, version=UNVERSIONED):
+        from model_export import load_inference_model
+
+        self.model = load_inference_model(model_path)
+        with open(class_labels_path, 'r') as f:
+            self.class_labels = json.load(f)
+        self.version = version
+
+    @classmethod
+    def for_active_version(cls, registry=REGISTRY_PATH, model_path=MODEL_PATH, class_labels_path=CLASS_LABELS_PATH):
+        """Runner for the registry's active version, or for model_path when nothing is published"""
+        version = active_version(registry)
+        if version is None:
+            return cls(model_path, class_labels_path)
+        folder = Path(registry) / version
+        return cls(folder / MODEL_FILE, folder / LABELS_FILE, version)
+
+    def clip_to_input(self, y, sr):
+        """Fixed-length clip -> normalized (H, W, 3) image, identical to the training PNGs"""
+        from spectrogram_renderer import clip_to_model_input
+        return clip_to_model_input(y, sr, N_MELS, HOP_LENGTH, IMG_SIZE)
+
+    def predict_arrays(self, arrays):
+        batches = [self.model.predict(np.stack(arrays[i:i + INFERENCE_BATCH_SIZE]), verbose=0)
+                   for i in range(0, len(arrays), INFERENCE_BATCH_SIZE)]
+        return np.concatenate(batches) if batches else np.empty((0, len(self.class_labels)))
+
+    def summarize(self, probabilities):
+        idx = int(np.argmax(probabilities))
+        return {
+            'predicted_animal': self.class_labels[str(idx)],
+            'confidence': float(probabilities[idx]) * 100,
+            'all_probabilities': {self.class_labels[str(i)]: float(p) * 100
+                                  for i, p in sorted(enumerate(probabilities), key=lambda x: -x[1])}
+        }
+
+    def run_file(self, path, windowed, hop_seconds):
+        from audio_gate import load_active_clip, load_windows, SilentAudioError
+
+        if not windowed:
+            try:
+                y, sr = load_active_clip(path, SAMPLE_RATE, DURATION)
+            except SilentAudioError:
+                return {'success': True, 'no_sound': True}
+            return dict(self.summarize(self.predict_arrays([self.clip_to_input(y, sr)])[0]), success=True)
+
+        # Windowed analysis: every non-silent window, plus the mean over all of them
+        starts, windows = load_windows(path, SAMPLE_RATE, DURATION, hop_seconds, max_seconds=MAX_WINDOW_SECONDS)
+        if len(windows) == 0:
+            return {'success': True, 'no_sound': True, 'windows': []}
+        probabilities = self.predict_arrays([self.clip_to_input(w, SAMPLE_RATE) for w in windows])
+        result = dict(self.summarize(probabilities.mean(axis=0)), success=True)
+        result['windows'] = [
+            {'start': float(start), 'end': float(start + DURATION),
+             'predicted_animal': self.class_labels[str(int(np.argmax(p)))],
+             'confidence': float(p.max()) * 100}
+            for start, p in zip(starts, probabilities)
+        ]
+        return result
+
+    def run(self, payload, renew=None):
+        results = []
+        for item in payload['files']:
+            try:
+                result = self.run_file(item['path'], payload.get('windowed', False),
+                                       payload.get('hop_seconds', DURATION / 2))
+            except Exception as e:
+                result = {'success': False, 'error': str(e) or type(e).__name__}
+            results.append(dict(result, file=item['name']))
+            if renew is not None:
+                renew()
+        return {'results': results, 'model_version': self.version}
+
+def run_worker(db_path=JOBS_DB_PATH, model_path=MODEL_PATH, class_labels_path=CLASS_LABELS_PATH,
+               jobs_folder=JOBS_FOLDER, registry=REGISTRY_PATH):
+    """Claim and run jobs until interrupted"""
+    if hasattr(os, 'nice'):
+        os.nice(WORKER_NICENESS)
+    worker = f"{os.uname().nodename if hasattr(os, 'uname') else 'local'}:{os.getpid()}"
+    queue = JobQueue(db_path)
+    runner = JobRunner.for_active_version(registry, model_path, class_labels_path)
+    print(f"✅ Job worker {worker} ready (model version {runner.version})")
+
+    last_purge = 0.0
+    failed_version = None
+    while True:
+        if time.monotonic() - last_purge > 60:
+            for job_id in queue.purge_expired():
+                shutil.rmtree(job_dir(job_id, jobs_folder), ignore_errors=True)
+            last_purge = time.monotonic()
+
+        # Switch model versions only between jobs, so one job never mixes versions
+        version = active_version(registry)
+        if version not in (None, runner.version, failed_version):
+            try:
+                runner = JobRunner.for_active_version(registry, model_path, class_labels_path)
+                failed_version = None
+                print(f"🔄 Job worker {worker} now on model version {runner.version}")
+            except Exception as e:
+                failed_version = version
+                print(f"❌ Model version {version} failed to load, staying on {runner.version}: {e}")
+
+        claimed = queue.claim(worker)
+        if claimed is None:
+            time.sleep(POLL_INTERVAL)
+            continue
+
+        job_id, payload = claimed
+        try:
+            result = runner.run(payload, renew=lambda: queue.renew(job_id))
+            queue.complete(job_id, result)
+            status = 'done'
+        except Exception as e:
+            status = queue.fail(job_id, str(e) or type(e).__name__)
+        print(f"{'✅' if status == 'done' else '⚠️'} Job {job_id}: {status}")
+        if status in TERMINAL_STATUSES:
+            shutil.rmtree(job_dir(job_id, jobs_folder), ignore_errors=True)
+
+def start_workers(count, db_path=JOBS_DB_PATH, model_path=MODEL_PATH, class_labels_path=CLASS_LABELS_PATH,
+                  registry=REGISTRY_PATH):
+    """Launch worker processes running this module; returns the Popen handles"""
+    command = [sys.executable, str(Path(__file__).resolve()), 'worker', '--db', str(db_path),
+               '--model', str(model_path), '--labels', str(class_labels_path), '--registry', str(registry)]
+    return [subprocess.Popen(command) for _ in range(count)]
+
+def main():
+    parser = argparse.ArgumentParser(description="Background prediction job worker")
+    parser.add_argument('command', choices=['worker'])
+    parser.add_argument('--db', type=Path, default=JOBS_DB_PATH, help="Job queue database")
+    parser.add_argument('--model', type=Path, default=MODEL_PATH, help="Trained model")
+    parser.add_argument('--labels', type=Path, default=CLASS_LABELS_PATH, help="class_labels.json")
+    parser.add_argument('--registry', type=Path, default=REGISTRY_PATH,
+                        help="Model registry; its ACTIVE version overrides --model/--labels")
+    args = parser.parse_args()
+
+    try:
+        run_worker(args.db, args.model, args.labels, registry=args.registry)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
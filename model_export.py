@@ -0,0 +1,270 @@
+"""
+Model Export - startup-optimized serving copies of trained models
+Loading a legacy .h5 file rebuilds the whole Keras model, and the first
+model.predict() then builds a predict function. A SavedModel exported with a
+fixed serving signature (batch x 128 x 128 x 3 float32) skips both: it loads
+about twice as fast and one-clip predictions run without Keras' per-call
+overhead. The output is the same.
+
+    trained_model/best_model.h5
+    trained_model/best_model_serving/       <- SavedModel + export.json
+
+export.json records the size and modification time of the source model, and the
+copy is only used while they still match. load_inference_model() returns the
+export when it is fresh and the Keras model otherwise (USE_EXPORTED_MODEL=0
+always uses Keras), so the scripts work with or without an export.
+
+The benchmark runs each entry point (app.py, 3_predict.py, 4_batch_predict.py)
+in a fresh process and reports the time from launch to the first prediction,
+with the export and with the plain .h5.
+
+Usage:
+    python model_export.py export --model trained_model/best_model.h5
+    python model_export.py benchmark --audio mini_project/Lion_1.wav --model trained_model/best_model.h5
+"""
+
+from pathlib import Path
+import numpy as np
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+# ========== CONFIGURATION ==========
+PROJECT_PATH = Path(__file__).parent
+MODEL_PATH = PROJECT_PATH / "trained_model" / "best_model.h5"
+EXPORT_SUFFIX = "_serving"
+MANIFEST_FILE = "export.json"
+PREDICT_BATCH_SIZE = 32  # Same default as keras Model.predict
+PREFER_EXPORT = os.environ.get('USE_EXPORTED_MODEL', '1') != '0'
+
+# Startup benchmark
+ENTRY_POINTS = ('app', '3_predict', '4_batch_predict')
+BENCHMARK_REPEATS = 3
+PROBE_TIMEOUT = 600
+
+def export_path(model_path):
+    """best_model.h5 -> best_model_serving/"""
+    model_path = Path(model_path)
+    return model_path.with_name(model_path.stem + EXPORT_SUFFIX)
+
+def source_stamp(model_path):
+    stat = Path(model_path).stat()
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def export_model(model_path):
+    """Write the SavedModel serving copy of a Keras model file next to it; returns its folder"""
+    import tensorflow as tf
+    from tensorflow import keras
+
+    model_path = Path(model_path)
+    output = export_path(model_path)
+    model = keras.models.load_model(model_path, compile=False)
+
+    # Export into a temp folder and rename, so a half-written export is never loaded
+    tmp_path = output.with_name(output.name + ".tmp")
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    model.export(str(tmp_path), format='tf_saved_model', verbose=False)
+    manifest = dict(source_stamp(model_path), **{
+        'source': model_path.name,
+        'input_shape': list(model.input_shape[1:]),
+        'output_shape': list(model.output_shape[1:]),
+        'tensorflow': tf.__version__,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S')
+    })
+    with open(tmp_path / MANIFEST_FILE, 'w') as f:
+        json.dump(manifest, f, indent=4)
+    shutil.rmtree(output, ignore_errors=True)
+    os.replace(tmp_path, output)
+    return output
+
+def fresh_export(model_path):
+    """Export folder for model_path if it exists and was made from the current file, else None"""
+    folder = export_path(model_path)
+    try:
+        with open(folder / MANIFEST_FILE, 'r') as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if {k: manifest.get(k) for k in ('size', 'mtime_ns')} != source_stamp(model_path):
+        print(f"⚠️ {folder} is older than {Path(model_path).name}; run 'python model_export.py export' again")
+        return None
+    return folder
+
+class ExportedModel:
+    """SavedModel called through its serving signature; has the predict() subset the scripts use"""
+
+    format = 'saved_model'
+
+    def __init__(self, path, saved_model, manifest):
+        self.path = Path(path)
+        self.saved_model = saved_model
+        self.manifest = manifest
+        self.output_shape = (None, *manifest['output_shape'])
+
+    @classmethod
+    def load(cls, path):
+        import tensorflow as tf
+
+        with open(Path(path) / MANIFEST_FILE, 'r') as f:
+            manifest = json.load(f)
+        return cls(path, tf.saved_model.load(str(path)), manifest)
+
+    def predict(self, x, batch_size=PREDICT_BATCH_SIZE, verbose=0):
+        """Batch of inputs -> probabilities as a NumPy array (verbose is accepted and ignored)"""
+        x = np.asarray(x, dtype=np.float32)
+        outputs = [self.saved_model.serve(x[i:i + batch_size]).numpy() for i in range(0, len(x), batch_size)]
+        if not outputs:
+            return np.zeros((0, *self.manifest['output_shape']), dtype=np.float32)
+        return np.concatenate(outputs)
+
+def load_inference_model(model_path, prefer_export=PREFER_EXPORT):
+    """Model for prediction only: the fresh SavedModel export if there is one, else the Keras model"""
+    folder = fresh_export(model_path) if prefer_export else None
+    if folder is not None:
+        try:
+            return ExportedModel.load(folder)
+        except Exception as e:
+            print(f"⚠️ Could not load {folder} ({e}); loading {model_path} instead")
+    from tensorflow import keras
+    return keras.models.load_model(model_path)
+
+def model_format(model):
+    return getattr(model, 'format', 'keras')
+
+# ---------- Startup benchmark (each probe runs in a fresh process) ----------
+
+def _import_entry_point(name):
+    """Import app.py / 3_predict.py / 4_batch_predict.py as a module without running its main()"""
+    import importlib.util
+
+    spec = importlib.util.spec_from_file_location(f"_entry_{name}", PROJECT_PATH / f"{name}.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def run_probe(entry, audio_path, launched, model_path=None, labels_path=None):
+    """Import one entry point, load its model, predict twice; timings in seconds"""
+    import contextlib
+    import io
+    import tempfile
+
+    timings = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        module = _import_entry_point(entry)
+        timings['import'] = time.perf_counter() - start
+        if model_path is not None:
+            module.MODEL_PATH = Path(model_path)
+            module.CLASS_LABELS_PATH = Path(labels_path or Path(model_path).with_name("class_labels.json"))
+
+        start = time.perf_counter()
+        if entry == 'app':
+            if model_path is not None:
+                module.MODEL_REGISTRY_PATH = Path(tempfile.mkdtemp())  # Empty registry: serve MODEL_PATH
+            module.start_preprocess_pool()  # Same order as the server's __main__
+            module.load_model_and_labels()  # Includes the server's warm-up
+            current = module.serving
+            model = current.model
+            predict = lambda: current.classify(module.audio_to_model_input(audio_path))
+        elif entry == '3_predict':
+            model, class_labels = module.load_model_and_labels()
+            predict = lambda: module.predict_animal(Path(audio_path), model, class_labels, show_probabilities=False)
+        else:
+            model, class_labels = module.load_model_and_labels()
+            predict = lambda: module.predict_single(audio_path, model, class_labels)
+        timings['load_model'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        predict()
+        timings['first_prediction'] = time.perf_counter() - start
+        timings['time_to_first_prediction'] = time.time() - launched
+        start = time.perf_counter()
+        predict()
+        timings['next_prediction'] = time.perf_counter() - start
+    return dict(timings, model_format=model_format(model))
+
+def probe(entry, audio_path, use_export, model_path=None, labels_path=None):
+    """Run run_probe in a fresh interpreter, so every import and load is cold"""
+    env = dict(os.environ, USE_EXPORTED_MODEL='1' if use_export else '0')
+    command = [sys.executable, str(Path(__file__).resolve()), '_probe', '--entry', entry,
+               '--audio', str(audio_path), '--launched', repr(time.time())]
+    if model_path is not None:
+        command += ['--model', str(model_path)]
+    if labels_path is not None:
+        command += ['--labels', str(labels_path)]
+    proc = subprocess.run(command, env=env, capture_output=True, text=True, timeout=PROBE_TIMEOUT,
+                          cwd=PROJECT_PATH)
+    lines = [line for line in proc.stdout.splitlines() if line.startswith('{')]
+    if proc.returncode != 0 or not lines:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "probe failed")
+    return json.loads(lines[-1])
+
+def benchmark(audio_path, entries=ENTRY_POINTS, repeats=BENCHMARK_REPEATS, model_path=None, labels_path=None):
+    """Median startup timings per (entry point, export on/off)"""
+    rows = []
+    for entry in entries:
+        for use_export in (False, True):
+            runs = []
+            for _ in range(repeats):
+                try:
+                    runs.append(probe(entry, audio_path, use_export, model_path, labels_path))
+                except Exception as e:
+                    print(f"   ⚠️ {entry} ({'export' if use_export else 'h5'}): {e}")
+                    break
+            if not runs:
+                continue
+            row = {k: float(np.median([r[k] for r in runs])) for k in runs[0] if k != 'model_format'}
+            rows.append(dict(row, entry=entry, model_format=runs[0]['model_format'], runs=len(runs)))
+            print_benchmark_row(rows[-1])
+    return rows
+
+def print_benchmark_row(row):
+    print(f"  {row['entry']:<16} {row['model_format']:<12} {row['time_to_first_prediction']:>7.2f}s  "
+          f"(import {row['import']:.2f}s, load {row['load_model']:.2f}s, "
+          f"first {row['first_prediction'] * 1000:.0f} ms, next {row['next_prediction'] * 1000:.0f} ms)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Export models for fast startup and benchmark cold starts")
+    sub = parser.add_subparsers(dest='command', required=True)
+    exp = sub.add_parser('export', help="Write the SavedModel serving copy of a model")
+    exp.add_argument('--model', type=Path, default=MODEL_PATH, help="Trained model (.h5 or .keras)")
+    bench = sub.add_parser('benchmark', help="Time from process launch to first prediction per entry point")
+    bench.add_argument('--audio', type=Path, required=True, help="Clip to predict")
+    bench.add_argument('--model', type=Path, default=None, help="Model to use instead of each script's default")
+    bench.add_argument('--labels', type=Path, default=None, help="class_labels.json (default: next to --model)")
+    bench.add_argument('--entry', nargs='+', choices=ENTRY_POINTS, default=list(ENTRY_POINTS))
+    bench.add_argument('--repeats', type=int, default=BENCHMARK_REPEATS, help="Cold starts per setting (median)")
+    bench.add_argument('--output', type=Path, default=None, help="Also write the results as JSON")
+    probe_args = sub.add_parser('_probe')  # Internal: one cold start, run by benchmark in a fresh process
+    probe_args.add_argument('--entry', choices=ENTRY_POINTS, required=True)
+    probe_args.add_argument('--audio', type=Path, required=True)
+    probe_args.add_argument('--launched', type=float, required=True)
+    probe_args.add_argument('--model', type=Path, default=None)
+    probe_args.add_argument('--labels', type=Path, default=None)
+    args = parser.parse_args()
+
+    if args.command == '_probe':
+        print(json.dumps(run_probe(args.entry, args.audio, args.launched, args.model, args.labels)))
+    elif args.command == 'export':
+        print(f"📦 Exporting {args.model}...")
+        output = export_model(args.model)
+        print(f"✅ Serving export written: {output}")
+    else:
+        print("=" * 60)
+        print("STARTUP BENCHMARK")
+        print("=" * 60)
+        if args.model is not None and fresh_export(args.model) is None:
+            print(f"⚠️ No fresh export for {args.model}; the export runs will load the .h5 too")
+        print(f"🎵 {args.audio}, median of {args.repeats} cold starts\n")
+        rows = benchmark(args.audio, args.entry, args.repeats, args.model, args.labels)
+        if args.output is not None:
+            with open(args.output, 'w') as f:
+                json.dump(rows, f, indent=4)
+            print(f"\n✅ Results saved to: {args.output}")
+
+if __name__ == "__main__":
+    main()
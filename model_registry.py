@@ -0,0 +1,279 @@
+"""
+Model Registry - versioned models and zero-downtime reloads
+Each version is a folder with the model, its class labels, metadata and
+(optionally) a calibrated cascade; the ACTIVE file names the version to serve.
+
+    trained_model/registry/
+        ACTIVE                      <- e.g. "v0003"
+        v0003/model.h5
+        v0003/model_serving/        <- fast-loading SavedModel copy (model_export.py)
+        v0003/class_labels.json
+        v0003/metadata.json
+        v0003/cascade.json, cascade_stage1.h5   (optional)
+
+The web server polls ACTIVE. It loads and warms up a new version on a
+background thread and swaps it in with a single reference assignment, so
+requests already running finish on the old version.
+
+Usage:
+    python model_registry.py publish --model trained_model/best_model.h5 --labels trained_model/class_labels.json --activate
+    python model_registry.py list
+    python model_registry.py activate v0002
+"""
+
+from pathlib import Path
+import numpy as np
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+import traceback
+from model_export import model_format
+
+# ========== CONFIGURATION ==========
+PROJECT_PATH = Path(__file__).parent
+REGISTRY_PATH = PROJECT_PATH / "trained_model" / "registry"
+ACTIVE_FILE = "ACTIVE"
+MODEL_FILE = "model.h5"
+LABELS_FILE = "class_labels.json"
+METADATA_FILE = "metadata.json"
+CASCADE_FILE = "cascade.json"
+RELOAD_CHECK_SECONDS = 5
+UNVERSIONED = "unversioned"  # Version name reported when serving a model outside the registry
+
+def _write_atomic(path, text):
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def list_versions(registry=REGISTRY_PATH):
+    """Published version names, oldest first"""
+    registry = Path(registry)
+    if not registry.is_dir():
+        return []
+    return sorted(d.name for d in registry.iterdir() if d.is_dir() and (d / METADATA_FILE).exists())
+
+def active_version(registry=REGISTRY_PATH):
+    """Version named in ACTIVE, or None"""
+    try:
+        version = (Path(registry) / ACTIVE_FILE).read_text().strip()
+    except FileNotFoundError:
+        return None
+    return version or None
+
+def read_metadata(version, registry=REGISTRY_PATH):
+    with open(Path(registry) / version / METADATA_FILE, 'r') as f:
+        return json.load(f)
+
+def next_version(registry=REGISTRY_PATH):
+    numbers = [int(v[1:]) for v in list_versions(registry) if v[:1] == 'v' and v[1:].isdigit()]
+    return f"v{max(numbers, default=0) + 1:04d}"
+
+def publish(model_path, class_labels_path, registry=REGISTRY_PATH, version=None, metadata=None,
+            cascade_config=None, activate=False):
+    """Copy a trained model into a new registry version; returns the version name"""
+    registry = Path(registry)
+    registry.mkdir(parents=True, exist_ok=True)
+    version = version or next_version(registry)
+    target = registry / version
+    if target.exists():
+        raise ValueError(f"Version already exists: {version}")
+
+    # Assemble in a temp folder and rename, so a version is never visible half-copied
+    staging = registry / f".{version}.tmp"
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir()
+    shutil.copy2(model_path, staging / MODEL_FILE)
+    shutil.copy2(class_labels_path, staging / LABELS_FILE)
+    with open(class_labels_path, 'r') as f:
+        class_labels = json.load(f)
+
+    if cascade_config is not None:
+        cascade_config = Path(cascade_config)
+        with open(cascade_config, 'r') as f:
+            config = json.load(f)
+        shutil.copy2(cascade_config.parent / config['stage1_model'], staging / config['stage1_model'])
+        shutil.copy2(cascade_config, staging / CASCADE_FILE)
+
+    info = dict(metadata or {})
+    info.update({
+        'version': version,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'source_model': str(model_path),
+        'classes': [class_labels[str(i)] for i in range(len(class_labels))],
+        'cascade': cascade_config is not None
+    })
+    with open(staging / METADATA_FILE, 'w') as f:
+        json.dump(info, f, indent=4)
+
+    # Serving copies load faster than the .h5 files (servers fall back to the .h5 without them)
+    from model_export import export_model
+    export_model(staging / MODEL_FILE)
+    if cascade_config is not None:
+        export_model(staging / config['stage1_model'])
+    os.replace(staging, target)
+
+    if activate:
+        activate_version(version, registry)
+    return version
+
+def activate_version(version, registry=REGISTRY_PATH):
+    """Point ACTIVE at a published version (servers pick it up on their next check)"""
+    if version not in list_versions(registry):
+        raise ValueError(f"Unknown version: {version}")
+    _write_atomic(Path(registry) / ACTIVE_FILE, version + "\n")
+
+class ServingModel:
+    """One loaded model version: model, labels, optional cascade; immutable once serving"""
+
+    def __init__(self, version, model, class_labels, metadata=None, cascade=None, model_path=None):
+        self.version = version
+        self.model = model
+        self.model_path = model_path
+        self.class_labels = class_labels
+        self.metadata = metadata or {}
+        self.cascade = cascade
+        self.loaded_at = time.time()
+
+    @classmethod
+    def load(cls, model_path, class_labels_path, version=UNVERSIONED, metadata=None,
+             cascade_config=None):
+        from model_export import load_inference_model
+        from cascade import CascadeClassifier
+
+        model = load_inference_model(model_path)
+        with open(class_labels_path, 'r') as f:
+            class_labels = json.load(f)
+        cascade = None
+        if cascade_config is not None and Path(cascade_config).exists():
+            cascade = CascadeClassifier.load(model, cascade_config)
+        return cls(version, model, class_labels, metadata, cascade, model_path)
+
+    @classmethod
+    def load_version(cls, version, registry=REGISTRY_PATH, use_cascade=True):
+        folder = Path(registry) / version
+        return cls.load(folder / MODEL_FILE, folder / LABELS_FILE, version, read_metadata(version, registry),
+                        folder / CASCADE_FILE if use_cascade else None)
+
+    def keras_model(self):
+        """The Keras model (for layer access); loaded from the model file when serving an export"""
+        from model_export import ExportedModel
+        if not isinstance(self.model, ExportedModel):
+            return self.model
+        from tensorflow import keras
+        return keras.models.load_model(self.model_path)
+
+    def classify(self, batch):
+        """Spectrogram batch -> (probabilities, stage per clip: 'fast' or 'full')"""
+        if self.cascade is None:
+            return self.model.predict(batch, verbose=0), ['full'] * len(batch)
+        probabilities, escalated = self.cascade.classify(batch)
+        return probabilities, ['full' if e else 'fast' for e in escalated]
+
+    def warm_up(self, input_shape, batch_sizes=(1,)):
+        """Run dummy batches so the first real request doesn't pay for graph tracing"""
+        for size in batch_sizes:
+            self.classify(np.zeros((size, *input_shape), dtype=np.float32))
+        if self.cascade is not None:
+            self.cascade.reset_stats()
+
+    def info(self):
+        return {
+            'version': self.version,
+            'loaded_at': self.loaded_at,
+            'classes': len(self.class_labels),
+            'format': model_format(self.model),
+            'cascade': self.cascade is not None
+        }
+
+class ModelReloader(threading.Thread):
+    """Background thread: when ACTIVE changes, load + warm up that version, then call on_swap(new)"""
+
+    def __init__(self, current_version, on_swap, input_shape, batch_sizes=(1,), registry=REGISTRY_PATH,
+                 use_cascade=True, interval=RELOAD_CHECK_SECONDS):
+        super().__init__(daemon=True, name="model-reloader")
+        self.current_version = current_version
+        self.on_swap = on_swap
+        self.input_shape = input_shape
+        self.batch_sizes = batch_sizes
+        self.registry = Path(registry)
+        self.use_cascade = use_cascade
+        self.interval = interval
+        self.failed_version = None
+        self.last_error = None
+        self.swaps = 0
+
+    def check(self):
+        """Load the active version if it differs from the one serving; returns True if swapped"""
+        version = active_version(self.registry)
+        if version is None or version in (self.current_version, self.failed_version):
+            return False
+        try:
+            print(f"🔄 Loading model version {version}...")
+            serving = ServingModel.load_version(version, self.registry, self.use_cascade)
+            serving.warm_up(self.input_shape, self.batch_sizes)
+        except Exception as e:
+            # Keep serving the current version; don't retry this one until ACTIVE changes again
+            self.failed_version = version
+            self.last_error = f"{version}: {e}"
+            print(f"❌ Model version {version} failed to load: {e}")
+            traceback.print_exc()
+            return False
+        self.on_swap(serving)
+        self.current_version = version
+        self.failed_version = None
+        self.last_error = None
+        self.swaps += 1
+        print(f"✅ Now serving model version {version}")
+        return True
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            self.check()
+
+    def status(self):
+        return {'swaps': self.swaps, 'last_error': self.last_error, 'registry': str(self.registry)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage versioned models for serving")
+    parser.add_argument('--registry', type=Path, default=REGISTRY_PATH, help="Registry folder")
+    sub = parser.add_subparsers(dest='command', required=True)
+    pub = sub.add_parser('publish', help="Copy a trained model into a new version")
+    pub.add_argument('--model', type=Path, required=True, help="Trained model (.h5)")
+    pub.add_argument('--labels', type=Path, required=True, help="class_labels.json")
+    pub.add_argument('--cascade', type=Path, default=None, help="cascade.json to ship with this version")
+    pub.add_argument('--version', default=None, help="Version name (default: next vNNNN)")
+    pub.add_argument('--note', default=None, help="Free-text note stored in metadata.json")
+    pub.add_argument('--activate', action='store_true', help="Serve this version right away")
+    sub.add_parser('list', help="List versions")
+    act = sub.add_parser('activate', help="Serve a published version")
+    act.add_argument('version')
+    args = parser.parse_args()
+
+    if args.command == 'publish':
+        metadata = {'note': args.note} if args.note else None
+        version = publish(args.model, args.labels, args.registry, args.version, metadata,
+                          args.cascade, args.activate)
+        print(f"✅ Published {version}{' (active)' if args.activate else ''}")
+    elif args.command == 'activate':
+        activate_version(args.version, args.registry)
+        print(f"✅ Active version: {args.version}")
+    else:
+        active = active_version(args.registry)
+        versions = list_versions(args.registry)
+        if not versions:
+            print(f"No versions in {args.registry}")
+        for version in versions:
+            meta = read_metadata(version, args.registry)
+            marker = "*" if version == active else " "
+            print(f"{marker} {version}  {meta['created_at']}  {len(meta['classes'])} classes"
+                  f"{'  cascade' if meta.get('cascade') else ''}  {meta.get('note', '')}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""
+Prediction Store - append-only, resumable storage for batch prediction results
+Rows are buffered and flushed in row groups, so a crash loses at most one
+unflushed group and a rerun can skip files that are already scored.
+
+Formats (picked from the output path):
+    *.csv      - one file, appended per row group, probabilities as prob_<class> columns
+    *.parquet  - a directory of part files (needs pyarrow), probabilities stored as
+                 one fixed-size float32 list column
+"""
+
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import json
+import os
+import shutil
+
+ROW_GROUP_SIZE = 1024  # Rows buffered before each flush
+CSV_READ_CHUNK = 100000
+SCALAR_COLUMNS = ['filename', 'filepath', 'true_label', 'predicted_label', 'confidence', 'correct']
+NO_SOUND_LABEL = 'NoSound'  # predicted_label stored for clips skipped by the silence gate
+ERROR_LABEL = 'Error'  # predicted_label stored for files that could not be decoded
+
+def is_parquet(path):
+    return Path(path).suffix.lower() == '.parquet'
+
+def _require_pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        return pa, pq
+    except ImportError:
+        raise ImportError("Parquet output needs pyarrow: pip install pyarrow (or use a .csv output)")
+
+def _parquet_parts(path):
+    path = Path(path)
+    if not path.is_dir():
+        return []
+    return sorted(p for p in path.iterdir() if p.name.startswith('part-') and p.suffix == '.parquet')
+
+class ClassMismatchError(ValueError):
+    """The store was written for a different set of classes than the current model's"""
+
+def stored_class_names(path):
+    """Class names of the probability columns already in the store, or None if it is empty"""
+    path = Path(path)
+    if is_parquet(path):
+        parts = _parquet_parts(path)
+        if not parts:
+            return None
+        _, pq = _require_pyarrow()
+        return json.loads(pq.read_schema(parts[0]).metadata[b'class_names'])
+    if not path.exists() or path.stat().st_size == 0:
+        return None
+    columns = pd.read_csv(path, nrows=0).columns
+    return [c[len('prob_'):] for c in columns if c.startswith('prob_')]
+
+def remove_results(path):
+    """Delete a store (CSV file or Parquet directory) if it exists"""
+    path = Path(path)
+    if path.is_dir():
+        shutil.rmtree(path)
+    elif path.exists():
+        path.unlink()
+
+class ResultWriter:
+    """Buffer prediction rows and append them to the store in row groups"""
+
+    def __init__(self, path, class_names, row_group_size=ROW_GROUP_SIZE):
+        self.path = Path(path)
+        self.class_names = list(class_names)
+        self.row_group_size = row_group_size
+        self.rows = []
+        self.probs = []
+        self.written = 0
+        # Appending rows of another class set would misalign the probability columns
+        existing = stored_class_names(self.path)
+        if existing is not None and existing != self.class_names:
+            raise ClassMismatchError(f"{self.path} holds results for other classes ({', '.join(existing)}); "
+                             f"use another output or overwrite it")
+        if not is_parquet(self.path):
+            self._drop_partial_csv_line()
+
+    def _drop_partial_csv_line(self):
+        """Cut a half-written last line left behind by a crash mid-flush"""
+        if not self.path.exists() or self.path.stat().st_size == 0:
+            return
+        with open(self.path, 'rb+') as f:
+            end = f.seek(0, os.SEEK_END)
+            pos = end
+            while pos > 0:
+                step = min(65536, pos)
+                f.seek(pos - step)
+                block = f.read(step)
+                newline = block.rfind(b'\n')
+                if newline != -1:
+                    if pos - step + newline + 1 != end:
+                        f.truncate(pos - step + newline + 1)
+                    return
+                pos -= step
+            f.truncate(0)
+
+    def add(self, result, probabilities):
+        """result: dict with SCALAR_COLUMNS; probabilities: per-class scores in percent"""
+        self.rows.append(result)
+        self.probs.append(np.asarray(probabilities, dtype=np.float32))
+        if len(self.rows) >= self.row_group_size:
+            self.flush()
+
+    def add_frame(self, df):
+        """Append a DataFrame chunk (SCALAR_COLUMNS + prob_<class> columns) as its own row group"""
+        self.flush()
+        if len(df) == 0:
+            return
+        prob_cols = [f'prob_{c}' for c in self.class_names]
+        self.rows = df[SCALAR_COLUMNS].to_dict('records')
+        self.probs = list(df[prob_cols].to_numpy(dtype=np.float32))
+        self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        df = pd.DataFrame(self.rows, columns=SCALAR_COLUMNS)
+        df['confidence'] = df['confidence'].astype(np.float32)
+        probs = np.stack(self.probs)
+        if is_parquet(self.path):
+            self._flush_parquet(df, probs)
+        else:
+            self._flush_csv(df, probs)
+        self.written += len(df)
+        self.rows, self.probs = [], []
+
+    def _flush_csv(self, df, probs):
+        prob_df = pd.DataFrame(probs, columns=[f'prob_{c}' for c in self.class_names], index=df.index)
+        out = pd.concat([df, prob_df], axis=1)
+        new_file = not self.path.exists() or self.path.stat().st_size == 0
+        with open(self.path, 'a', newline='') as f:
+            out.to_csv(f, header=new_file, index=False, float_format='%.6g')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _flush_parquet(self, df, probs):
+        pa, pq = _require_pyarrow()
+        self.path.mkdir(parents=True, exist_ok=True)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        flat = pa.array(probs.reshape(-1), type=pa.float32())
+        table = table.append_column('probabilities',
+                                    pa.FixedSizeListArray.from_arrays(flat, len(self.class_names)))
+        table = table.replace_schema_metadata({'class_names': json.dumps(self.class_names)})
+        parts = _parquet_parts(self.path)
+        next_id = int(parts[-1].stem.split('-')[1]) + 1 if parts else 0
+        # Write under a temp name and rename, so readers never see a half-written part
+        tmp_path = self.path / f".part-{next_id:06d}.parquet.tmp"
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, self.path / f"part-{next_id:06d}.parquet")
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def iter_result_chunks(path, columns=None):
+    """
+    Stream the store as DataFrame chunks. Probabilities come back as prob_<class> columns.
+    columns: restrict to these scalar columns (None = everything, including probabilities)
+    """
+    path = Path(path)
+    if is_parquet(path):
+        pa, pq = _require_pyarrow()
+        for part in _parquet_parts(path):
+            pf = pq.ParquetFile(part)
+            class_names = json.loads(pf.schema_arrow.metadata[b'class_names'])
+            for batch in pf.iter_batches(columns=columns):
+                table = pa.Table.from_batches([batch])
+                if columns is not None:
+                    yield table.to_pandas()
+                    continue
+                probs = table.column('probabilities').combine_chunks().flatten().to_numpy()
+                df = table.drop_columns(['probabilities']).to_pandas()
+                prob_df = pd.DataFrame(probs.reshape(-1, len(class_names)),
+                                       columns=[f'prob_{c}' for c in class_names])
+                yield pd.concat([df, prob_df], axis=1)
+    elif path.exists() and path.stat().st_size > 0:
+        yield from pd.read_csv(path, usecols=columns, chunksize=CSV_READ_CHUNK)
+
+def iter_latest_chunks(path, columns=None):
+    """
+    Like iter_result_chunks, but only the last row stored for each filepath: a file that was
+    scored again (e.g. re-recorded in a watched folder) supersedes its earlier rows
+    """
+    last = {}
+    rows = 0
+    for chunk in iter_result_chunks(path, columns=['filepath']):
+        last.update(zip(chunk['filepath'], range(rows, rows + len(chunk))))
+        rows += len(chunk)
+    if len(last) == rows:
+        yield from iter_result_chunks(path, columns)
+        return
+    keep = np.zeros(rows, dtype=bool)
+    keep[np.fromiter(last.values(), dtype=np.int64, count=len(last))] = True
+    offset = 0
+    for chunk in iter_result_chunks(path, columns):
+        mask = keep[offset:offset + len(chunk)]
+        offset += len(chunk)
+        yield chunk[mask].reset_index(drop=True)
+
+def read_results(path, columns=None):
+    """Whole store as one DataFrame, latest row per file (empty if nothing has been written yet)"""
+    chunks = list(iter_latest_chunks(path, columns))
+    if not chunks:
+        return pd.DataFrame(columns=columns or SCALAR_COLUMNS)
+    return pd.concat(chunks, ignore_index=True)
+
+def scored_paths(path):
+    """Set of filepaths already present in the store"""
+    done = set()
+    for chunk in iter_result_chunks(path, columns=['filepath']):
+        done.update(chunk['filepath'])
+    return done
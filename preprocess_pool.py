@@ -0,0 +1,143 @@
+"""
+Preprocessing Pool - runs audio decoding, mel computation and spectrogram rendering
+in persistent worker processes, so the web server's request threads are not
+serialized on the GIL while the model stays in the main process.
+
+Workers import librosa once at startup. Finished spectrogram images are
+written into a shared-memory slot and only the slot number travels back through
+the pool, so the arrays themselves are never pickled.
+"""
+
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from multiprocessing import shared_memory
+import numpy as np
+import atexit
+import queue
+
+# Worker-process globals (set by _init_worker)
+_params = None
+_slots = None
+_shm = None
+
+def _init_worker(shm_name, num_slots, params):
+    """Pre-import the heavy libraries and attach to the shared result buffer"""
+    global _params, _slots, _shm
+    # librosa loads its submodules lazily, so import the ones the pipeline uses explicitly
+    import librosa.core.audio  # noqa: F401
+    import librosa.core.spectrum  # noqa: F401
+    import librosa.feature.spectral  # noqa: F401
+    import PIL.Image  # noqa: F401
+
+    _params = params
+    _shm = shared_memory.SharedMemory(name=shm_name)
+    height, width = params['img_size']
+    _slots = np.ndarray((num_slots, height, width, 3), dtype=np.float32, buffer=_shm.buf)
+
+def audio_to_image_array(audio_path, params):
+    """
+    Audio file -> normalized (H, W, 3) float32 spectrogram image, the same pipeline as
+    training: active-window load, mel dB spectrogram, specshow-identical render, nearest
+    resize, / 255. Rendered with the lookup-table renderer, so matplotlib is never imported.
+    Raises SilentAudioError for silent clips.
+    """
+    from audio_gate import load_active_clip
+    from spectrogram_renderer import clip_to_model_input
+
+    # Load audio, gate silence and cut the most energetic fixed-length window
+    y, sr = load_active_clip(audio_path, params['sample_rate'], params['duration'])
+    return clip_to_model_input(y, sr, params['n_mels'], params['hop_length'], params['img_size'])
+
+def _preprocess_into_slot(audio_path, slot):
+    _slots[slot] = audio_to_image_array(audio_path, _params)
+    return slot
+
+class PreprocessPool:
+    """Persistent process pool returning model-ready spectrogram batches"""
+
+    def __init__(self, workers, params, slots_per_worker=2, wait_ready=True):
+        self.params = dict(params)
+        height, width = self.params['img_size']
+        self.num_slots = workers * slots_per_worker
+        slot_bytes = height * width * 3 * np.dtype(np.float32).itemsize
+
+        self.shm = shared_memory.SharedMemory(create=True, size=self.num_slots * slot_bytes)
+        self.slots = np.ndarray((self.num_slots, height, width, 3), dtype=np.float32, buffer=self.shm.buf)
+        self.free_slots = queue.Queue()
+        for slot in range(self.num_slots):
+            self.free_slots.put(slot)
+
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(self.shm.name, self.num_slots, self.params)
+        )
+        # Start every worker now so the first requests don't pay the import cost; with
+        # wait_ready=False the workers import in the background while the caller keeps starting up
+        ready = [self.executor.submit(_noop, i) for i in range(workers)]
+        if wait_ready:
+            wait(ready)
+        atexit.register(self.close)
+
+    def preprocess(self, audio_path):
+        """Blocking: audio file -> (1, H, W, 3) float32 batch. Thread-safe."""
+        slot = self.free_slots.get()
+        try:
+            self.executor.submit(_preprocess_into_slot, str(audio_path), slot).result()
+            return self.slots[slot][np.newaxis].copy()
+        finally:
+            self.free_slots.put(slot)
+
+    def iter_preprocessed(self, audio_paths):
+        """
+        Preprocess many files in parallel; yields (path, batch or None, error or None)
+        in completion order. Only blocks waiting for a free slot when holding none,
+        so concurrent callers cannot deadlock each other.
+        """
+        paths = iter(audio_paths)
+        in_flight = {}
+        exhausted = False
+        try:
+            while True:
+                while not exhausted:
+                    try:
+                        slot = self.free_slots.get(block=not in_flight)
+                    except queue.Empty:
+                        break
+                    path = next(paths, None)
+                    if path is None:
+                        self.free_slots.put(slot)
+                        exhausted = True
+                        break
+                    in_flight[self.executor.submit(_preprocess_into_slot, str(path), slot)] = (path, slot)
+                if not in_flight:
+                    return
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path, slot = in_flight.pop(future)
+                    batch, error = None, None
+                    try:
+                        future.result()
+                        batch = self.slots[slot][np.newaxis].copy()
+                    except Exception as e:
+                        error = e
+                    finally:
+                        self.free_slots.put(slot)
+                    yield path, batch, error
+        finally:
+            # Consumer stopped early: let outstanding work finish before reusing its slots
+            for future, (_, slot) in in_flight.items():
+                wait([future])
+                self.free_slots.put(slot)
+
+    def close(self):
+        if self.executor is None:
+            return
+        self.executor.shutdown(wait=True)
+        self.executor = None
+        self.slots = None
+        self.shm.close()
+        self.shm.unlink()
+
+def _noop(_):
+    return None
@@ -0,0 +1,256 @@
+"""
+Similarity Index - nearest-neighbour search over CNN embeddings
+Runs the trained CNN over the spectrogram dataset, takes the activations of the
+penultimate Dense(256) layer and stores them as a persisted vector index.
+
+Search modes:
+    exact - brute-force cosine similarity with batched matrix multiplication
+    ivf   - inverted file index (spherical k-means lists), only the closest lists are scanned
+
+Build the index:
+    python similarity_index.py
+"""
+
+from pathlib import Path
+import numpy as np
+import hashlib
+import json
+import os
+import shutil
+import argparse
+
+# ========== CONFIGURATION ==========
+PROJECT_PATH = Path(r"C:\Users\sasik\OneDrive\Documents\AnimalVoicedetection")
+SPECTROGRAM_PATH = PROJECT_PATH / "spectrograms_dataset"
+MODEL_PATH = PROJECT_PATH / "trained_model" / "animal_sound_classifier.h5"
+INDEX_PATH = PROJECT_PATH / "trained_model" / "similarity_index"
+META_FILE = "index.json"
+
+IMG_SIZE = (128, 128)
+EMBEDDING_UNITS = 256  # Width of the penultimate Dense layer
+EMBED_BATCH_SIZE = 64
+SEARCH_CHUNK = 65536  # Rows scored per matrix multiplication in exact search
+KMEANS_ITERATIONS = 20
+DEFAULT_NPROBE = 8
+
+def build_embedding_model(model):
+    """Sub-model that outputs the penultimate Dense(256) activations"""
+    from tensorflow import keras
+
+    dense_layers = [l for l in model.layers if isinstance(l, keras.layers.Dense)]
+    candidates = [l for l in dense_layers[:-1] if l.units == EMBEDDING_UNITS]
+    if not candidates:
+        raise ValueError(f"Model has no Dense({EMBEDDING_UNITS}) layer before the output layer")
+    return keras.Model(model.inputs, candidates[-1].output)
+
+def model_fingerprint(model_path, chunk_size=1 << 20):
+    """Content hash of a model file; identifies the model an index was built with"""
+    digest = hashlib.sha1()
+    with open(model_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def model_identity(model_path):
+    """Index metadata for the model: content hash, plus its registry version when it is a published copy"""
+    from model_registry import METADATA_FILE, UNVERSIONED
+
+    version = UNVERSIONED
+    try:
+        with open(Path(model_path).parent / METADATA_FILE, 'r') as f:
+            version = json.load(f).get('version', UNVERSIONED)
+    except (FileNotFoundError, ValueError):
+        pass
+    return {'path': str(model_path), 'version': version, 'sha1': model_fingerprint(model_path)}
+
+def normalize(vectors):
+    """L2-normalize rows so that dot product == cosine similarity"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+def _top_k(scores, ids, k):
+    """Top-k (ids, scores) of a 1-D score array, highest first"""
+    k = min(k, len(scores))
+    if k == 0:
+        return ids[:0], scores[:0]
+    part = np.argpartition(-scores, k - 1)[:k]
+    order = part[np.argsort(-scores[part])]
+    return ids[order], scores[order]
+
+def spherical_kmeans(vectors, n_lists, iterations=KMEANS_ITERATIONS, seed=42):
+    """Cluster normalized vectors by cosine similarity; returns (centroids, assignments)"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)].copy()
+    assignments = np.zeros(len(vectors), dtype=np.int64)
+    for _ in range(iterations):
+        for start in range(0, len(vectors), SEARCH_CHUNK):
+            chunk = vectors[start:start + SEARCH_CHUNK]
+            assignments[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        counts = np.bincount(assignments, minlength=n_lists)
+        # Re-seed empty lists with random vectors
+        empty = counts == 0
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+        centroids = normalize(sums)
+    return centroids, assignments
+
+class SimilarityIndex:
+    """Persisted embedding index with exact and IVF search"""
+
+    def __init__(self, vectors, entries, centroids=None, list_ids=None, list_offsets=None, model=None):
+        self.vectors = normalize(vectors)
+        self.entries = entries
+        self.centroids = centroids
+        self.list_ids = list_ids
+        self.list_offsets = list_offsets
+        self.model = model  # model_identity() of the model that produced the vectors (None: unknown)
+
+    def __len__(self):
+        return len(self.vectors)
+
+    @classmethod
+    def build(cls, vectors, entries, n_lists=None, model=None):
+        """Build the index; n_lists=None picks ~sqrt(N) IVF lists, 0 disables IVF"""
+        index = cls(vectors, entries, model=model)
+        if n_lists is None:
+            n_lists = int(np.sqrt(len(index.vectors)))
+        if n_lists > 0 and len(index.vectors) >= n_lists:
+            centroids, assignments = spherical_kmeans(index.vectors, n_lists)
+            index.centroids = centroids
+            index.list_ids = np.argsort(assignments, kind='stable')
+            index.list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=n_lists))])
+        return index
+
+    def save(self, path=INDEX_PATH):
+        """Write all files into a temp folder and swap it in, so no stale IVF files survive a rebuild"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        old_path = path.with_name(f".{path.name}.old")
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        tmp_path.mkdir()
+        np.save(tmp_path / "vectors.npy", self.vectors)
+        n_lists = 0 if self.centroids is None else len(self.centroids)
+        if n_lists:
+            np.save(tmp_path / "ivf_centroids.npy", self.centroids)
+            np.save(tmp_path / "ivf_ids.npy", self.list_ids)
+            np.save(tmp_path / "ivf_offsets.npy", self.list_offsets)
+        with open(tmp_path / "entries.json", 'w') as f:
+            json.dump(self.entries, f)
+        with open(tmp_path / META_FILE, 'w') as f:
+            json.dump({'vectors': len(self.vectors), 'n_lists': n_lists, 'model': self.model}, f)
+
+        shutil.rmtree(old_path, ignore_errors=True)
+        if path.exists():
+            os.replace(path, old_path)
+        os.replace(tmp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+    @classmethod
+    def load(cls, path=INDEX_PATH):
+        path = Path(path)
+        with open(path / "entries.json", 'r') as f:
+            entries = json.load(f)
+        try:
+            with open(path / META_FILE, 'r') as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            meta = {'n_lists': None}  # Index saved before index.json existed
+        index = cls.__new__(cls)
+        index.vectors = np.load(path / "vectors.npy")
+        index.entries = entries
+        index.centroids = index.list_ids = index.list_offsets = None
+        index.model = meta.get('model')
+        use_ivf = meta['n_lists'] != 0 and (path / "ivf_centroids.npy").exists()
+        if use_ivf:
+            list_ids = np.load(path / "ivf_ids.npy")
+            if len(list_ids) == len(index.vectors):  # IVF lists must cover exactly these vectors
+                index.centroids = np.load(path / "ivf_centroids.npy")
+                index.list_ids = list_ids
+                index.list_offsets = np.load(path / "ivf_offsets.npy")
+        return index
+
+    def search_exact(self, query, k=10):
+        """Brute-force top-k by cosine similarity, scored in chunks of SEARCH_CHUNK rows"""
+        query = normalize(query)
+        best_ids = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        for start in range(0, len(self.vectors), SEARCH_CHUNK):
+            scores = self.vectors[start:start + SEARCH_CHUNK] @ query
+            ids, top = _top_k(scores, np.arange(start, start + len(scores)), k)
+            best_ids, best_scores = _top_k(np.concatenate([best_scores, top]),
+                                           np.concatenate([best_ids, ids]), k)
+        return best_ids, best_scores
+
+    def search_ivf(self, query, k=10, nprobe=DEFAULT_NPROBE):
+        """Approximate top-k: only scan the nprobe lists whose centroids are closest"""
+        if self.centroids is None:
+            return self.search_exact(query, k)
+        query = normalize(query)
+        probe = np.argsort(-(self.centroids @ query))[:nprobe]
+        candidates = np.concatenate([
+            self.list_ids[self.list_offsets[l]:self.list_offsets[l + 1]] for l in probe
+        ])
+        return _top_k(self.vectors[candidates] @ query, candidates, k)
+
+    def search(self, query, k=10, method='exact', nprobe=DEFAULT_NPROBE):
+        """Return the top-k neighbours as a list of entry dicts with a 'similarity' score"""
+        if method == 'ivf':
+            ids, scores = self.search_ivf(query, k, nprobe)
+        else:
+            ids, scores = self.search_exact(query, k)
+        return [dict(self.entries[i], similarity=float(s)) for i, s in zip(ids, scores)]
+
+def embed_dataset(model_path=MODEL_PATH, spectrogram_path=SPECTROGRAM_PATH):
+    """Run the trained CNN over every spectrogram and return (embeddings, entries)"""
+    from tensorflow import keras
+    from tqdm import tqdm
+
+    embedding_model = build_embedding_model(keras.models.load_model(model_path))
+
+    entries = []
+    for class_dir in sorted(d for d in Path(spectrogram_path).iterdir() if d.is_dir()):
+        with os.scandir(class_dir) as it:
+            names = sorted(e.name for e in it if e.is_file() and e.name.endswith('.png'))
+        entries.extend({'path': str(class_dir / n), 'label': class_dir.name} for n in names)
+
+    embeddings = np.empty((len(entries), EMBEDDING_UNITS), dtype=np.float32)
+    for start in tqdm(range(0, len(entries), EMBED_BATCH_SIZE), desc="Embedding"):
+        batch = entries[start:start + EMBED_BATCH_SIZE]
+        images = np.stack([
+            keras.preprocessing.image.img_to_array(
+                keras.preprocessing.image.load_img(e['path'], target_size=IMG_SIZE)) / 255.0
+            for e in batch
+        ])
+        embeddings[start:start + len(batch)] = embedding_model.predict(images, verbose=0)
+    return embeddings, entries
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the nearest-neighbour sound index")
+    parser.add_argument('--model', type=Path, default=MODEL_PATH, help="Trained model")
+    parser.add_argument('--output', type=Path, default=INDEX_PATH, help="Index directory")
+    parser.add_argument('--lists', type=int, default=None,
+                        help="Number of IVF lists (default: sqrt(N), 0 = exact search only)")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("BUILDING SIMILARITY INDEX")
+    print("=" * 60)
+
+    if not SPECTROGRAM_PATH.exists():
+        print(f"❌ Spectrogram directory not found: {SPECTROGRAM_PATH}")
+        return
+
+    embeddings, entries = embed_dataset(args.model)
+    print(f"📊 Embedded {len(entries)} spectrograms")
+
+    index = SimilarityIndex.build(embeddings, entries, n_lists=args.lists, model=model_identity(args.model))
+    index.save(args.output)
+
+    ivf_info = f"{len(index.list_offsets) - 1} IVF lists" if index.centroids is not None else "exact only"
+    print(f"✅ Index saved: {args.output} ({len(index)} vectors, {ivf_info})")
+
+if __name__ == "__main__":
+    main()
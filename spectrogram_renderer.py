@@ -0,0 +1,137 @@
+"""
+Spectrogram Renderer - matplotlib-free PNG rendering of mel spectrograms
+Maps the dB mel matrix through a precomputed 256-entry inferno lookup table and
+writes the image with Pillow. The output has the same geometry as the
+librosa.display.specshow figure used in training (figsize 4x4 at 72 dpi, mel
+axis on librosa's symlog scale, bbox tight): each output pixel is assigned the
+spectrogram cell whose pcolormesh quad covers the pixel centre, so the images
+match the specshow PNGs pixel for pixel.
+"""
+
+from functools import lru_cache
+import numpy as np
+import io
+
+# matplotlib's 'inferno' colormap sampled at its 256 entries, RGB bytes
+INFERNO_LUT = np.frombuffer(bytes.fromhex(
+    "00000401000501010601010802010a02020c02020e03021004031204031405041706041907051b08051d09061f0a0722"
+    "0b07240c08260d08290e092b10092d110a30120a32140b34150b37160b39180c3c190c3e1b0c411c0c431e0c451f0c48"
+    "210c4a230c4c240c4f260c51280b53290b552b0b572d0b592f0a5b310a5c320a5e340a5f3609613809623909633b0964"
+    "3d09653e0966400a67420a68440a68450a69470b6a490b6a4a0c6b4c0c6b4d0d6c4f0d6c510e6c520e6d540f6d550f6d"
+    "57106e59106e5a116e5c126e5d126e5f136e61136e62146e64156e65156e67166e69166e6a176e6c186e6d186e6f196e"
+    "71196e721a6e741a6e751b6e771c6d781c6d7a1d6d7c1d6d7d1e6d7f1e6c801f6c82206c84206b85216b87216b88226a"
+    "8a226a8c23698d23698f24699025689225689326679526679727669827669a28659b29649d29649f2a63a02a63a22b62"
+    "a32c61a52c60a62d60a82e5fa92e5eab2f5ead305dae305cb0315bb1325ab3325ab43359b63458b73557b93556ba3655"
+    "bc3754bd3853bf3952c03a51c13a50c33b4fc43c4ec63d4dc73e4cc83f4bca404acb4149cc4248ce4347cf4446d04545"
+    "d24644d34743d44842d54a41d74b3fd84c3ed94d3dda4e3cdb503bdd513ade5238df5337e05536e15635e25734e35933"
+    "e45a31e55c30e65d2fe75e2ee8602de9612bea632aeb6429eb6628ec6726ed6925ee6a24ef6c23ef6e21f06f20f1711f"
+    "f1731df2741cf3761bf37819f47918f57b17f57d15f67e14f68013f78212f78410f8850ff8870ef8890cf98b0bf98c0a"
+    "f98e09fa9008fa9207fa9407fb9606fb9706fb9906fb9b06fb9d07fc9f07fca108fca309fca50afca60cfca80dfcaa0f"
+    "fcac11fcae12fcb014fcb216fcb418fbb61afbb81dfbba1ffbbc21fbbe23fac026fac228fac42afac62df9c72ff9c932"
+    "f9cb35f8cd37f8cf3af7d13df7d340f6d543f6d746f5d949f5db4cf4dd4ff4df53f4e156f3e35af3e55df2e661f2e865"
+    "f2ea69f1ec6df1ed71f1ef75f1f179f2f27df2f482f3f586f3f68af4f88ef5f992f6fa96f8fb9af9fc9dfafda1fcffa4"
+), dtype=np.uint8).reshape(256, 3)
+INFERNO_LUT_FLOAT = INFERNO_LUT.astype(np.float32) / 255.0  # Model-input scale
+
+# librosa.display sets the mel axis to symlog(linthresh=1000, base=2)
+MEL_LINTHRESH = 1000.0
+MEL_LOG_BASE = 2.0
+
+def _cell_edges(centers):
+    """Quad edges around cell centres (pcolormesh shading='nearest')"""
+    half = np.diff(centers) / 2
+    return np.concatenate([[centers[0] - half[0]], centers[:-1] + half, [centers[-1] + half[-1]]])
+
+def _symlog(x, linthresh=MEL_LINTHRESH, base=MEL_LOG_BASE):
+    """matplotlib SymmetricalLogTransform with linscale=1"""
+    linscale_adj = 1.0 / (1.0 - 1.0 / base)
+    magnitude = np.abs(x)
+    log_part = linthresh * (linscale_adj + np.log(np.maximum(magnitude, linthresh) / linthresh) / np.log(base))
+    return np.where(magnitude <= linthresh, x * linscale_adj, np.sign(x) * log_part)
+
+def _pixel_cells(edges, pixels, flip=False):
+    """Index of the cell covering each pixel centre along one axis"""
+    fraction = (np.arange(pixels) + 0.5) / pixels
+    if flip:
+        fraction = 1.0 - fraction  # Image rows run top to bottom, the axis bottom to top
+    positions = edges[0] + fraction * (edges[-1] - edges[0])
+    return np.clip(np.searchsorted(edges, positions, side='right') - 1, 0, len(edges) - 2)
+
+@lru_cache(maxsize=16)
+def pixel_map(n_mels, n_frames, sr, hop_length, width, height):
+    """(row indices, column indices) mapping image pixels to spectrogram cells"""
+    import librosa
+
+    mel_edges = _symlog(_cell_edges(librosa.mel_frequencies(n_mels, fmin=0.0, fmax=sr / 2)))
+    time_edges = _cell_edges(librosa.frames_to_time(np.arange(n_frames), sr=sr, hop_length=hop_length))
+    return _pixel_cells(mel_edges, height, flip=True), _pixel_cells(time_edges, width)
+
+def render_spectrogram(mel_spec_db, sr, hop_length, figsize=(4, 4), dpi=72):
+    """dB mel spectrogram -> (H, W, 3) uint8 RGB image, like specshow + savefig"""
+    width, height = round(figsize[0] * dpi), round(figsize[1] * dpi)
+    if mel_spec_db.shape[1] < 2:
+        raise ValueError("Need at least two frames to render a spectrogram")
+    rows, cols = pixel_map(mel_spec_db.shape[0], mel_spec_db.shape[1], sr, hop_length, width, height)
+
+    # Normalize to the data range and quantize like matplotlib's Colormap (N=256)
+    low, high = float(mel_spec_db.min()), float(mel_spec_db.max())
+    scaled = (mel_spec_db - low) / (high - low) if high > low else np.zeros_like(mel_spec_db)
+    levels = np.clip((scaled * 256).astype(np.int64), 0, 255).astype(np.uint8)
+    return INFERNO_LUT[levels[rows[:, np.newaxis], cols]]
+
+def _nearest_indices(src, dst):
+    """Source index sampled by Pillow's NEAREST resize for each of dst output pixels"""
+    from PIL import Image
+    ramp = np.arange(src, dtype=np.int32)[np.newaxis]
+    return np.asarray(Image.fromarray(ramp, mode='I').resize((dst, 1), Image.NEAREST))[0]
+
+@lru_cache(maxsize=16)
+def input_pixel_map(n_mels, n_frames, sr, hop_length, img_size, figsize=(4, 4), dpi=72):
+    """pixel_map composed with the nearest resize to img_size: model-input pixel -> spectrogram cell"""
+    width, height = round(figsize[0] * dpi), round(figsize[1] * dpi)
+    rows, cols = pixel_map(n_mels, n_frames, sr, hop_length, width, height)
+    return rows[_nearest_indices(height, img_size[0])], cols[_nearest_indices(width, img_size[1])]
+
+def batch_log_mel(clips, sr, n_mels, hop_length):
+    """(B, samples) clips -> (B, n_mels, frames) dB mel spectrograms, each relative to its own peak"""
+    import librosa
+
+    mel_spec = librosa.feature.melspectrogram(y=clips, sr=sr, n_mels=n_mels, hop_length=hop_length, fmax=sr//2)
+    return librosa.power_to_db(mel_spec, ref=mel_spec.max(axis=(-2, -1), keepdims=True))
+
+def render_model_inputs(mel_specs_db, sr, hop_length, img_size):
+    """
+    (B, n_mels, frames) dB batch -> (B, H, W, 3) float32 model inputs in one vectorized
+    pass; per clip the same values clip_to_model_input produces
+    """
+    rows, cols = input_pixel_map(mel_specs_db.shape[1], mel_specs_db.shape[2], sr, hop_length, tuple(img_size))
+    low = mel_specs_db.min(axis=(1, 2), keepdims=True)
+    span = mel_specs_db.max(axis=(1, 2), keepdims=True) - low
+    scaled = np.where(span > 0, (mel_specs_db - low) / np.where(span > 0, span, 1), 0)
+    levels = np.clip((scaled * 256).astype(np.int64), 0, 255)
+    return INFERNO_LUT_FLOAT[levels[:, rows[:, np.newaxis], cols]]
+
+def clip_to_model_input(y, sr, n_mels, hop_length, img_size):
+    """
+    Fixed-length clip -> normalized (H, W, 3) float32 model input, identical to loading
+    the training PNG with keras load_img(target_size) / 255, without writing a file
+    """
+    import librosa
+    from PIL import Image
+
+    mel_spec = librosa.feature.melspectrogram(y=y, sr=sr, n_mels=n_mels, hop_length=hop_length, fmax=sr//2)
+    img = Image.fromarray(render_spectrogram(librosa.power_to_db(mel_spec, ref=np.max), sr, hop_length))
+    height, width = img_size
+    if img.size != (width, height):
+        img = img.resize((width, height), Image.NEAREST)
+    return np.asarray(img, dtype=np.float32) / 255.0
+
+def save_spectrogram_png(image, save_path):
+    from PIL import Image
+    Image.fromarray(image).save(save_path, format='PNG')
+
+def spectrogram_png_bytes(image):
+    from PIL import Image
+    buf = io.BytesIO()
+    Image.fromarray(image).save(buf, format='PNG')
+    return buf.getvalue()
@@ -20,6 +20,14 @@ const retryBtn = document.getElementById('retryBtn');
 // ========== STATE ==========
 let selectedFile = null;
 
+// ========== CLIENT-SIDE AUDIO PREPARATION ==========
+// Must match the server's audio parameters (SAMPLE_RATE, DURATION in app.py,
+// HOP_LENGTH / MAX_LOAD_SECONDS in audio_gate.py)
+const TARGET_SAMPLE_RATE = 22050;
+const CLIP_SECONDS = 3;
+const WINDOW_HOP = 512;
+const MAX_SCAN_SECONDS = 60;
+
 // ========== UTILITY FUNCTIONS ==========
 function formatFileSize(bytes) {
     if (bytes === 0) return '0 Bytes';
@@ -35,6 +43,88 @@ function getConfidenceClass(confidence) {
     return 'low';
 }
 
+// Decode, downmix to mono, resample and trim in the browser, so we upload a small
+// 16-bit PCM WAV instead of the whole file. Returns null if the browser can't decode it.
+async function prepareClip(file) {
+    const AudioCtx = window.AudioContext || window.webkitAudioContext;
+    if (!AudioCtx || !window.OfflineAudioContext) return null;
+    
+    let decoded;
+    const ctx = new AudioCtx();
+    try {
+        decoded = await ctx.decodeAudioData(await file.arrayBuffer());
+    } catch (error) {
+        console.warn('Browser could not decode audio, uploading original file:', error);
+        return null;
+    } finally {
+        ctx.close();
+    }
+    
+    // Render up to MAX_SCAN_SECONDS as mono at TARGET_SAMPLE_RATE (Web Audio downmixes and resamples)
+    const seconds = Math.min(decoded.duration, MAX_SCAN_SECONDS);
+    const frames = Math.max(1, Math.ceil(seconds * TARGET_SAMPLE_RATE));
+    const offline = new OfflineAudioContext(1, frames, TARGET_SAMPLE_RATE);
+    const source = offline.createBufferSource();
+    source.buffer = decoded;
+    source.connect(offline.destination);
+    source.start(0);
+    const rendered = await offline.startRendering();
+    
+    return encodeWav(loudestWindow(rendered.getChannelData(0)), TARGET_SAMPLE_RATE);
+}
+
+// Most energetic CLIP_SECONDS of the samples, same search as the server's audio gate
+function loudestWindow(samples) {
+    const length = CLIP_SECONDS * TARGET_SAMPLE_RATE;
+    if (samples.length <= length) return samples;
+    
+    const power = new Float64Array(samples.length + 1);
+    for (let i = 0; i < samples.length; i++) power[i + 1] = power[i] + samples[i] * samples[i];
+    
+    const last = samples.length - length;
+    let bestStart = 0;
+    let bestEnergy = -1;
+    for (let start = 0; ; start = Math.min(start + WINDOW_HOP, last)) {
+        const energy = power[start + length] - power[start];
+        if (energy > bestEnergy) {
+            bestEnergy = energy;
+            bestStart = start;
+        }
+        if (start === last) break;
+    }
+    return samples.subarray(bestStart, bestStart + length);
+}
+
+// Mono float samples -> 16-bit PCM WAV blob
+function encodeWav(samples, sampleRate) {
+    const buffer = new ArrayBuffer(44 + samples.length * 2);
+    const view = new DataView(buffer);
+    const writeString = (offset, text) => {
+        for (let i = 0; i < text.length; i++) view.setUint8(offset + i, text.charCodeAt(i));
+    };
+    
+    writeString(0, 'RIFF');
+    view.setUint32(4, 36 + samples.length * 2, true);
+    writeString(8, 'WAVE');
+    writeString(12, 'fmt ');
+    view.setUint32(16, 16, true);             // fmt chunk size
+    view.setUint16(20, 1, true);              // PCM
+    view.setUint16(22, 1, true);              // mono
+    view.setUint32(24, sampleRate, true);
+    view.setUint32(28, sampleRate * 2, true); // byte rate
+    view.setUint16(32, 2, true);              // block align
+    view.setUint16(34, 16, true);             // bits per sample
+    writeString(36, 'data');
+    view.setUint32(40, samples.length * 2, true);
+    
+    for (let i = 0; i < samples.length; i++) {
+        const s = Math.max(-1, Math.min(1, samples[i]));
+        view.setInt16(44 + i * 2, s < 0 ? s * 0x8000 : s * 0x7FFF, true);
+    }
+    
+    return new Blob([buffer], { type: 'audio/wav' });
+}
+
 // ========== FILE UPLOAD HANDLERS ==========
 uploadArea.addEventListener('click', () => {
     audioFileInput.click();
@@ -117,11 +207,18 @@ predictBtn.addEventListener('click', async () => {
     resultsSection.style.display = 'none';
     errorSection.style.display = 'none';
     
-    // Create form data
-    const formData = new FormData();
-    formData.append('audio', selectedFile);
-    
     try {
+        // Create form data (compact clip when the browser can prepare it, original file otherwise)
+        const formData = new FormData();
+        const clip = await prepareClip(selectedFile).catch(() => null);
+        if (clip) {
+            const stem = selectedFile.name.replace(/\.[^.]+$/, '');
+            formData.append('audio', clip, `${stem}_clip.wav`);
+            console.log(`Uploading ${formatFileSize(clip.size)} clip instead of ${formatFileSize(selectedFile.size)}`);
+        } else {
+            formData.append('audio', selectedFile);
+        }
+        
         const response = await fetch('/predict', {
             method: 'POST',
             body: formData
@@ -145,7 +242,7 @@ predictBtn.addEventListener('click', async () => {
 
 function displayResults(data) {
     // Update main result
-    predictedAnimal.textContent = data.predicted_animal;
+    predictedAnimal.textContent = data.no_sound ? 'No sound detected' : data.predicted_animal;
     confidenceValue.textContent = data.confidence.toFixed(2) + '%';
     confidenceFill.style.width = data.confidence + '%';
     
@@ -0,0 +1,199 @@
+"""
+Synthetic Corpus - deterministic fake animal-sound dataset for offline scale tests
+Writes <Label>_<n>.wav clips (the naming extract_label expects) plus a matching
+sounds.csv, so steps 1, 2 and 4 and the web server can be exercised at any scale
+without the real dataset or network access.
+
+Every label gets its own frequency band and mix of sound types (harmonic tones,
+chirps, noise bursts), so a model can actually learn the classes. Clips vary in
+length, sample rate, channel count and WAV sample format, and a small share is
+silent to exercise the silence gate. Each clip is generated from its own seed
+(corpus seed + clip number), so the corpus is identical however many worker
+processes write it and whichever files already exist.
+
+Usage:
+    python synthetic_corpus.py --count 200000 --output synthetic_corpus --workers 8
+    python synthetic_corpus.py --count 1000 --labels Lion,Bear,Cat --output mini_project
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import numpy as np
+import argparse
+import csv
+import os
+import time
+
+# ========== CONFIGURATION ==========
+PROJECT_PATH = Path(r"C:\Users\sasik\OneDrive\Documents\AnimalVoicedetection")
+DEFAULT_OUTPUT = PROJECT_PATH / "synthetic_corpus"
+CSV_NAME = "sounds.csv"
+DEFAULT_COUNT = 1000
+DEFAULT_SEED = 0
+DEFAULT_LABELS = ('Bear', 'Bird', 'Cat', 'Cow', 'Dog', 'Elephant', 'Frog', 'Lion', 'Monkey', 'Sheep')
+
+SAMPLE_RATES = (8000, 16000, 22050, 44100, 48000)
+SAMPLE_RATE_WEIGHTS = (0.1, 0.25, 0.35, 0.2, 0.1)
+SUBTYPES = ('PCM_16', 'PCM_24', 'FLOAT')
+SUBTYPE_WEIGHTS = (0.7, 0.15, 0.15)
+STEREO_FRACTION = 0.2
+DURATION_RANGE = (0.5, 8.0)  # Seconds; log-uniform
+SILENT_FRACTION = 0.01
+SOUND_TYPES = ('tone', 'chirp', 'burst')
+LOW_HZ, HIGH_HZ = 80.0, 3500.0  # Span of the per-label base-frequency bands (kept under 8 kHz Nyquist)
+SFC_SET_ADD_PEAK_CHUNK = 0x1050  # libsndfile command (not wrapped by soundfile)
+CSV_COLUMNS = ['name', 'label', 'duration', 'sample_rate', 'channels', 'subtype', 'sound_type']
+
+def label_profile(label_index, num_labels):
+    """Per-label base-frequency band and sound-type mix (fixed for a given label count)"""
+    edges = np.geomspace(LOW_HZ, HIGH_HZ, num_labels + 1)
+    mix = np.roll([0.6, 0.25, 0.15], label_index % len(SOUND_TYPES))
+    return (edges[label_index], edges[label_index + 1]), mix
+
+def clip_spec(index, labels, seed):
+    """Name and format of clip number index (0-based); cheap, so existing files can be listed without synthesis"""
+    rng = np.random.default_rng([seed, index, 0])
+    label_index = index % len(labels)
+    band, mix = label_profile(label_index, len(labels))
+    silent = rng.random() < SILENT_FRACTION
+    return {
+        'name': f"{labels[label_index]}_{index // len(labels) + 1}.wav",
+        'label': labels[label_index],
+        'duration': round(float(np.exp(rng.uniform(*np.log(DURATION_RANGE)))), 3),
+        'sample_rate': int(rng.choice(SAMPLE_RATES, p=SAMPLE_RATE_WEIGHTS)),
+        'channels': 2 if rng.random() < STEREO_FRACTION else 1,
+        'subtype': str(rng.choice(SUBTYPES, p=SUBTYPE_WEIGHTS)),
+        'sound_type': 'silence' if silent else str(rng.choice(SOUND_TYPES, p=mix)),
+        'band': band
+    }
+
+def _envelope(n, rng):
+    """Random attack/decay amplitude envelope"""
+    attack = max(1, int(n * rng.uniform(0.01, 0.2)))
+    release = max(1, int(n * rng.uniform(0.1, 0.5)))
+    env = np.ones(n)
+    env[:attack] = np.linspace(0, 1, attack)
+    env[-release:] *= np.linspace(1, 0, release)
+    return env
+
+def synthesize(spec, seed, index):
+    """(samples, channels) float32 audio for a clip spec"""
+    rng = np.random.default_rng([seed, index, 1])
+    sr, channels = spec['sample_rate'], spec['channels']
+    n = max(1, int(spec['duration'] * sr))
+    t = np.arange(n) / sr
+    low, high = spec['band']
+    f0 = rng.uniform(low, high)
+
+    if spec['sound_type'] == 'silence':
+        y = np.zeros(n)
+    elif spec['sound_type'] == 'tone':
+        # Harmonic stack with vibrato
+        vibrato = 1 + 0.01 * np.sin(2 * np.pi * rng.uniform(3, 8) * t)
+        phase = 2 * np.pi * f0 * np.cumsum(vibrato) / sr
+        y = sum(np.sin(k * phase) / k for k in range(1, int(rng.integers(2, 6)) + 1))
+        y *= _envelope(n, rng)
+    elif spec['sound_type'] == 'chirp':
+        # Exponential sweep inside the label's band, repeated a few times
+        period = max(1, n // int(rng.integers(1, 5)))
+        position = np.arange(n) % period
+        local = position / sr
+        rate = np.log(rng.uniform(low, high) / f0) / max(period / sr, 1e-3)
+        phase = 2 * np.pi * f0 * (np.expm1(rate * local) / rate if abs(rate) > 1e-9 else local)
+        y = np.sin(phase) * np.hanning(period + 2)[1:-1][position]
+    else:
+        # Band-limited noise bursts: white noise through an FFT band mask, gated in bursts
+        spectrum = np.fft.rfft(rng.standard_normal(n))
+        freqs = np.fft.rfftfreq(n, 1 / sr)
+        spectrum[(freqs < low) | (freqs > high * 2)] = 0
+        y = np.fft.irfft(spectrum, n)
+        bursts = np.zeros(n)
+        for _ in range(int(rng.integers(1, 6))):
+            start = int(rng.integers(0, n))
+            length = int(rng.uniform(0.05, 0.5) * sr)
+            bursts[start:start + length] = 1
+        y *= np.convolve(bursts, np.hanning(max(3, sr // 100)), mode='same') / (sr // 200 + 1)
+
+    if spec['sound_type'] != 'silence':
+        y = y / (np.abs(y).max() + 1e-9) * 10 ** (rng.uniform(-30, -1) / 20)  # Peak level -30..-1 dBFS
+        y += rng.standard_normal(n) * 10 ** (rng.uniform(-80, -50) / 20)  # Background hiss
+    audio = np.repeat(y[:, np.newaxis], channels, axis=1)
+    if channels > 1:
+        audio[:, 1] *= rng.uniform(0.5, 1.0)  # Slightly different level per channel
+    return np.clip(audio, -1, 1).astype(np.float32)
+
+def write_clip(args):
+    """Worker: write clip index unless it already exists; returns its CSV row"""
+    import soundfile as sf
+
+    index, labels, seed, output, overwrite = args
+    spec = clip_spec(index, labels, seed)
+    path = Path(output) / spec['name']
+    if overwrite or not path.exists():
+        audio = synthesize(spec, seed, index)
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        with sf.SoundFile(tmp_path, 'w', spec['sample_rate'], spec['channels'], subtype=spec['subtype'],
+                          format='WAV') as f:
+            # Float WAVs get a PEAK chunk with a write timestamp; drop it so reruns are byte-identical
+            sf._snd.sf_command(f._file, SFC_SET_ADD_PEAK_CHUNK, sf._ffi.NULL, 0)
+            f.write(audio)
+        os.replace(tmp_path, path)
+    return {k: spec[k] for k in CSV_COLUMNS}
+
+def generate(output, count, labels=DEFAULT_LABELS, seed=DEFAULT_SEED, workers=None, overwrite=False,
+             chunksize=64):
+    """Write count clips and sounds.csv into output; returns the CSV path"""
+    from tqdm import tqdm
+
+    output = Path(output)
+    output.mkdir(parents=True, exist_ok=True)
+    csv_path = output / CSV_NAME
+    tasks = ((i, tuple(labels), seed, str(output), overwrite) for i in range(count))
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool, \
+            open(csv_path.with_name(CSV_NAME + ".tmp"), 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_COLUMNS)
+        writer.writeheader()
+        # map() keeps clip order, so sounds.csv is identical for any worker count
+        for row in tqdm(pool.map(write_clip, tasks, chunksize=chunksize), total=count, desc="Writing clips"):
+            writer.writerow(row)
+    os.replace(csv_path.with_name(CSV_NAME + ".tmp"), csv_path)
+    return csv_path
+
+def estimate_bytes(count, labels, seed, sample=2000):
+    """Approximate corpus size from the specs of a sample of clips"""
+    indices = np.linspace(0, count - 1, min(count, sample)).astype(int)
+    sizes = []
+    for i in indices:
+        spec = clip_spec(int(i), labels, seed)
+        width = {'PCM_16': 2, 'PCM_24': 3, 'FLOAT': 4}[spec['subtype']]
+        sizes.append(spec['duration'] * spec['sample_rate'] * spec['channels'] * width)
+    return float(np.mean(sizes)) * count
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a deterministic synthetic animal-sound corpus")
+    parser.add_argument('--output', type=Path, default=DEFAULT_OUTPUT, help="Folder for the clips and sounds.csv")
+    parser.add_argument('--count', type=int, default=DEFAULT_COUNT, help="Number of clips")
+    parser.add_argument('--labels', type=lambda s: [x for x in s.split(',') if x], default=list(DEFAULT_LABELS),
+                        help="Comma-separated class names")
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help="Corpus seed (same seed, same corpus)")
+    parser.add_argument('--workers', type=int, default=None, help="Writer processes (default: all cores)")
+    parser.add_argument('--overwrite', action='store_true', help="Rewrite clips that already exist")
+    args = parser.parse_args()
+
+    if any('_' in label for label in args.labels):
+        parser.error("labels must not contain '_' (the label is the filename part before the first '_')")
+
+    print("=" * 60)
+    print("SYNTHETIC CORPUS GENERATOR")
+    print("=" * 60)
+    print(f"📁 {args.count} clips, {len(args.labels)} labels, seed {args.seed} → {args.output}")
+    print(f"💾 Estimated size: {estimate_bytes(args.count, args.labels, args.seed) / 1e9:.2f} GB")
+
+    started = time.perf_counter()
+    csv_path = generate(args.output, args.count, args.labels, args.seed, args.workers, args.overwrite)
+    elapsed = time.perf_counter() - started
+    print(f"\n✅ {args.count} clips in {elapsed:.1f}s ({args.count / max(elapsed, 1e-9):.0f} clips/s)")
+    print(f"✅ Metadata: {csv_path}")
+
+if __name__ == "__main__":
+    main()
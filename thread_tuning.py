@@ -0,0 +1,319 @@
+"""
+Thread Tuning - measure and apply CPU parallelism settings for this machine
+TensorFlow's intra/inter-op thread pools, the OpenMP/BLAS threads used by
+librosa/numpy, and the preprocessing worker processes all compete for the same
+cores. This script runs the real serving pipeline (active-window load → mel →
+specshow render → model.predict) under different settings and saves the fastest
+ones to a profile:
+
+    latency     one clip at a time (web server, 3_predict.py)
+    throughput  many clips, batched (thread counts also used by 4_batch_predict.py,
+                which scores one file at a time and so runs at a different speed)
+
+app.py, 3_predict.py and 4_batch_predict.py call apply_thread_profile() before
+importing TensorFlow. Thread variables that are already set in the environment win.
+
+Usage:
+    python thread_tuning.py tune --audio-dir mini_project
+    python thread_tuning.py show
+"""
+
+from pathlib import Path
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+# ========== CONFIGURATION ==========
+PROJECT_PATH = Path(__file__).parent
+PROFILE_PATH = PROJECT_PATH / "trained_model" / "thread_profile.json"
+MODEL_PATH = PROJECT_PATH / "trained_model" / "best_model.h5"
+DEFAULT_AUDIO_FOLDER = PROJECT_PATH / "mini_project"
+OBJECTIVES = ('latency', 'throughput')
+DEFAULT_CLIPS = 32
+BATCH_SIZES = (1, 8, 32)
+TRIAL_TIMEOUT = 900
+
+# Audio parameters (must match training)
+PREPROCESS_PARAMS = {
+    'sample_rate': 22050,
+    'duration': 3,
+    'n_mels': 128,
+    'hop_length': 512,
+    'img_size': (128, 128)
+}
+
+# Environment variables each setting maps to (read by TensorFlow / the BLAS libraries at startup)
+THREAD_ENV = {
+    'intra_op_threads': ('TF_NUM_INTRAOP_THREADS',),
+    'inter_op_threads': ('TF_NUM_INTEROP_THREADS',),
+    'blas_threads': ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS')
+}
+
+def machine_fingerprint():
+    """Profiles are only valid on the hardware they were measured on"""
+    return {'cpu_count': os.cpu_count(), 'machine': platform.machine(), 'processor': platform.processor()}
+
+def load_profile(path=PROFILE_PATH):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def thread_env(settings):
+    """Settings dict -> environment variables"""
+    return {var: str(settings[key]) for key, names in THREAD_ENV.items() for var in names}
+
+def apply_thread_profile(objective, path=PROFILE_PATH):
+    """
+    Export the saved settings for objective ('latency' or 'throughput') as environment
+    variables; must run before TensorFlow is imported. Returns the settings, or None
+    when there is no profile for this machine.
+    """
+    profile = load_profile(path)
+    if profile is None or objective not in profile.get('objectives', {}):
+        return None
+    if profile.get('machine') != machine_fingerprint():
+        print(f"⚠️ Thread profile {path} was measured on different hardware; not applied")
+        return None
+    if 'tensorflow' in sys.modules:
+        print("⚠️ Thread profile applied after TensorFlow was imported; TF thread pools may ignore it")
+
+    settings = profile['objectives'][objective]
+    for var, value in thread_env(settings).items():
+        os.environ.setdefault(var, value)
+    return settings
+
+# ---------- Measurement (runs in a fresh process per setting) ----------
+
+def run_trial(settings, model_path, audio_files, batch_sizes):
+    """Time the serving pipeline in this process; settings are already in the environment"""
+    import numpy as np
+    import tensorflow as tf
+    from model_export import load_inference_model
+    from preprocess_pool import PreprocessPool, audio_to_image_array
+    from audio_gate import SilentAudioError
+
+    tf.config.threading.set_intra_op_parallelism_threads(settings['intra_op_threads'])
+    tf.config.threading.set_inter_op_parallelism_threads(settings['inter_op_threads'])
+    model = load_inference_model(model_path)
+    workers = settings['preprocess_workers']
+    pool = PreprocessPool(workers, PREPROCESS_PARAMS) if workers > 0 else None
+
+    def preprocess(path):
+        if pool is not None:
+            return pool.preprocess(path)
+        return audio_to_image_array(path, PREPROCESS_PARAMS)[np.newaxis]
+
+    def iter_inputs(paths):
+        if pool is not None:
+            yield from pool.iter_preprocessed(paths)
+            return
+        for path in paths:
+            try:
+                yield path, preprocess(path), None
+            except Exception as e:
+                yield path, None, e
+
+    # Warm-up: first decode, first render and one trace per batch size
+    sample = preprocess(audio_files[0])
+    for size in batch_sizes:
+        model.predict(np.repeat(sample, size, axis=0), verbose=0)
+
+    # Latency: one request at a time, preprocess + predict
+    latencies = []
+    for path in audio_files:
+        start = time.perf_counter()
+        try:
+            model.predict(preprocess(path), verbose=0)
+        except SilentAudioError:
+            continue
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    # Throughput: all clips streamed through preprocessing into batched predictions
+    throughput = {}
+    for size in batch_sizes:
+        start = time.perf_counter()
+        pending, scored = [], 0
+        for _, batch, error in iter_inputs(audio_files):
+            if error is not None:
+                continue
+            pending.append(batch)
+            if len(pending) >= size:
+                model.predict(np.concatenate(pending), verbose=0)
+                scored += len(pending)
+                pending = []
+        if pending:
+            model.predict(np.concatenate(pending), verbose=0)
+            scored += len(pending)
+        throughput[size] = scored / (time.perf_counter() - start)
+
+    if pool is not None:
+        pool.close()
+    best_batch = max(throughput, key=throughput.get)
+    return {
+        'latency_ms': float(np.median(latencies)) if latencies else None,
+        'clips_per_second': throughput[best_batch],
+        'batch_size': best_batch,
+        'throughput_by_batch': {str(k): v for k, v in throughput.items()}
+    }
+
+def measure(settings, model_path, files_list, batch_sizes):
+    """Run one trial in a subprocess, so TensorFlow and BLAS start with these thread counts"""
+    env = dict(os.environ, **thread_env(settings))
+    command = [sys.executable, str(Path(__file__).resolve()), '_trial', '--settings', json.dumps(settings),
+               '--model', str(model_path), '--files', str(files_list),
+               '--batch-sizes', ','.join(map(str, batch_sizes))]
+    proc = subprocess.run(command, env=env, capture_output=True, text=True, timeout=TRIAL_TIMEOUT)
+    lines = [line for line in proc.stdout.splitlines() if line.startswith('{')]
+    if proc.returncode != 0 or not lines:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "trial failed")
+    return json.loads(lines[-1])
+
+def format_speed(result):
+    """'12.3 ms/clip, 45.6 clips/s'; latency is None when every clip was silent"""
+    latency_ms = result['latency_ms']
+    latency = f"{latency_ms:.1f} ms/clip" if latency_ms is not None else "no latency (all clips silent)"
+    return f"{latency}, {result['clips_per_second']:.1f} clips/s"
+
+def candidate_counts(cores, values):
+    return sorted({min(max(1, v), cores) for v in values})
+
+def tune(audio_folder, model_path=MODEL_PATH, output_path=PROFILE_PATH, clips=DEFAULT_CLIPS,
+         batch_sizes=BATCH_SIZES):
+    """
+    Two-stage sweep: TensorFlow thread pools first (no preprocessing workers), then BLAS
+    threads x preprocessing workers around the best TF setting for each objective.
+    """
+    from dataset_index import load_index
+
+    audio_files = sorted(e.path for e in load_index(Path(audio_folder), probe=False).entries())[:clips]
+    if not audio_files:
+        raise FileNotFoundError(f"No audio files found in {audio_folder}")
+    cores = os.cpu_count() or 1
+    print(f"🖥️ {cores} CPU cores, {len(audio_files)} clips, batch sizes {list(batch_sizes)}")
+
+    trials = []
+    with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+        json.dump(audio_files, f)
+        files_list = f.name
+
+    def run(settings):
+        for trial in trials:
+            if trial['settings'] == settings:
+                return trial
+        label = ", ".join(f"{k}={v}" for k, v in settings.items())
+        try:
+            result = measure(settings, model_path, files_list, batch_sizes)
+        except Exception as e:
+            print(f"   ⚠️ {label}: {e}")
+            return None
+        trial = dict(result, settings=settings)
+        trials.append(trial)
+        print(f"   {label}: {format_speed(result)} (batch {result['batch_size']})")
+        return trial
+
+    def best(objective, candidates):
+        if objective == 'latency':
+            candidates = [t for t in candidates if t is not None and t['latency_ms'] is not None]
+            key = lambda t: t['latency_ms']
+        else:
+            candidates = [t for t in candidates if t is not None]
+            key = lambda t: -t['clips_per_second']
+        if not candidates:
+            raise RuntimeError(f"No successful trials for the {objective} profile "
+                               f"(see the warnings above); nothing was saved")
+        return min(candidates, key=key)
+
+    try:
+        print("\n🔧 Stage 1: TensorFlow thread pools")
+        stage1 = [run({'intra_op_threads': intra, 'inter_op_threads': inter,
+                       'blas_threads': 1, 'preprocess_workers': 0})
+                  for intra in candidate_counts(cores, [1, 2, cores // 2, cores])
+                  for inter in candidate_counts(cores, [1, 2])]
+
+        winners = {}
+        for objective in OBJECTIVES:
+            tf_settings = best(objective, stage1)['settings']
+            print(f"\n🔧 Stage 2 ({objective}): BLAS threads x preprocessing workers")
+            stage2 = [run(dict(tf_settings, blas_threads=blas, preprocess_workers=workers))
+                      for blas in candidate_counts(cores, [1, cores // 2])
+                      for workers in [0] + candidate_counts(cores, [1, cores // 2, cores - 1])]
+            winners[objective] = best(objective, stage1 + stage2)
+    finally:
+        os.unlink(files_list)
+
+    profile = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'machine': machine_fingerprint(),
+        'model': str(model_path),
+        'clips': len(audio_files),
+        'objectives': {
+            objective: dict(trial['settings'], batch_size=trial['batch_size'],
+                            latency_ms=trial['latency_ms'], clips_per_second=trial['clips_per_second'])
+            for objective, trial in winners.items()
+        },
+        'trials': trials
+    }
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump(profile, f, indent=4)
+    return profile
+
+def print_profile(profile):
+    print(f"Measured {profile['created_at']} on {profile['machine']['cpu_count']} cores "
+          f"({len(profile['trials'])} trials)")
+    for objective, s in profile['objectives'].items():
+        print(f"  {objective:<10} intra={s['intra_op_threads']} inter={s['inter_op_threads']} "
+              f"blas={s['blas_threads']} workers={s['preprocess_workers']} batch={s['batch_size']}  "
+              f"→ {format_speed(s)}")
+    print("  Measured on the pooled, batched pipeline (lookup-table render, fixed batch sizes).\n"
+          "  4_batch_predict.py scores one file at a time with its own spectrogram code, so its\n"
+          "  speed differs; the profile only sets its thread counts.")
+
+def main():
+    parser = argparse.ArgumentParser(description="Find and save the best CPU thread settings for inference")
+    sub = parser.add_subparsers(dest='command', required=True)
+    run = sub.add_parser('tune', help="Sweep thread settings and save the profile")
+    run.add_argument('--audio-dir', type=Path, default=DEFAULT_AUDIO_FOLDER, help="Representative audio clips")
+    run.add_argument('--model', type=Path, default=MODEL_PATH, help="Trained model")
+    run.add_argument('--clips', type=int, default=DEFAULT_CLIPS, help="Clips per trial")
+    run.add_argument('--output', type=Path, default=PROFILE_PATH, help="Profile to write")
+    show = sub.add_parser('show', help="Print the saved profile")
+    show.add_argument('--profile', type=Path, default=PROFILE_PATH)
+    trial = sub.add_parser('_trial')  # Internal: one measurement, run by tune in a fresh process
+    trial.add_argument('--settings', type=json.loads, required=True)
+    trial.add_argument('--model', type=Path, required=True)
+    trial.add_argument('--files', type=Path, required=True)
+    trial.add_argument('--batch-sizes', type=lambda s: [int(x) for x in s.split(',')], required=True)
+    args = parser.parse_args()
+
+    if args.command == '_trial':
+        with open(args.files, 'r') as f:
+            audio_files = json.load(f)
+        print(json.dumps(run_trial(args.settings, args.model, audio_files, args.batch_sizes)))
+    elif args.command == 'tune':
+        print("=" * 60)
+        print("THREAD TUNING")
+        print("=" * 60)
+        try:
+            profile = tune(args.audio_dir, args.model, args.output, args.clips)
+        except (FileNotFoundError, RuntimeError) as e:
+            print(f"\n❌ {e}")
+            return
+        print(f"\n✅ Profile saved to: {args.output}")
+        print_profile(profile)
+    else:
+        profile = load_profile(args.profile)
+        if profile is None:
+            print(f"No profile at {args.profile}; run 'python thread_tuning.py tune' first")
+            return
+        print_profile(profile)
+
+if __name__ == "__main__":
+    main()
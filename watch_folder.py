@@ -0,0 +1,350 @@
+"""
+Hot-Folder Watcher - classify audio files as they land in a folder tree
+Detects new or changed audio files (inotify on Linux, scandir polling elsewhere),
+waits until a file has stopped changing, scores ready files in micro-batches and
+appends the rows to the same results store as '4_batch_predict.py'. A file that
+changes is scored again; readers of the store use its latest row.
+
+A cursor (path -> size, mtime of the version that was scored) is persisted after
+every micro-batch, so a restart only picks up files that are new or changed.
+
+Usage:
+    python watch_folder.py path/to/recordings --output watch_predictions.csv
+"""
+
+from pathlib import Path
+import numpy as np
+import argparse
+import ctypes
+import ctypes.util
+import hashlib
+import json
+import os
+import select
+import struct
+import sys
+import time
+
+# ========== CONFIGURATION ==========
+PROJECT_PATH = Path(r"C:\Users\sasik\OneDrive\Documents\AnimalVoicedetection")
+MODEL_PATH = PROJECT_PATH / "trained_model" / "animal_sound_classifier.h5"
+CLASS_LABELS_PATH = PROJECT_PATH / "trained_model" / "class_labels.json"
+RESULTS_PATH = PROJECT_PATH / "watch_predictions.csv"
+STATE_DIR = PROJECT_PATH / "watch_state"  # Cursor and folder index, one subfolder per watched folder
+
+# Audio parameters (must match training)
+SAMPLE_RATE = 22050
+DURATION = 3
+N_MELS = 128
+HOP_LENGTH = 512
+IMG_SIZE = (128, 128)
+
+DEBOUNCE_SECONDS = 2.0  # A file must keep the same size and mtime this long before it is scored
+POLL_INTERVAL = 1.0  # Seconds between checks (and between scans in polling mode)
+DEEP_SCAN_EVERY = 60  # Polling mode: re-stat every file every N scans (catches in-place rewrites)
+MICRO_BATCH = 32  # Files scored per model call
+
+# ========== CHANGE DETECTION ==========
+# inotify constants from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, name length
+
+def walk_files(root, extensions):
+    """Relative posix paths of all matching files under root (one scandir walk)"""
+    stack = ['']
+    while stack:
+        rel_dir = stack.pop()
+        try:
+            with os.scandir(os.path.join(root, rel_dir)) as it:
+                for entry in it:
+                    rel = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(rel)
+                    elif entry.name.lower().endswith(extensions):
+                        yield rel
+        except FileNotFoundError:
+            continue
+
+class InotifyWatcher:
+    """Recursive inotify watch through libc (Linux only)"""
+
+    def __init__(self, root, extensions):
+        self.root = Path(root)
+        self.extensions = extensions
+        libc_name = ctypes.util.find_library('c')
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError("inotify is not available")
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.dirs = {}
+        self._watch_tree('')
+
+    def _watch_tree(self, rel_dir):
+        """Watch rel_dir and its subfolders; returns the files already inside them"""
+        found = []
+        stack = [rel_dir]
+        while stack:
+            current = stack.pop()
+            full = os.path.join(self.root, current) if current else str(self.root)
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(full), WATCH_MASK)
+            if wd < 0:
+                continue
+            self.dirs[wd] = current
+            try:
+                with os.scandir(full) as it:
+                    for entry in it:
+                        rel = f"{current}/{entry.name}" if current else entry.name
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(rel)
+                        elif entry.name.lower().endswith(self.extensions):
+                            found.append(rel)
+            except FileNotFoundError:
+                continue
+        return found
+
+    def changes(self, timeout):
+        """Relative paths that may have changed during the next timeout seconds"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        changed = set()
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, name_len = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + name_len].rstrip(b'\0'))
+            offset += name_len
+            if mask & IN_Q_OVERFLOW:
+                # Events were dropped: fall back to a full scan
+                changed.update(walk_files(self.root, self.extensions))
+                continue
+            rel_dir = self.dirs.get(wd)
+            if rel_dir is None or not name:
+                continue
+            rel = f"{rel_dir}/{name}" if rel_dir else name
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # Files can land in a new folder before its watch exists
+                    changed.update(self._watch_tree(rel))
+            elif name.lower().endswith(self.extensions):
+                changed.add(rel)
+        return changed
+
+class PollingWatcher:
+    """Portable fallback: incremental scandir index refreshed every poll"""
+
+    def __init__(self, root, extensions, manifest_path):
+        from dataset_index import DatasetIndex
+
+        self.index = DatasetIndex(root, extensions, probe=False, manifest_path=manifest_path)
+        self.scans = 0
+        self.seen = {}
+
+    def changes(self, timeout):
+        time.sleep(timeout)
+        self.scans += 1
+        self.index.refresh(deep=self.scans % DEEP_SCAN_EVERY == 0)
+        current = {rel: tuple(values[:2]) for rel, values in self.index.files.items()}
+        changed = {rel for rel, sig in current.items() if self.seen.get(rel) != sig}
+        self.seen = current
+        return changed
+
+def make_watcher(root, extensions, manifest_path, polling=False):
+    if not polling and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(root, extensions)
+        except OSError as e:
+            print(f"⚠️ inotify unavailable ({e}), polling instead")
+    return PollingWatcher(root, extensions, manifest_path)
+
+# ========== CURSOR ==========
+def state_dir_for(folder, state_root=STATE_DIR):
+    key = hashlib.sha1(str(Path(folder).resolve()).encode()).hexdigest()[:12]
+    return Path(state_root) / f"{Path(folder).name or 'root'}_{key}"
+
+def load_cursor(path):
+    if not path.exists():
+        return None
+    with open(path, 'r') as f:
+        return {rel: tuple(sig) for rel, sig in json.load(f).items()}
+
+def save_cursor(cursor, path):
+    """Write the cursor atomically"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump(cursor, f)
+    os.replace(tmp_path, path)
+
+def file_signature(path):
+    st = os.stat(path)
+    return (st.st_size, st.st_mtime_ns)
+
+# ========== SCORING ==========
+class MicroBatchScorer:
+    """Scores lists of files with one model call and appends the rows to the results store"""
+
+    def __init__(self, model, class_labels, writer):
+        self.model = model
+        self.class_labels = class_labels
+        self.class_names = [class_labels[str(i)] for i in range(len(class_labels))]
+        self.writer = writer
+        self.counts = {'scored': 0, 'silent': 0, 'failed': 0}
+
+    def row(self, path, predicted, confidence):
+        true_label = path.name.split('_')[0] if '_' in path.name else 'Unknown'
+        return {
+            'filename': path.name,
+            'filepath': str(path),
+            'true_label': true_label,
+            'predicted_label': predicted,
+            'confidence': confidence,
+            'correct': true_label.lower() == predicted.lower()
+        }
+
+    def score(self, paths):
+        from audio_gate import load_active_clip, SilentAudioError
+        from spectrogram_renderer import clip_to_model_input
+        from prediction_store import NO_SOUND_LABEL, ERROR_LABEL
+
+        inputs, loaded = [], []
+        for path in paths:
+            try:
+                y, sr = load_active_clip(path, SAMPLE_RATE, DURATION)
+                inputs.append(clip_to_model_input(y, sr, N_MELS, HOP_LENGTH, IMG_SIZE))
+                loaded.append(path)
+            except SilentAudioError:
+                self.writer.add(self.row(path, NO_SOUND_LABEL, 0.0), np.zeros(len(self.class_names)))
+                self.counts['silent'] += 1
+            except Exception as e:
+                # Stored like in 4_batch_predict.py, so the store says why the file has no prediction
+                print(f"❌ {path}: {e}")
+                self.writer.add(self.row(path, ERROR_LABEL, 0.0), np.zeros(len(self.class_names)))
+                self.counts['failed'] += 1
+
+        if inputs:
+            predictions = self.model.predict(np.stack(inputs), verbose=0)
+            for path, probabilities in zip(loaded, predictions):
+                idx = int(np.argmax(probabilities))
+                self.writer.add(self.row(path, self.class_names[idx], float(probabilities[idx]) * 100),
+                                probabilities * 100)
+            self.counts['scored'] += len(loaded)
+
+        # Rows must be durable before the cursor says these files are done
+        self.writer.flush()
+
+def watch(folder, model, class_labels, output_path=RESULTS_PATH, state_dir=None, polling=False,
+          debounce=DEBOUNCE_SECONDS, max_batches=None):
+    """Watch folder until interrupted (or until max_batches micro-batches have been scored)"""
+    from dataset_index import AUDIO_EXTENSIONS
+    from prediction_store import ResultWriter, scored_paths
+
+    folder = Path(folder)
+    state_dir = Path(state_dir) if state_dir else state_dir_for(folder)
+    cursor_path = state_dir / "cursor.json"
+
+    class_names = [class_labels[str(i)] for i in range(len(class_labels))]
+    writer = ResultWriter(output_path, class_names)
+    scorer = MicroBatchScorer(model, class_labels, writer)
+
+    cursor = load_cursor(cursor_path)
+    if cursor is None:
+        # First run: files already in the results store (e.g. from 4_batch_predict) count as scored
+        done = scored_paths(output_path)
+        cursor = {rel: file_signature(folder / rel) for rel in walk_files(folder, AUDIO_EXTENSIONS)
+                  if str(folder / rel) in done}
+        save_cursor(cursor, cursor_path)
+        print(f"🧭 New cursor: {len(cursor)} files already in {output_path}")
+    else:
+        print(f"🧭 Cursor loaded: {len(cursor)} files already scored")
+
+    watcher = make_watcher(folder, AUDIO_EXTENSIONS, state_dir / "index.json", polling)
+    print(f"👀 Watching {folder} ({type(watcher).__name__}), results -> {output_path}")
+
+    pending = {}  # rel -> (signature, monotonic time the signature was first seen)
+
+    def note(rel):
+        try:
+            sig = file_signature(folder / rel)
+        except FileNotFoundError:
+            pending.pop(rel, None)
+            return
+        if cursor.get(rel) == sig:
+            pending.pop(rel, None)
+        elif rel not in pending or pending[rel][0] != sig:
+            pending[rel] = (sig, time.monotonic())
+
+    for rel in walk_files(folder, AUDIO_EXTENSIONS):
+        note(rel)
+
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        for rel in watcher.changes(POLL_INTERVAL):
+            note(rel)
+        # Re-stat pending files directly: appends don't always produce events or index changes
+        for rel in list(pending):
+            note(rel)
+
+        now = time.monotonic()
+        ready = sorted(rel for rel, (_, seen) in pending.items() if now - seen >= debounce)
+        for start in range(0, len(ready), MICRO_BATCH):
+            chunk = ready[start:start + MICRO_BATCH]
+            scorer.score([folder / rel for rel in chunk])
+            for rel in chunk:
+                # Failed files are recorded too, so they are only retried once they change
+                cursor[rel] = pending.pop(rel)[0]
+            save_cursor(cursor, cursor_path)
+            batches += 1
+            counts = scorer.counts
+            print(f"✅ Batch of {len(chunk)}: {counts['scored']} scored, {counts['silent']} silent, "
+                  f"{counts['failed']} failed so far")
+
+    writer.close()
+    return scorer.counts
+
+def main():
+    parser = argparse.ArgumentParser(description="Classify audio files as they appear in a folder")
+    parser.add_argument('folder', type=Path, help="Folder to watch (recursively)")
+    parser.add_argument('--output', type=Path, default=RESULTS_PATH,
+                        help="Results store (.csv or .parquet), same format as 4_batch_predict.py")
+    parser.add_argument('--state', type=Path, default=None, help="Cursor/index folder (default: per-folder under watch_state/)")
+    parser.add_argument('--poll', action='store_true', help="Use scandir polling even where inotify is available")
+    parser.add_argument('--debounce', type=float, default=DEBOUNCE_SECONDS,
+                        help="Seconds a file must stay unchanged before it is scored")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("HOT-FOLDER WATCHER")
+    print("=" * 60)
+
+    if not args.folder.is_dir():
+        print(f"❌ Folder not found: {args.folder}")
+        return
+
+    from model_export import load_inference_model
+    model = load_inference_model(MODEL_PATH)
+    with open(CLASS_LABELS_PATH, 'r') as f:
+        class_labels = json.load(f)
+    print(f"✅ Model loaded with {len(class_labels)} classes")
+
+    try:
+        watch(args.folder, model, class_labels, args.output, args.state, args.poll, args.debounce)
+    except KeyboardInterrupt:
+        print("\n👋 Stopped")
+
+if __name__ == "__main__":
+    main()